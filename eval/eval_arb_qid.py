@@ -110,23 +110,26 @@ Received: 1.136 MiB in 8983 messages
             # preprocessing time
             logging.debug("FOUND motion line", ln)
 
-            preprocessing_line = evalinput[ln + 20]
+            # newer MOTION versions (and the secret sharing backend) print one more setup line
+            offset = 0 if PREPROCESSING_LINE_START in evalinput[ln + 20] else 1
+
+            preprocessing_line = evalinput[ln + 20 + offset]
             if not PREPROCESSING_LINE_START in preprocessing_line:
-                raise ValueError(f"Expected preprocessing line, found {preprocessing_line} [L. {ln + 20}]")
+                raise ValueError(f"Expected preprocessing line, found {preprocessing_line} [L. {ln + 20 + offset}]")
 
             preprocessing_time = float(preprocessing_line.split()[2])
 
             # circuit eval time
-            circuit_eval_line = evalinput[ln + 24]
+            circuit_eval_line = evalinput[ln + 24 + offset]
             if not CIRCUIT_EVAL_LINE_START in circuit_eval_line:
-                raise ValueError(f"Expected circuit eval line, found {circuit_eval_line} [L. {ln + 24}]")
+                raise ValueError(f"Expected circuit eval line, found {circuit_eval_line} [L. {ln + 24 + offset}]")
 
             circuit_eval_time = float(circuit_eval_line.split()[2])
 
             # data sent time
-            sent_line = evalinput[ln + 27]
+            sent_line = evalinput[ln + 27 + offset]
             if not DATA_SENT_LINE_START in sent_line:
-                raise ValueError(f"Expected sent line, found {sent_line} [L. {ln + 27}]")
+                raise ValueError(f"Expected sent line, found {sent_line} [L. {ln + 27 + offset}]")
 
             messages_sent = int(sent_line.split()[4].replace(".", ""))
             messages_sent_size = float(sent_line.split()[1])
@@ -140,10 +143,10 @@ Received: 1.136 MiB in 8983 messages
 
             motion_runs.append(run)
 
-            logging.debug("\n".join(evalinput[ln:ln+30]))
+            logging.debug("\n".join(evalinput[ln:ln + 30 + offset]))
             logging.debug(run)
 
-            ln += 30
+            ln += 30 + offset
         elif "Next best refinement" in current_line:
             number_of_rounds += 1
             ln += 1
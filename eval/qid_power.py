@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
+import sys
+
 import more_itertools
 
-# already successfully performed some eval runs? and then the machine went crazy? no worries...
-FIRST = "0"
+# already successfully performed some eval runs? and then the machine went crazy? no worries... (e.g. FIRST = "0,4")
+FIRST = None
 
 qids = [0, 4, 5, 6, 8, 9]
 result = list(more_itertools.powerset(qids))[1:]
+if "--descending" in sys.argv:
+    # larger QID sets first, so runs warm starting from earlier runs find a superset of their QIDs
+    result.reverse()
 results = list(map(lambda t: ",".join(map(str, t)), result))
-results = results[results.index(FIRST):]
+if FIRST is not None:
+    results = results[results.index(FIRST):]
 result_str = ' '.join(results)
 print(result_str)
@@ -7,8 +7,11 @@ for method in securesum motion ;
 do
   if [ $method == "securesum" ]; then
     path="../original"
+    transportarg=""
   else
     path="../ours"
+    # the network counters below only see ring messages sent via TCP
+    transportarg="--transport tcp"
   fi
   
   venvpath="../venv/bin/activate"
@@ -19,6 +22,11 @@ do
 
   for dataset in medical adult ;
   do
+    if [ $method == "motion" ]; then
+      # all boxes map the same snapshot instead of parsing the whole CSV file each
+      python $path/create_snapshot.py --dataset $dataset > /dev/null
+    fi
+
     for ((p=2; p<=$max_number_of_parties; p++))
     do
       for ((r=1; r<=$runs; r++))
@@ -31,12 +39,12 @@ do
         for ((i=1; i<=p; i++))
         do
           echo "[sh] Starting $i..."
-          python $boxpath $i $p --dataset $dataset > /dev/null &
+          python $boxpath $i $p --dataset $dataset $transportarg > /dev/null &
         done
 
         echo "[sh] Starting central..."
         python -c "import psutil,sys;network=psutil.net_io_counters(pernic=True);sys.stdout.write('NETWORK BEFORE: ' + str(network) + '\n');" >> $logfile
-        python $centralpath --number_of_boxes $p --dataset $dataset | tee -a $logfile
+        python $centralpath --number_of_boxes $p --dataset $dataset $transportarg | tee -a $logfile
         python -c "import psutil,sys;network=psutil.net_io_counters(pernic=True);sys.stdout.write('NETWORK AFTER: ' + str(network) + '\n');" >> $logfile
       done
     done
@@ -1,16 +1,31 @@
 #!/bin/bash
 
 number_of_parties=3
+# WARM_START=1 lets each run of ours warm start from the specializations of the previous runs, which start with the
+# larger QID sets
+warm_start=${WARM_START:-0}
 
 source venv/bin/activate
-use_qids=$(python qid_power.py)
+if [ $warm_start == 1 ]; then
+	use_qids=$(python qid_power.py --descending)
+else
+	use_qids=$(python qid_power.py)
+fi
+started=$(date +%Y%m%d_%H%M%S)
 
 for method in motion securesum ;
 do
 	if [ $method == "securesum" ]; then
 		path="../original"
+		transportarg=""
 	else
 		path="../ours"
+		# the network counters below only see ring messages sent via TCP
+		transportarg="--transport tcp"
+	fi
+	warmstartarg=""
+	if [ $method == "motion" ] && [ $warm_start == 1 ]; then
+		warmstartarg="--warm_start_file data/runs_arb_qid_$method/specializations-$started.json"
 	fi
 	
 	venvpath="../venv/bin/activate"
@@ -19,6 +34,11 @@ do
 
 	source $venvpath
 
+	if [ $method == "motion" ]; then
+		# all boxes map the same snapshot instead of parsing the whole CSV file each
+		python $path/create_snapshot.py --dataset adult > /dev/null
+	fi
+
 	for qid in $use_qids ;
 	do
 		now=$(date +%Y%m%d_%H%M%S)
@@ -29,13 +49,13 @@ do
 		for ((i=1; i<=$number_of_parties; i++))
 		do
 			echo "Starting $i..."
-			python $boxpath $i $number_of_parties --dataset adult > /dev/null &
+			python $boxpath $i $number_of_parties --dataset adult $transportarg > /dev/null &
 		done
 
 		echo "Starting central..."
 		python -c "import psutil,sys;network=psutil.net_io_counters(pernic=True);sys.stdout.write('NETWORK BEFORE: ' + str(network) + '\n');" >> $logfile
 
-		python $centralpath --number_of_boxes $number_of_parties --dataset adult --used_qids $qid | tee -a $logfile
+		python $centralpath --number_of_boxes $number_of_parties --dataset adult --used_qids $qid $transportarg $warmstartarg | tee -a $logfile
 
 		python -c "import psutil,sys;network=psutil.net_io_counters(pernic=True);sys.stdout.write('NETWORK AFTER: ' + str(network) + '\n');" >> $logfile
 	done
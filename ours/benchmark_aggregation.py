@@ -0,0 +1,57 @@
+"""
+Benchmark the secret sharing backend for the secure computations (see src/secret_sharing.py).
+All parties perform a number of calls with random inputs in one session, the statistics of the output party (the
+central) are printed in the shape of the MOTION statistics.
+"""
+import argparse
+from multiprocessing import Process
+from random import Random
+
+from src.secret_sharing import SecretSharingBackend, format_statistics
+
+MOTION_PORT = 6452
+DEFAULT_K = 5
+
+
+def _inputs(party_id: int, number_of_groups: int, group_size: int) -> list:
+    random = Random(party_id)
+    return [[random.randint(0, 10) for _ in range(group_size)] for _ in range(number_of_groups)]
+
+
+def _run_party(backend: SecretSharingBackend, parties: list, party_id: int, number_of_groups: int, group_size: int,
+               repetitions: int, preprocess: bool):
+    session = backend.open_session(parties, party_id)
+    inputs = _inputs(party_id, number_of_groups, group_size)
+    for _ in range(repetitions):
+        if preprocess:
+            session.preprocess(number_of_groups, number_of_groups * group_size)
+        session.perform_arithmetic_then_bool_with_groups(inputs, DEFAULT_K if party_id == 0 else 0)
+    session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number_of_boxes', type=int, help='Number of boxes, the central is added.', default=3)
+    parser.add_argument('--number_of_groups', type=int, help='Number of counter groups per call.', default=100)
+    parser.add_argument('--group_size', type=int, help='Number of counters per group.', default=5)
+    parser.add_argument('--repetitions', type=int, help='Number of calls.', default=10)
+    parser.add_argument('--preprocess', help='Generate the random shares before each call, like the protocol does between rounds', default=False, action=argparse.BooleanOptionalAction)
+    args = parser.parse_args()
+
+    parties = [(i, "127.0.0.1", MOTION_PORT + i) for i in range(args.number_of_boxes + 1)]
+    party_args = (args.number_of_groups, args.group_size, args.repetitions, args.preprocess)
+
+    # boxes run as processes communicating via sockets, only the statistics of the central are printed
+    box_processes = [Process(target=_run_party, args=(SecretSharingBackend(), parties, i) + party_args) for i in range(1, len(parties))]
+    for p in box_processes:
+        p.start()
+    backend = SecretSharingBackend()
+    _run_party(backend, parties, 0, *party_args)
+    for p in box_processes:
+        p.join()
+
+    print(format_statistics(backend.statistics[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark the throughput of the ring transports between two processes on this host.
+A receiver process receives a number of messages of a given size, the sender measures the time until it got all
+messages back (ping-pong), so each message passes the transport twice.
+"""
+import argparse
+import os
+from multiprocessing import Process
+from timeit import default_timer as timer
+
+from src.communication import SocketTransport, UnixSocketTransport, Transport, LOCALHOST
+
+
+SENDER_PORT = 6442
+RECEIVER_PORT = 6443
+DEFAULT_PAYLOAD_SIZES = [1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+
+TRANSPORTS_TO_BENCHMARK = {
+    "tcp": lambda: SocketTransport(),
+    "unix": lambda: UnixSocketTransport(shared_memory_threshold=None),
+    "unix+shm": lambda: UnixSocketTransport(),
+}
+
+
+def _echo(transport_name: str, repetitions: int):
+    transport: Transport = TRANSPORTS_TO_BENCHMARK[transport_name]()
+    for _ in range(repetitions + 1):  # including warm-up message
+        data = transport.receive_data(LOCALHOST, RECEIVER_PORT)
+        transport.send_data_to_other_party(data, LOCALHOST, SENDER_PORT)
+
+
+def benchmark(transport_name: str, payload_size: int, repetitions: int) -> float:
+    """
+    :return: the throughput in MiB/s
+    """
+    transport: Transport = TRANSPORTS_TO_BENCHMARK[transport_name]()
+    data = {"payload": os.urandom(payload_size)}
+
+    echo_process = Process(target=_echo, args=(transport_name, repetitions))
+    echo_process.start()
+
+    # warm-up, so the process start is not measured
+    transport.send_data_to_other_party(data, LOCALHOST, RECEIVER_PORT)
+    transport.receive_data(LOCALHOST, SENDER_PORT)
+
+    start = timer()
+    for _ in range(repetitions):
+        transport.send_data_to_other_party(data, LOCALHOST, RECEIVER_PORT)
+        transport.receive_data(LOCALHOST, SENDER_PORT)
+    end = timer()
+
+    echo_process.join()
+    return 2 * repetitions * payload_size / (end - start) / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repetitions', type=int, help='Number of ping-pong messages per transport and size.', default=10)
+    parser.add_argument('--sizes', help='Comma-separated list of payload sizes in bytes.')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else DEFAULT_PAYLOAD_SIZES
+
+    print("{:>12} ".format("bytes") + " ".join("{:>14}".format(name) for name in TRANSPORTS_TO_BENCHMARK))
+    for size in sizes:
+        results = [benchmark(name, size, args.repetitions) for name in TRANSPORTS_TO_BENCHMARK]
+        print("{:>12} ".format(size) + " ".join("{:>9.1f} MiB/s".format(r) for r in results), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Convert a data set once to a typed columnar snapshot (see src/snapshot.py), which run_box.py and run_local.py load
+instead of parsing the CSV file, as long as the CSV file is unchanged.
+"""
+import argparse
+
+import adult_data
+import medical_data
+from src.snapshot import write_snapshot, verify_snapshot, snapshot_metadata, CHUNK_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', help='The data set to be converted ([medical]/adult).', choices=["adult", "medical"], default="medical")
+    parser.add_argument('--chunk_size', type=int, help='The number of rows parsed at once, which bounds the memory used.', default=CHUNK_SIZE)
+
+    args = parser.parse_args()
+
+    datapath = medical_data.DATA_PATH if args.dataset == "medical" else adult_data.DATA_PATH
+    attribute_trees = medical_data.attribute_trees if args.dataset == "medical" else adult_data.attribute_trees
+    path = write_snapshot(datapath, attribute_trees, args.chunk_size)
+    verify_snapshot(path)
+
+    metadata = snapshot_metadata(path)
+    print("written snapshot " + path)
+    print(f"{metadata['number_of_rows']} rows, {metadata['number_of_dropped_rows']} dropped because of missing values {metadata['missing_values']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,70 +3,16 @@ Run a box via terminal.
 Currently this uses simple communication via sockets and data pickling and a fixed data set.
 """
 import argparse
-import pickle
+import threading
 
 import adult_data
 import medical_data
-from src.box import Box
-from src.communication import receive_data
-from src.constants import DATA_ROWS, REQUEST_TYPE, QID_ATTRIBUTE_TREES, \
-    CRITERIA, CENTRAL_PK, INFO, RequestType, PARTIES, BEST_ATTRIBUTE_INDEX, BEST_LABEL
-from src.data_utils import read_csv_data
-
-
-def answer_request(box_data, box_data_categories, box_id: int, box_host: str, box_ring_port: int):
-    """
-    Perform the required steps in the distributed algorithm to compute a request result.
-
-    :param box_data: the local data
-    :param box_data_categories: categories in the local data
-    :param box_id: the box id
-    :param box_ring_port: the box port for ring communication
-    :param box_host: the box host
-    :return:
-    """
-
-    # wait for connections
-    request_from_predecessor = receive_data(box_host, box_ring_port)
-
-    # data = {REQUEST_TYPE: RequestType.INFORMATION,
-    #         CRITERIA: criteria_list,
-    #         INFO: counter_link_heads_init,
-    #         QID_ATTRIBUTE_TREES: qid_attribute_trees,
-    #         CENTRAL_PK: pickle.dumps(public_key)}
-
-    central_pk = pickle.loads(request_from_predecessor[CENTRAL_PK])
-    criteria = request_from_predecessor[CRITERIA]
-    qid_trees = request_from_predecessor[QID_ATTRIBUTE_TREES]
-    counter_information_data = request_from_predecessor[INFO]
-    parties = request_from_predecessor[PARTIES]
-
-    b = Box(box_data_categories, box_data, criteria, central_pk, qid_trees, box_id, parties)
-    b.perform_initial_round(counter_information_data)
-
-    while True:
-        request_from_predecessor = receive_data(box_host, box_ring_port)
-
-        # data = {REQUEST_TYPE: RequestType.INSTRUCTION,
-        #         INFO: extracted_counter_nodes,
-        #         BEST_REFINEMENTS: best_refinements}
-
-        # data = {REQUEST_TYPE: RequestType.END,
-        #         DATA_ROWS: encrypted_rows}
-
-        if request_from_predecessor[REQUEST_TYPE] == RequestType.INSTRUCTION:
-            best_attr_index = request_from_predecessor[BEST_ATTRIBUTE_INDEX]
-            best_gen_label = request_from_predecessor[BEST_LABEL]
-            counter_information_data = request_from_predecessor[INFO]
-
-            b.perform_regular_round(best_attr_index, best_gen_label, counter_information_data)
-        elif request_from_predecessor[REQUEST_TYPE] == RequestType.END:
-            data_rows = request_from_predecessor[DATA_ROWS]
-
-            b.perform_secure_data_union_action(data_rows)
-            break
-        else:
-            raise Exception("Unexpected request type: {}".format(request_from_predecessor[REQUEST_TYPE]))
+from src.box import serve_requests
+from src.box_data import BoxData, follow_append_file, DEFAULT_APPEND_POLL_INTERVAL
+from src.communication import TRANSPORTS
+from src.criteria import CriteriaIndex
+from src.secret_sharing import SecretSharingBackend
+from src.snapshot import read_data, read_data_leaf_codes
 
 
 def main():
@@ -77,6 +23,14 @@ def main():
     parser.add_argument('--ringport', type=int, help='The box port for ring communication.')
     parser.add_argument('--motionport', type=int, help='The box port for MOTION communication.')
     parser.add_argument('--dataset', help='The data set to be used ([medical]/adult).', choices=["adult", "medical"], default="medical")
+    parser.add_argument('--rows', help='The rows of the data set used by the box as START:STOP, instead of the partition given by boxid and number_of_boxes.')
+    parser.add_argument('--row_indices', help='A file with the indices of the rows of the data set used by the box, one per line, instead of the partition given by boxid and number_of_boxes.')
+    parser.add_argument('--transport', help='The transport used for ring communication ([auto]/tcp/unix). auto uses Unix domain sockets for loopback addresses. All parties must use the same transport.', choices=list(TRANSPORTS), default="auto")
+    parser.add_argument('--aggregation', help='The backend for the secure computations ([motion]/secret-sharing). secret-sharing is a pure Python stand-in for testing and profiling without MOTION.', choices=["motion", "secret-sharing"], default="motion")
+    parser.add_argument('--requests', type=int, help='The number of requests to answer before exiting, 0 keeps serving requests (daemon mode). Concurrent requests are processed side by side.', default=1)
+    parser.add_argument('--append_file', help='A CSV file without header, whose records are appended to the data of the box while it is running, including the records written to it later. Requests starting afterwards include them, requests with the criteria and QIDs of an earlier request warm start from its TIPS tree.')
+    parser.add_argument('--append_interval', type=float, help='Seconds between checking --append_file for new records.', default=DEFAULT_APPEND_POLL_INTERVAL)
+    parser.add_argument('--crypto_workers', type=int, help='The number of processes encrypting the result rows in parallel.', default=1)
 
     args = parser.parse_args()
 
@@ -89,14 +43,31 @@ def main():
     print("reading data...")
 
     datapath = medical_data.DATA_PATH if args.dataset == "medical" else adult_data.DATA_PATH
-    data_categories, all_data = read_csv_data(datapath)
-    box_data_range = len(all_data) // args.number_of_boxes
-    box_data = all_data[(box_id - 1) * box_data_range:box_id * box_data_range]
+    # uses the snapshot of the data set, if there is an up-to-date one (see create_snapshot.py)
+    if args.rows:
+        start, stop = args.rows.split(":")
+        selection = {"row_range": (int(start), int(stop))}
+    elif args.row_indices:
+        with open(args.row_indices) as f:
+            selection = {"row_indices": [int(line) for line in f if line.strip()]}
+    else:
+        selection = {"partition": (box_id - 1, args.number_of_boxes)}
+    data_categories, box_data = read_data(datapath, **selection)
+    leaf_codes = read_data_leaf_codes(datapath, **selection)
+    # built once for all requests, so no request pays for it
+    criteria_index = CriteriaIndex(data_categories, box_data)
+    criteria_index.build()
 
     print("finished reading data.")
     print("\nWaiting for requests on port " + str(box_ring_port) + "\n")
 
-    answer_request(box_data, data_categories, box_id, box_host, box_ring_port)
+    data = BoxData(data_categories, box_data, criteria_index, leaf_codes=leaf_codes)
+    if args.append_file:
+        threading.Thread(target=follow_append_file, args=(data, args.append_file, args.append_interval), daemon=True).start()
+
+    motion_backend = SecretSharingBackend(print_statistics=True) if args.aggregation == "secret-sharing" else None
+    serve_requests(data, box_id, box_host, box_ring_port, TRANSPORTS[args.transport](),
+                   motion_backend, args.crypto_workers, args.requests if args.requests > 0 else None)
 
 
 if __name__ == "__main__":
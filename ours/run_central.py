@@ -5,17 +5,21 @@ Currently this uses simple communication via sockets and data pickling and fixed
 import argparse
 import json
 from operator import itemgetter
-from typing import Any, List
 from timeit import default_timer as timer
 from datetime import timedelta
 
 import adult_data
 import medical_data
-from src.motion import Party
-from src.central import Central
-from src.communication import receive_data
-from src.constants import DATA_ROWS, INFO
-from src.counter_information_data import CounterInformationData
+from src.motion import Party, default_number_of_shards
+from src.central import Central, perform_request
+from src.central_service import CentralService, AnonymizationRequest, AdmissionError, DEFAULT_MAX_CONCURRENT_REQUESTS, \
+    DEFAULT_MAX_QUEUED_REQUESTS, DEFAULT_RESULT_TTL
+from src.communication import TRANSPORTS
+from src.crypto import ROW_ENCRYPTIONS, ROW_ENCRYPTION_SEALED
+from src.data_utils import ROW_AGGREGATIONS, ROW_AGGREGATION_NONE
+from src.row_codec import ROW_CODECS, ROW_CODEC_COMPACT
+from src.secret_sharing import SecretSharingBackend
+from src.specialization_store import SpecializationStore
 
 
 DEFAULT_K = 5
@@ -44,42 +48,21 @@ def ask_for_criteria():
     return temp_criteria_list
 
 
-def run_request(k: int, criteria_list: List, parties, central_host, central_ring_port, central_motion_port, qid_attribute_trees) -> List[List[Any]]:
+def read_requests(path, all_qid_attribute_trees, default_k):
     """
-    Perform the required steps in the distributed algorithm to compute a request result.
-
-    :param k: the parameter for the anonymity metric
-    :param criteria_list: criteria for the request
-    :param : TODO
-    :return: the anonymized result data
+    Read the requests of a file with one JSON object per line, e.g., {"k": 10, "criteria": [["Age", "<", "65"]], "qids": [1, 2]}.
+    All keys are optional, the defaults are the anonymity parameter, no criteria and all QIDs.
     """
-    c = Central(k, qid_attribute_trees, criteria_list, parties, central_host, central_ring_port, central_motion_port)
-
-    # run initial round
-    c.start_initial_round()
-
-    response = receive_data(central_host, central_ring_port)
-    counter_information: CounterInformationData = response[INFO]
-
-    c.complete_round(counter_information)
-
-    # perform rounds as long as further refinements are possible
-    while c.can_perform_round():
-        c.start_round()
-
-        response = receive_data(central_host, central_ring_port)
-        blinded_counter_information: CounterInformationData = response[INFO]
-
-        c.complete_round(blinded_counter_information)
-
-    # final secure set union
-    c.start_secure_data_union()
-
-    response = receive_data(central_host, central_ring_port)
-    encrypted_result = response[DATA_ROWS]
-
-    anonymized_result = c.complete_secure_data_union(encrypted_result)
-    return anonymized_result
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            qids = request.get("qids", list(all_qid_attribute_trees))
+            requests.append(AnonymizationRequest(request.get("k", default_k), request.get("criteria", []),
+                                                 {qid: all_qid_attribute_trees[qid] for qid in qids}))
+    return requests
 
 
 def print_results(data_rows):
@@ -100,11 +83,26 @@ def main():
     parser.add_argument('--dataset', help='The data set to be used ([medical]/adult).', choices=["adult", "medical"], default="medical")
     parser.add_argument('--print_output', help='Print the final protocol output', default=False, action=argparse.BooleanOptionalAction)
     parser.add_argument('--used_qids', help='Comma-separated list, can be used to restrict the used QIDs.')
+    parser.add_argument('--transport', help='The transport used for ring communication ([auto]/tcp/unix). auto uses Unix domain sockets for loopback addresses. All parties must use the same transport.', choices=list(TRANSPORTS), default="auto")
+    parser.add_argument('--aggregation', help='The backend for the secure computations ([motion]/secret-sharing). secret-sharing is a pure Python stand-in for testing and profiling without MOTION.', choices=["motion", "secret-sharing"], default="motion")
+    parser.add_argument('--motion_shards', help='The maximum number of concurrent MOTION sessions per round, an integer or auto for one per core. Large rounds are split into shards, shard i uses the MOTION ports plus i * 1000. Reduced to the number of shards with ports up to 65535.', default="1")
+    parser.add_argument('--row_encryption', help='How the result rows are encrypted for the central ([sealed]/hybrid). hybrid performs one key agreement per party instead of one per row, but lets the central learn which rows come from the same box.', choices=ROW_ENCRYPTIONS, default=ROW_ENCRYPTION_SEALED)
+    parser.add_argument('--row_codec', help='How the result rows are encoded before encryption (pickle/[compact]). compact encodes generalization labels as ids in the QID trees and packs numbers, which roughly halves the encrypted result.', choices=ROW_CODECS, default=ROW_CODEC_COMPACT)
+    parser.add_argument('--row_aggregation', help='Whether identical result rows are encrypted once with their multiplicity ([none]/expanded/weighted). weighted returns the rows with their multiplicity as last column. Lets the central learn which identical rows come from the same box.', choices=ROW_AGGREGATIONS, default=ROW_AGGREGATION_NONE)
+    parser.add_argument('--crypto_workers', type=int, help='The number of processes encrypting/decrypting the result rows in parallel.', default=1)
+    parser.add_argument('--requests_file', help='A file with one request per line (JSON with the optional keys k, criteria and qids), which are performed concurrently instead of a single request. The boxes must serve at least as many requests (--requests of run_box.py).')
+    parser.add_argument('--max_concurrent_requests', type=int, help=f'The number of requests of --requests_file performed side by side. Slot i uses the central ring port plus i * {CentralService.RING_PORT_STRIDE} and all MOTION ports plus i * 1000 * motion_shards.', default=DEFAULT_MAX_CONCURRENT_REQUESTS)
+    parser.add_argument('--max_queued_requests', type=int, help='The number of further requests of --requests_file waiting for a slot, further requests are rejected.', default=DEFAULT_MAX_QUEUED_REQUESTS)
+    parser.add_argument('--result_cache_mib', type=int, help='The size of the cache of the results of --requests_file in MiB, 0 disables the cache. Identical requests return the cached result if the data of no box changed, otherwise they warm start from its specialization. The boxes must run with --requests 0, since cached results do not reach them.', default=0)
+    parser.add_argument('--result_ttl', type=float, help='Seconds a result is cached.', default=DEFAULT_RESULT_TTL)
+    parser.add_argument('--warm_start_file', help='A JSON file with the specializations of earlier requests. The request (or each request of --requests_file) warm starts from the specialization of an earlier request with the same criteria and a superset of its QIDs, e.g., of the previous run of a sweep over k or QID subsets, and adds its own specialization. Created if it does not exist.')
+    parser.add_argument('--box_motion_port_offset', type=int, help='Shifts the MOTION ports of all boxes, which they take from each request. Centrals performing requests on the same boxes at the same time must use disjoint box MOTION ports (including those of the shards and slots), otherwise their MOTION sessions collide.', default=0)
+    parser.add_argument('--max_records_per_box', type=int, help='A public upper bound for the number of records of each box. If set, the secure computation only uses the required bit width.')
     args = parser.parse_args()
 
     number_of_boxes = args.number_of_boxes
     # TODO this sets the default address and ports for all boxes, changes are not possible atm
-    parties = [Party(i, "127.0.0.1", 4442 + i, 5442 + i) for i in range(1, number_of_boxes + 1)]
+    parties = [Party(i, "127.0.0.1", 4442 + i, 5442 + i + args.box_motion_port_offset) for i in range(1, number_of_boxes + 1)]
 
     central_host = args.address
     central_ring_port = args.ringport
@@ -132,12 +130,33 @@ def main():
     if args.interactive_criteria:
         criteria_list = ask_for_criteria()
     
+    motion_backend = SecretSharingBackend(print_statistics=True) if args.aggregation == "secret-sharing" else None
+    number_of_motion_shards = default_number_of_shards() if args.motion_shards == "auto" else int(args.motion_shards)
+
+    if args.requests_file:
+        serve_requests_file(args, parties, central_host, central_ring_port, central_motion_port, all_qid_attribute_trees, k,
+                            motion_backend, number_of_motion_shards)
+        return
+
+    specialization_store = SpecializationStore(args.warm_start_file) if args.warm_start_file else None
+    specialization = specialization_store.related_specialization(k, criteria_list, used_qid_attribute_trees) if specialization_store else None
+    if specialization:
+        print(f"Warm start from {len(specialization)} refinements of an earlier request", flush=True)
+
     start = timer()
 
-    anonymized_result = run_request(k, criteria_list, parties, central_host, central_ring_port, central_motion_port, used_qid_attribute_trees)
+    transport = TRANSPORTS[args.transport]()
+    c = Central(k, used_qid_attribute_trees, criteria_list, parties, central_host, central_ring_port, central_motion_port, transport,
+                motion_backend, args.max_records_per_box, number_of_motion_shards, row_encryption=args.row_encryption,
+                number_of_crypto_workers=args.crypto_workers, row_codec=args.row_codec, row_aggregation=args.row_aggregation,
+                specialization=specialization)
+    anonymized_result = perform_request(c, transport, central_host, central_ring_port)
 
     end = timer()
 
+    if specialization_store:
+        specialization_store.add(k, criteria_list, used_qid_attribute_trees, c.specialization)
+
     print(f"FINISHED - time elapsed [{timedelta(seconds=end-start)}]")
 
     if args.print_output:
@@ -145,5 +164,34 @@ def main():
         print_results(sorted_anon_result)
 
 
+def serve_requests_file(args, parties, central_host, central_ring_port, central_motion_port, all_qid_attribute_trees, k,
+                        motion_backend, number_of_motion_shards):
+    requests = read_requests(args.requests_file, all_qid_attribute_trees, k)
+    service = CentralService(parties, central_host, central_ring_port, central_motion_port, TRANSPORTS[args.transport](), motion_backend,
+                             number_of_motion_shards, args.max_concurrent_requests, args.max_queued_requests,
+                             args.result_cache_mib * 2 ** 20, args.result_ttl,
+                             SpecializationStore(args.warm_start_file) if args.warm_start_file else None,
+                             max_records_per_box=args.max_records_per_box, row_encryption=args.row_encryption,
+                             number_of_crypto_workers=args.crypto_workers, row_codec=args.row_codec, row_aggregation=args.row_aggregation)
+    futures = []
+    for i, request in enumerate(requests):
+        try:
+            futures.append(service.submit(request))
+        except AdmissionError as e:
+            print(f"REJECTED request {i}: {e}", flush=True)
+            futures.append(None)
+    for i, (request, future) in enumerate(zip(requests, futures)):
+        if future is None:
+            continue
+        anonymized_result = future.result()
+        source = " (cached)" if request.cached_result else " (warm start)" if request.warm_started else ""
+        print(f"FINISHED request {i}{source} [k: {request.k}, criteria: {request.criteria_list}, QIDs: {list(request.qid_attribute_trees)}] - "
+              f"latency [{timedelta(seconds=request.end_time - request.submission_time)}]", flush=True)
+        if args.print_output:
+            print_results(sorted(anonymized_result, key=itemgetter(1)))
+    service.close()
+    print(f"Central service: {service}")
+
+
 if __name__ == "__main__":
     main()
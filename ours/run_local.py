@@ -0,0 +1,121 @@
+"""
+Run the central unit and all boxes within one process via terminal.
+Parties run as threads, communicate via in-process queues and use a stand-in for MOTION (either a plain computation
+without any security or additive secret sharing), so this is meant for profiling and quick scaling experiments, not
+for productive use.
+"""
+import argparse
+import cProfile
+import pstats
+
+import adult_data
+import medical_data
+from src.algorithm_utils import AlgorithmRunner
+from src.crypto import ROW_ENCRYPTIONS, ROW_ENCRYPTION_SEALED
+from src.row_codec import ROW_CODECS, ROW_CODEC_COMPACT
+from src.data_utils import ROW_AGGREGATIONS, ROW_AGGREGATION_NONE
+from src.local_motion import LocalMotion
+from src.motion import default_number_of_shards
+from src.network_emulation import LinkProfile, NetworkEmulation
+from src.secret_sharing import SecretSharingBackend, format_statistics
+from src.snapshot import read_data
+
+
+DEFAULT_K = 5
+DEFAULT_NUMBER_OF_BOXES = 3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number_of_boxes', type=int, help='Number of participating boxes.', default=DEFAULT_NUMBER_OF_BOXES)
+    parser.add_argument('--anonymity_parameter', type=int, help='The anonymity parameter k of k-anonymity.', default=DEFAULT_K)
+    parser.add_argument('--dataset', help='The data set to be used ([medical]/adult).', choices=["adult", "medical"], default="medical")
+    parser.add_argument('--used_qids', help='Comma-separated list, can be used to restrict the used QIDs.')
+    parser.add_argument('--print_output', help='Print information about the protocol output', default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument('--profile', help='Profile the protocol run and print the most expensive functions', default=False, action=argparse.BooleanOptionalAction)
+    parser.add_argument('--rtt_ms', type=float, help='Emulated round trip time between all parties in ms.', default=0.0)
+    parser.add_argument('--jitter_ms', type=float, help='Emulated jitter of the one-way latency in ms.', default=0.0)
+    parser.add_argument('--bandwidth_mbit', type=float, help='Emulated bandwidth of each link in Mbit/s (default: unlimited).')
+    parser.add_argument('--link_profiles', help='JSON file with per-link profiles, e.g., {"0-1": {"rtt_ms": 40, "jitter_ms": 5, "bandwidth_mbit": 100}}.')
+    parser.add_argument('--motion_round_trips', type=int, help='Number of round trips emulated for each secure computation.', default=0)
+    parser.add_argument('--motion_setup_ms', type=float, help='Emulated setup time of a MOTION party in ms. Sessions keep the party for all rounds, which the pandapython library does not support yet, so MOTION itself still pays the setup per round.', default=0.0)
+    parser.add_argument('--motion_preprocessing_us', type=float, help='Emulated preprocessing time per secure sum input in microseconds. Preprocessing for the next round happens in the background, which the pandapython library does not support yet, so MOTION itself still preprocesses online.', default=0.0)
+    parser.add_argument('--aggregation', help='The stand-in for MOTION ([local]/secret-sharing). The --motion_* options only apply to local.', choices=["local", "secret-sharing"], default="local")
+    parser.add_argument('--motion_shards', help='The maximum number of concurrent MOTION sessions per round, an integer or auto for one per core. Large rounds are split into shards, shard i uses the MOTION ports plus i * 1000. Reduced to the number of shards with ports up to 65535.', default="1")
+    parser.add_argument('--row_encryption', help='How the result rows are encrypted for the central ([sealed]/hybrid). hybrid performs one key agreement per party instead of one per row, but lets the central learn which rows come from the same box.', choices=ROW_ENCRYPTIONS, default=ROW_ENCRYPTION_SEALED)
+    parser.add_argument('--row_codec', help='How the result rows are encoded before encryption (pickle/[compact]). compact encodes generalization labels as ids in the QID trees and packs numbers, which roughly halves the encrypted result.', choices=ROW_CODECS, default=ROW_CODEC_COMPACT)
+    parser.add_argument('--row_aggregation', help='Whether identical result rows are encrypted once with their multiplicity ([none]/expanded/weighted). weighted returns the rows with their multiplicity as last column. Lets the central learn which identical rows come from the same box.', choices=ROW_AGGREGATIONS, default=ROW_AGGREGATION_NONE)
+    parser.add_argument('--crypto_workers', type=int, help='The number of processes encrypting/decrypting the result rows in parallel.', default=1)
+    parser.add_argument('--aggregation_statistics', help='Print MOTION-like statistics of the secure computations of the central (secret-sharing only)', default=False, action=argparse.BooleanOptionalAction)
+    args = parser.parse_args()
+
+    number_of_boxes = args.number_of_boxes
+    k = args.anonymity_parameter
+
+    all_qid_attribute_trees = medical_data.attribute_trees if args.dataset == "medical" else adult_data.attribute_trees
+    if args.used_qids:
+        used_qids = [int(q.strip()) for q in args.used_qids.split(",")]
+        used_qid_attribute_trees = {k: v for k, v in all_qid_attribute_trees.items() if k in used_qids}
+        if len(used_qid_attribute_trees) != len(used_qids):
+            raise ValueError(f"{used_qids} as QIDs requested, but there only exist the following QIDs: {list(all_qid_attribute_trees.keys())}")
+    else:
+        used_qid_attribute_trees = all_qid_attribute_trees
+
+    print(f"Starting local run [Number of boxes: {number_of_boxes}, dataset: {args.dataset}, k: {k}, num_qids: {len(used_qid_attribute_trees)}]", flush=True)
+
+    datapath = medical_data.DATA_PATH if args.dataset == "medical" else adult_data.DATA_PATH
+    data_categories, all_data = read_data(datapath)
+    box_data_range = len(all_data) // number_of_boxes
+    box_data = [all_data[(box_id - 1) * box_data_range:box_id * box_data_range] for box_id in range(1, number_of_boxes + 1)]
+
+    default_profile = LinkProfile.from_milliseconds(args.rtt_ms, args.jitter_ms, args.bandwidth_mbit)
+    if args.link_profiles:
+        network_emulation = NetworkEmulation.from_json(args.link_profiles, default_profile)
+    elif args.rtt_ms or args.jitter_ms or args.bandwidth_mbit:
+        network_emulation = NetworkEmulation(default_profile)
+    else:
+        network_emulation = None
+
+    motion_delay = 0.0
+    if network_emulation is not None and args.motion_round_trips:
+        # MOTION parties communicate pairwise, the slowest link dominates each communication round
+        motion_delay = args.motion_round_trips * network_emulation.max_rtt()
+
+    if args.aggregation == "secret-sharing":
+        motion_backend = SecretSharingBackend(in_process=True)
+    else:
+        motion_backend = LocalMotion(motion_delay, args.motion_setup_ms / 1000, args.motion_preprocessing_us / 1000 / 1000)
+    number_of_motion_shards = default_number_of_shards() if args.motion_shards == "auto" else int(args.motion_shards)
+    runner = AlgorithmRunner(motion_backend, network_emulation, number_of_motion_shards, row_encryption=args.row_encryption,
+                             number_of_crypto_workers=args.crypto_workers, row_codec=args.row_codec,
+                             row_aggregation=args.row_aggregation)
+    profiler = cProfile.Profile() if args.profile else None
+
+    if profiler:
+        profiler.enable()
+    runner.run_algorithm(used_qid_attribute_trees, box_data, data_categories, k, [])
+    if profiler:
+        profiler.disable()
+
+    finished = (f"FINISHED - time elapsed [{runner.end_time - runner.start_time:0.3f} s], rounds: {runner.number_of_rounds}, "
+                f"messages: {runner.number_of_messages}, bytes: {runner.number_of_exchanged_bytes}")
+    if isinstance(motion_backend, LocalMotion):
+        finished += (f", MOTION calls: {motion_backend.number_of_calls}, MOTION inputs: {motion_backend.number_of_inputs}, "
+                     f"MOTION party setups: {motion_backend.number_of_setups}, "
+                     f"inputs preprocessed online: {motion_backend.number_of_inputs_preprocessed_online}")
+    else:
+        finished += f", secure computations: {len(motion_backend.statistics.get(0, []))}"
+    print(finished)
+
+    if args.aggregation_statistics and isinstance(motion_backend, SecretSharingBackend):
+        print(format_statistics(motion_backend.statistics[0]))
+
+    if args.print_output:
+        print(runner.printable_anonymization_run_information())
+
+    if profiler:
+        pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(30)
+
+
+if __name__ == "__main__":
+    main()
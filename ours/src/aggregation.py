@@ -0,0 +1,108 @@
+"""
+Backends for the secure computation behind motion.perform_protocol_secure_sums_gt_k.
+
+Each party inputs its grouped counters, all parties receive the grouped sums after applying the output rules of the
+MOTION circuit (see grouped_sums_gt_k). Available backends:
+- MotionBackend: the MOTION pandapython library (requires MOTION_PANDA_LIB_PATH)
+- secret_sharing.SecretSharingBackend: additive secret sharing in pure Python/NumPy, over sockets or in-process
+- local_motion.LocalMotion: plain computation for parties running as threads of one process, no security at all
+"""
+import os
+import sys
+from abc import ABC, abstractmethod
+from typing import List, Tuple, Optional
+
+MOTION_LIB_PATH = os.environ.get("MOTION_PANDA_LIB_PATH")
+if MOTION_LIB_PATH:
+    sys.path.append(MOTION_LIB_PATH)
+    import pandapython
+else:
+    pandapython = None  # only the other backends can be used
+
+# same value as returned by pandapython.get_zero_mask_value()
+ZERO_MASK_VALUE = 2 ** 30 - 1
+
+MotionParty = Tuple[int, str, int]  # (id, host, motion port)
+
+
+def secure_sum_bit_width(number_of_boxes: int, max_records_per_box: int, k: int) -> int:
+    """
+    The smallest bit width, which represents all possible sums and k. It only depends on public upper bounds, so the
+    central can choose it and announce it to the boxes.
+
+    :param number_of_boxes: the number of boxes
+    :param max_records_per_box: an upper bound for the number of records of each box
+    :param k: the anonymity parameter
+    :return: the bit width
+    """
+    max_sum = number_of_boxes * max_records_per_box
+    if max_sum >= ZERO_MASK_VALUE:
+        raise ValueError("Sums up to {} cannot be distinguished from the zero mask value {}".format(max_sum, ZERO_MASK_VALUE))
+    return max(max_sum.bit_length(), k.bit_length(), 1)
+
+
+def grouped_sums_gt_k(summed_inputs: List[List[int]], k: int, zero_mask_value: int = ZERO_MASK_VALUE) -> List[List[int]]:
+    """
+    Apply the output rules of the MOTION circuit to already summed inputs:
+    - sum == 0     -> zero_mask_value
+    - 0 < sum < k  -> 0 for ALL sums of the group
+    - k <= sum     -> sum
+
+    :param summed_inputs: the summed inputs of all parties, grouped
+    :param k: the anonymity parameter
+    :param zero_mask_value: the value used for empty sums
+    :return: the grouped results
+    """
+    results = []
+    for group in summed_inputs:
+        if any(0 < s < k for s in group):
+            results.append([0] * len(group))
+        else:
+            results.append([zero_mask_value if s == 0 else s for s in group])
+    return results
+
+
+class AggregationBackend(ABC):
+    """
+    Interface of the pandapython functions used by the protocol.
+
+    Backends may additionally offer `open_session(parties, my_id)` to keep a set up party for several calls, see
+    motion.SecureSumsSession.
+    """
+
+    @abstractmethod
+    def get_zero_mask_value(self) -> int:
+        pass
+
+    @abstractmethod
+    def perform_arithmetic_then_bool_with_groups(self, parties: List[MotionParty], my_id: int, my_inputs: List[List[int]], k: int,
+                                                 bit_width: Optional[int] = None) -> List[List[int]]:
+        """
+        :param parties: all parties as (id, host, motion port)
+        :param my_id: the id of the calling party
+        :param my_inputs: the grouped inputs of the calling party, equally shaped for all parties
+        :param k: the anonymity parameter (only the central knows it, boxes use 0)
+        :param bit_width: the bit width needed for all sums and k, the same for all parties (default: the widest
+            circuit of the backend)
+        :return: the grouped results, see grouped_sums_gt_k
+        """
+        pass
+
+
+class MotionBackend(AggregationBackend):
+    """
+    The MOTION pandapython library, which performs the secure computation between the real parties.
+    """
+
+    def __init__(self):
+        if pandapython is None:
+            raise Exception("You must set the path for the required motion lib in the environment variable MOTION_PANDA_LIB_PATH. Contact the readme for details.")
+
+    def get_zero_mask_value(self) -> int:
+        return pandapython.get_zero_mask_value()
+
+    def perform_arithmetic_then_bool_with_groups(self, parties: List[MotionParty], my_id: int, my_inputs: List[List[int]], k: int,
+                                                 bit_width: Optional[int] = None) -> List[List[int]]:
+        # pandapython offers a single circuit, which covers every bit width below the zero mask value
+        # (see secure_sum_bit_width), narrower circuits would have to be added to the library
+        return pandapython.perform_arithmetic_then_bool_with_groups(parties=parties, my_id=my_id, my_inputs=my_inputs, k=k)
@@ -1,41 +1,89 @@
-import json
 import pickle
 import statistics
+import threading
 import time
-from typing import List, Optional
+from collections import Counter
+from typing import List, Optional, Dict
+
+from src.box import answer_request
+from src.central import run_request, Central
+from src.communication import InProcessTransport
+from src.constants import Data, REQUEST_TYPE, RequestType
+from src.crypto import ROW_ENCRYPTION_SEALED
+from src.row_codec import ROW_CODEC_COMPACT
+from src.data_utils import data_fulfills_k_anonymity, compute_equivalence_class_sizes, extract_equivalence_classes, expand_rows, \
+    ROW_AGGREGATION_NONE, ROW_AGGREGATION_WEIGHTED
+from src.local_motion import LocalMotion
+from src import motion
+from src.motion import Party
+from src.network_emulation import NetworkEmulation, EmulatedTransport
+from src.qid_hierarchy_node import QidAttributeTrees
+
+
+class CountingInProcessTransport(InProcessTransport):
+    """ An in-process transport additionally counting the sent messages per request type. """
 
-from src.box import Box
-from src.central import Central
-from src.constants import Data, REQUEST_TYPE, RequestType, CENTRAL_PK, INFO, DATA_ROWS, BEST_REFINEMENTS
-from src.data_utils import data_fulfills_k_anonymity, compute_equivalence_class_sizes, extract_equivalence_classes
-from src.qid_hierarchy_node import QidAttributeTrees, NumericalQidHierarchyNode, CategoricalQidHierarchyNode
+    def __init__(self):
+        super().__init__()
+        self.messages_per_request_type: Dict[RequestType, int] = Counter()
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        super().send_data_to_other_party(data, host, port)
+        self.messages_per_request_type[data[REQUEST_TYPE]] += 1
 
 
 class AlgorithmRunner:
+    """
+    Runs the complete distributed algorithm (central and all boxes) within one process.
+
+    Each party runs in its own thread, messages are exchanged via an in-process transport and the secure computation
+    is performed by a local MOTION stand-in. Apart from that, everything happens just like in the distributed setting.
+    """
+
+    HOST = "127.0.0.1"
+    CENTRAL_RING_PORT = 4442
+    CENTRAL_MOTION_PORT = 5442
+
+    def __init__(self, motion_backend=None, network_emulation: Optional[NetworkEmulation] = None, number_of_motion_shards: int = 1,
+                 batch_window: Optional[float] = None, row_encryption: str = ROW_ENCRYPTION_SEALED,
+                 number_of_crypto_workers: int = 1, row_codec: str = ROW_CODEC_COMPACT, row_aggregation: str = ROW_AGGREGATION_NONE):
+        """
+        :param motion_backend: the library performing the secure computation (default: a new LocalMotion stand-in)
+        :param network_emulation: if set, ring messages are delayed according to the given link profiles
+        :param number_of_motion_shards: the maximum number of concurrent MOTION sessions per round
+        :param batch_window: batch the secure computations with concurrent runs using the same motion backend (see
+            central.Central)
+        :param row_encryption: how the rows of the secure set union are encrypted (see crypto.ROW_ENCRYPTIONS)
+        :param number_of_crypto_workers: the number of processes of each party encrypting and decrypting the result rows
+        :param row_codec: how the rows of the secure set union are encoded before encryption (see row_codec.ROW_CODECS)
+        :param row_aggregation: whether identical rows of the secure set union are sent once with their multiplicity
+            (see data_utils.ROW_AGGREGATIONS)
+        """
+        self.motion_backend = motion_backend
+        self.number_of_motion_shards = number_of_motion_shards
+        self.batch_window = batch_window
+        self.row_encryption = row_encryption
+        self.number_of_crypto_workers = number_of_crypto_workers
+        self.row_codec = row_codec
+        self.row_aggregation = row_aggregation
+        self.network_emulation = network_emulation
 
-    def __init__(self):
         self.k = 0
         self.qid_attribute_trees = None
         self.data_categories = None
 
-        # These values are used as replacement for a real communication channel.
-        self.central_pk = None
-        self.current_counter_information = None
-        self.best_refinements = None
-        self.current_counter_information = None
-        self.data_rows = None
-        self.data_rows = None
-        self.current_counter_information = None
-
+        self.transport: Optional[CountingInProcessTransport] = None
         self.number_of_rounds = 0
-        self.central: Optional[Central] = None
-        self.boxes: Optional[List[Box]] = None
+        self.number_of_messages = 0
+        self.number_of_exchanged_bytes = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
 
         self.result_data = None
 
     def run_algorithm(self, qid_attribute_trees: QidAttributeTrees, box_data: List[Data], data_categories, k: int, criteria) -> Data:
         """
-        Run the algorithm "in-place" without real communication, but apart from that just like it would happen in the distributed setting.
+        Run the algorithm "in-place" with in-process communication, but apart from that just like it would happen in the distributed setting.
 
         :param qid_attribute_trees: the refinement hierarchies
         :param box_data: the data of all boxes, the number of participating boxes is derived from this
@@ -50,109 +98,67 @@ class AlgorithmRunner:
 
         # initialisation
 
-        self.central_pk = None
-        self.current_counter_information = None
-        self.best_refinements = None
-        self.current_counter_information = None
-        self.data_rows = None
-        self.data_rows = None
-        self.current_counter_information = None
-
-        self.number_of_rounds = 0
-        self.number_of_messages = 0
-        self.number_of_exchanged_bytes = 0  # estimation without taking encryption into account
-        self.start_time = time.perf_counter()
-
-        # initial round
-
-        self.central = Central(k, qid_attribute_trees, criteria, self._central_send_data)
-        self.central.start_initial_round()
-
-        self.boxes: List[Box] = []
-        for data in box_data:
-            box = Box(data_categories, data, criteria, self.central_pk, qid_attribute_trees, self._box_send_data)
-            box.perform_initial_round(self.current_counter_information)
-            self.boxes.append(box)
-
-        self.central.complete_round(self.current_counter_information)
-
-        # regular rounds
-
-        while self.central.can_perform_round():
-            self.number_of_rounds += 1
-            self.central.start_round()
+        self.transport = CountingInProcessTransport()
+        motion_backend = self.motion_backend if self.motion_backend is not None else LocalMotion()
+        parties = [Party(i, self.HOST, self.CENTRAL_RING_PORT + i, self.CENTRAL_MOTION_PORT + i) for i in range(1, len(box_data) + 1)]
 
-            for box in self.boxes:
-                box.perform_regular_round(self.best_refinements, self.current_counter_information)
-
-            self.central.complete_round(self.current_counter_information)
-
-        # final step (secure set union)
+        self.result_data = None
+        finished = threading.Event()
+        errors = []
+
+        all_parties = [Party(Central.CENTRAL_ID, self.HOST, self.CENTRAL_RING_PORT, self.CENTRAL_MOTION_PORT)] + parties
+
+        def run_party(target, party_id, *args, **kwargs):
+            transport = self.transport
+            if self.network_emulation is not None:
+                transport = EmulatedTransport(self.transport, self.network_emulation, party_id, all_parties)
+            try:
+                result = target(*args, transport, motion_backend, **kwargs)
+                if target is run_request:
+                    self.result_data = result
+                    finished.set()
+            except Exception as e:
+                errors.append(e)
+                finished.set()  # the remaining parties would wait forever
+
+        # each box keeps its own copy of the data rows, just like in the distributed setting
+        threads = [threading.Thread(target=run_party, daemon=True,
+                                    args=(answer_request, p.id, pickle.loads(pickle.dumps(data)), data_categories, p.id, p.host, p.ring_port),
+                                    kwargs={"number_of_crypto_workers": self.number_of_crypto_workers})
+                   for data, p in zip(box_data, parties)]
+        threads.append(threading.Thread(target=run_party, daemon=True,
+                                        args=(run_request, Central.CENTRAL_ID, k, criteria, parties, self.HOST, self.CENTRAL_RING_PORT,
+                                              self.CENTRAL_MOTION_PORT, qid_attribute_trees),
+                                        # the box sizes are known here, so they serve as public upper bounds
+                                        kwargs={"max_records_per_box": max(len(data) for data in box_data),
+                                                "number_of_motion_shards": self.number_of_motion_shards,
+                                                "batch_window": self.batch_window,
+                                                "row_encryption": self.row_encryption,
+                                                "number_of_crypto_workers": self.number_of_crypto_workers,
+                                                "row_codec": self.row_codec,
+                                                "row_aggregation": self.row_aggregation}))
 
-        self.central.start_secure_data_union()
-        for box in self.boxes:
-            box.perform_secure_data_union_action(self.data_rows)
+        self.start_time = time.perf_counter()
 
-        self.result_data = self.central.complete_secure_data_union(self.data_rows)
+        for t in threads:
+            t.start()
+        finished.wait()
+        if errors:
+            raise errors[0]
+        for t in threads:
+            t.join()
+        motion.close_sessions(motion_backend)
 
         # finalisation
 
         self.end_time = time.perf_counter()
 
-        return self.result_data
+        self.number_of_messages = self.transport.number_of_messages
+        self.number_of_exchanged_bytes = self.transport.number_of_bytes
+        # each round message passes all boxes and returns to the central
+        self.number_of_rounds = self.transport.messages_per_request_type[RequestType.INSTRUCTION] // (len(box_data) + 1)
 
-    def _update_exchanged_messages(self, data):
-        class JSONEncoder(json.JSONEncoder):
-            """ Just used as an estimation of exchanged message bytes. """
-            def default(self, obj):
-                # print("encoding {} of type {}".format(obj, type(obj)))
-
-                if isinstance(obj, bytes):
-                    return obj.hex()
-                if isinstance(obj, NumericalQidHierarchyNode):
-                    obj_dict = dict({
-                        'min': obj.min,
-                        'max': obj.max,
-                        'children': [JSONEncoder.default(self, c) for c in obj.children] if len(obj.children) > 0 else None,
-                    })
-                    return obj_dict
-
-                if isinstance(obj, CategoricalQidHierarchyNode):
-                    obj_dict = {
-                        'value': str(obj.value),
-                        'children': [JSONEncoder.default(self, c) for c in obj.children] if len(obj.children) > 0 else None,
-                    }
-                    return obj_dict
-
-                return json.JSONEncoder.default(self, obj)
-
-        self.number_of_messages += 1
-        exchanged_str = json.dumps(data, cls=JSONEncoder)
-        exchanged_bytes = len(exchanged_str.encode('utf-8'))
-        # print("Adding bytes for {} [{}]".format(exchanged_str[:5], exchanged_bytes))
-        self.number_of_exchanged_bytes += exchanged_bytes
-
-    def _central_send_data(self, data):
-        self._update_exchanged_messages(data)
-
-        if data[REQUEST_TYPE] == RequestType.INFORMATION:
-            self.central_pk = pickle.loads(data[CENTRAL_PK])
-            self.current_counter_information = data[INFO]
-        elif data[REQUEST_TYPE] == RequestType.INSTRUCTION:
-            self.best_refinements = data[BEST_REFINEMENTS]
-            self.current_counter_information = data[INFO]
-        elif data[REQUEST_TYPE] == RequestType.END:
-            self.data_rows = data[DATA_ROWS]
-        else:
-            raise ValueError("unknown RequestType: " + data[REQUEST_TYPE] + ". Adjust integration test.")
-
-    def _box_send_data(self, data):
-        self._update_exchanged_messages(data)
-
-        if data[REQUEST_TYPE] == RequestType.END:
-            self.data_rows = data[DATA_ROWS]
-        else:
-            self.current_counter_information = data[INFO]
+        return self.result_data
 
     def printable_anonymization_run_information(self) -> str:
         """
@@ -167,12 +173,13 @@ class AlgorithmRunner:
             raise Exception("Runner has not run complete algorithm")
 
         relevant_attributes = list(self.qid_attribute_trees.keys())
+        result_data = expand_rows(self.result_data) if self.row_aggregation == ROW_AGGREGATION_WEIGHTED else self.result_data
 
-        data_is_k_anonymous = data_fulfills_k_anonymity(self.result_data, relevant_attributes, self.k)
-        example_anonymous_row = list(zip(self.data_categories, self.result_data[0]))
-        eq_class_sizes_counter = compute_equivalence_class_sizes(self.result_data, relevant_attributes)
+        data_is_k_anonymous = data_fulfills_k_anonymity(result_data, relevant_attributes, self.k)
+        example_anonymous_row = list(zip(self.data_categories, result_data[0]))
+        eq_class_sizes_counter = compute_equivalence_class_sizes(result_data, relevant_attributes)
         eq_class_sizes_counter_sorted = sorted(eq_class_sizes_counter.items(), key=lambda pair: pair[0])
-        extracted_eq_classes = extract_equivalence_classes(self.result_data, relevant_attributes)
+        extracted_eq_classes = extract_equivalence_classes(result_data, relevant_attributes)
         eq_class_sizes = sorted([len(eqc) for eqc in extracted_eq_classes.values()])
         eq_class_sizes_mean = statistics.mean(eq_class_sizes)
         eq_class_sizes_median = statistics.median(eq_class_sizes)
@@ -182,7 +189,7 @@ class AlgorithmRunner:
 Algorithm rounds: {}
 Algorithm total time: {:0.2f} s
 Messages sent: {}
-Estimated total message sizes: {} bytes
+Total ring message sizes: {} bytes
 Result is k-anonymous: {}
 
 ----
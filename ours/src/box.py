@@ -1,45 +1,78 @@
 import pickle
+import threading
+from queue import Queue
 from random import shuffle
-from typing import List, Any, Callable, Dict
+from typing import List, Any, Callable, Dict, Optional
 
 from nacl.public import PublicKey
 
 from src import motion, communication
+from src.communication import Transport
 from src.constants import REQUEST_TYPE, RequestType, CRITERIA, INFO, QID_ATTRIBUTE_TREES, CENTRAL_PK, \
     EncryptedData, DATA_ROWS, BEST_REFINEMENTS, BestRefinements, PARTIES, TipsNodeId, AttributeIndex, \
-    GeneralizationLabel, BEST_ATTRIBUTE_INDEX, BEST_LABEL
+    GeneralizationLabel, BEST_ATTRIBUTE_INDEX, BEST_LABEL, Data, BIT_WIDTH, MOTION_SHARDS, BATCH, MOTION_SESSION, ROW_ENCRYPTION, SESSION_KEYS, ROW_CODEC, \
+    AGGREGATE_ROWS, REQUEST_ID, SPECIALIZATION, Specialization, DATA_VERSIONS
+from src.box_data import BoxData
 from src.counter_information_data import CounterInformationData, add_counter_information_data, \
-    counter_groups_from_counter_information_data, filter_counter_groups_by_id
-from src.crypto import encrypt_data_rows
+    counter_groups_from_counter_information_data, filter_counter_groups_by_id, CounterGroup
+from src.crypto import encrypt_data_rows, encrypt_data_rows_hybrid, ROW_ENCRYPTION_SEALED, ROW_ENCRYPTION_HYBRID, SessionKey
+from src.data_utils import aggregate_rows
+from src.row_codec import RowCodec, ROW_CODEC_PICKLE, ROW_CODEC_COMPACT
 from src.qid_hierarchy_node import QidAttributeTrees
 from src.tips_nodes import setup_tips_root_node, setup_tips_leaf_nodes, \
     extract_counter_information_data_from_tips_nodes, get_anonymous_result_data, LeafNodes, perform_refinements, \
-    LinkHeads, setup_tips_link_heads, perform_refinement, get_anonymous_result_data_from_link_heads
+    LinkHeads, setup_tips_link_heads, perform_refinement, get_anonymous_result_data_from_link_heads, \
+    counter_groups_upper_bound, next_round_counter_groups_upper_bound, leaf_nodes_from_link_heads
+
+
+def next_party_in_ring(box_id: int, parties: [motion.Party]) -> motion.Party:
+    """
+    Returns the successor of a box in the ring topology: the next party by id if present, the central otherwise.
+    """
+    next_party = list(filter(lambda p: p.id == box_id + 1, parties))
+    return next_party[0] if next_party else parties[0]
 
 
 class Box:
     """
-    A Box is responsible for performing tasks for exactly ONE request.
+    A Box is responsible for performing tasks for exactly ONE request. Processes serving several requests use one Box
+    per request, see serve_requests.
     """
 
     def __init__(self,
-                 categories: List[str],
-                 data: List[List[Any]],
+                 box_data: BoxData,
                  request_criteria: List,
                  central_pk: PublicKey,
                  qid_attribute_trees: QidAttributeTrees,
                  box_id: int,
-                 parties: [motion.Party]):
+                 parties: [motion.Party],
+                 transport: Optional[Transport] = None,
+                 motion_backend=None,
+                 bit_width: Optional[int] = None,
+                 number_of_motion_shards: int = 1,
+                 number_of_crypto_workers: int = 1,
+                 request_id: Optional[str] = None,
+                 specialization: Optional[Specialization] = None, central_session_id: Optional[str] = None):
         """
         Initialize the box component.
 
-        :param categories: categories present in the local data
-        :param data: the local data
+        :param box_data: the local data, which can be shared by several requests
         :param request_criteria: the criteria for the request
         :param central_pk: the public key of the central component
         :param counter_information: initial count statistics from the previous box/central component in the ring
         :param qid_attribute_trees: the unspecialized qid attribute hierarchies
-        :param send_data_callable: a callable to send data to the next box on the ring topology
+        :param box_id: the box id
+        :param parties: all parties (including the central with id 0)
+        :param transport: the transport used to send data to the next box on the ring topology (default: sockets)
+        :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+        :param bit_width: the bit width of the secure computation chosen by the central
+        :param number_of_motion_shards: the number of concurrent MOTION sessions per round chosen by the central
+        :param number_of_crypto_workers: the number of processes encrypting the result rows in parallel
+        :param request_id: the id of the request, which tags all messages of the request
+        :param specialization: the refinements of a warm start chosen by the central, which are performed before the
+            initial round (default: start from the root node)
+        :param central_session_id: the id of the MOTION session of the central, a session of the box kept for another
+            session of the central is replaced (see motion.open_session)
         """
         self._request_criteria = request_criteria
 
@@ -47,124 +80,283 @@ class Box:
             t.check_consistency()
         self._qid_attribute_trees = qid_attribute_trees
 
-        data_matching_criteria = self._gather_box_data_for_request(request_criteria, categories, data)
-        self._tips_root = setup_tips_root_node(data_matching_criteria, qid_attribute_trees)
-        self._tips_link_heads: LinkHeads = setup_tips_link_heads(self._tips_root, qid_attribute_trees)
+        self._box_data = box_data
+        self._specialization: Specialization = list(specialization) if specialization else []
+        self._tips_link_heads, self._number_of_rows = box_data.tips_tree(request_criteria, qid_attribute_trees, self._specialization)
 
         self._central_pk = central_pk
         self._parties = parties
+        self._transport = transport if transport is not None else communication.SocketTransport()
 
         self._box_id = box_id
-        next_party = list(filter(lambda p: p.id == box_id + 1, parties))
-        self._next_party = next_party[0] if next_party else self._parties[0]  # next party by id if present, central otherwise
+        self._request_id = request_id
+        self._bit_width = bit_width
+        self._number_of_crypto_workers = number_of_crypto_workers
+        self._next_party = next_party_in_ring(box_id, parties)
 
-    def perform_initial_round(self, relevant_tips_nodes: List[TipsNodeId]):
+        # the MOTION session is kept open for all rounds (and further requests with the same parties)
+        self._motion_session = motion.open_session(parties, box_id, motion_backend, number_of_motion_shards, central_session_id)
+        self._motion_session.preprocess(*counter_groups_upper_bound(leaf_nodes_from_link_heads(self._tips_link_heads)))
+
+    def perform_initial_round(self, relevant_tips_nodes: List[TipsNodeId], batch: Optional[motion.Batch] = None):
         """
         Perform the initial round:
-        Compute local count statistics, add them with received count statistics and forward this data.
+        Compute local count statistics and input them into the secure computation.
+        The request itself has already been forwarded to the next box (see answer_request), since it does not depend
+        on the local data.
+
+        Without a warm start, the TIPS tree consists of the root node only. Otherwise, the counters of all leaf nodes
+        of the replayed specialization are input, so the central validates them in a single round.
 
-        :param relevant_tips_nodes: TODO
+        :param relevant_tips_nodes: the TIPS nodes, whose counters are requested by the central unit
+        :param batch: the batch of the secure computation assigned by the central, if any
         """
-        own_counter_information: CounterInformationData = extract_counter_information_data_from_tips_nodes([self._tips_root])
+        own_counter_information = extract_counter_information_data_from_tips_nodes(leaf_nodes_from_link_heads(self._tips_link_heads))
         counter_groups = counter_groups_from_counter_information_data(own_counter_information)
         relevant_counters = filter_counter_groups_by_id(counter_groups, relevant_tips_nodes)
 
-        send_data = {
-            REQUEST_TYPE: RequestType.INFORMATION,
-            CRITERIA: self._request_criteria,
-            INFO: relevant_tips_nodes,  # send central counter information
-            QID_ATTRIBUTE_TREES: self._qid_attribute_trees,
-            CENTRAL_PK: pickle.dumps(self._central_pk),
-            PARTIES: self._parties
-        }
+        self._perform_secure_sums(relevant_counters, batch)
+        self._motion_session.preprocess(*next_round_counter_groups_upper_bound(self._tips_link_heads))
 
-        communication.send_data_to_other_party(send_data, self._next_party.host, self._next_party.ring_port)
-
-        motion.perform_protocol_secure_sums_gt_k(self._parties, self._box_id, relevant_counters, 0)  # box does not need k
-
-    @staticmethod
-    def _gather_box_data_for_request(criteria: List, data_categories, data):
-        # start with full database and filter rows not compliant with criteria
-        result = data.copy()
-        for criterion in criteria:
-            new_result = []
-
-            category = criterion[0]
-            operator = criterion[1]
-            raw_value = criterion[2]
-
-            if category in data_categories:
-                index = data_categories.index(category)
-                try:
-                    value = int(raw_value)
-                except ValueError:
-                    try:
-                        value = float(raw_value)
-                    except ValueError:
-                        print("This is not a numerical value: " + raw_value)
-                        result = []
-                        break
-
-                for row in result:
-                    if (
-                            (operator == "=" and row[index] == value)
-                            or (operator == "<" and row[index] < value)
-                            or (operator == ">" and row[index] > value)
-                    ):
-                        def remove_center_nr(data_row):
-                            data_row[0] = "*"
-
-                        remove_center_nr(row)
-                        new_result.append(row)
-            else:
-                print("Criterion '" + category + "' is not present in my database.")
-            result = new_result
-        return result
-
-    def perform_regular_round(self, best_index: AttributeIndex, best_label: GeneralizationLabel, relevant_tips_nodes: [TipsNodeId]):
+    def _perform_secure_sums(self, relevant_counters: List[CounterGroup], batch: Optional[motion.Batch]) -> List[CounterGroup]:
+        # box does not need k
+        if batch is not None:
+            return self._motion_session.perform_batched_secure_sums_gt_k(batch, relevant_counters, 0, self._bit_width)
+        return self._motion_session.perform_secure_sums_gt_k(relevant_counters, 0, self._bit_width)
+
+    def perform_replay_round(self, specialization: Specialization, relevant_tips_nodes: [TipsNodeId],
+                             batch: Optional[motion.Batch] = None):
         """
-        Performs the actions required for a algorithm round: refine local data based on the given best refinement
-        and send the new count statistics to the next box.
+        Performs the actions required for undoing refinements of a warm start, which the central could not validate:
+        forward the instruction to the next box, set up the TIPS tree again with the first refinements only and input
+        the counters of its leaf nodes into the secure computation.
 
-        :param best_refinements: the attribute to be refined for each leaf node
-        :param relevant_tips_nodes: the count statistics coming from the previous box/the central unit
+        :param specialization: the refinements to keep
+        :param relevant_tips_nodes: the TIPS nodes, whose counters are requested by the central unit
+        :param batch: the batch of the secure computation assigned by the central, if any
         """
-        self._tips_link_heads, new_nodes = perform_refinement(self._tips_link_heads, best_index, best_label)
+        data = {
+            REQUEST_TYPE: RequestType.INSTRUCTION,
+            REQUEST_ID: self._request_id,
+            INFO: relevant_tips_nodes,
+            SPECIALIZATION: specialization,
+            BATCH: batch
+        }
 
-        # extract counter nodes for the new (refined) TIPS nodes
-        own_counter_information: CounterInformationData = extract_counter_information_data_from_tips_nodes(new_nodes)
-        counter_groups = counter_groups_from_counter_information_data(own_counter_information)
-        relevant_counters = filter_counter_groups_by_id(counter_groups, relevant_tips_nodes)
+        self._transport.send_data_to_other_party(data, self._next_party.host, self._next_party.ring_port)
+
+        self._specialization = list(specialization)
+        self._tips_link_heads, self._number_of_rows = self._box_data.tips_tree(self._request_criteria, self._qid_attribute_trees,
+                                                                               self._specialization)
+        self.perform_initial_round(relevant_tips_nodes, batch)
+
+    def perform_regular_round(self, best_index: AttributeIndex, best_label: GeneralizationLabel, relevant_tips_nodes: [TipsNodeId],
+                              batch: Optional[motion.Batch] = None):
+        """
+        Performs the actions required for a algorithm round: forward the instruction to the next box, refine local data
+        based on the given best refinement and input the new count statistics into the secure computation.
 
+        The instruction is forwarded first, since it does not depend on the local refinement. This way, all boxes
+        refine concurrently instead of one after another.
+
+        :param best_index: the attribute to be refined
+        :param best_label: the generalization class to be refined
+        :param relevant_tips_nodes: the TIPS nodes, whose counters are requested by the central unit
+        :param batch: the batch of the secure computation assigned by the central, if any
+        """
         data = {
             REQUEST_TYPE: RequestType.INSTRUCTION,
+            REQUEST_ID: self._request_id,
             INFO: relevant_tips_nodes,  # send central counter information
             BEST_ATTRIBUTE_INDEX: best_index,
-            BEST_LABEL: best_label
+            BEST_LABEL: best_label,
+            BATCH: batch
         }
 
-        communication.send_data_to_other_party(data, self._next_party.host, self._next_party.ring_port)
+        self._transport.send_data_to_other_party(data, self._next_party.host, self._next_party.ring_port)
+
+        self._tips_link_heads, new_nodes = perform_refinement(self._tips_link_heads, best_index, best_label)
+        self._specialization.append((best_index, best_label))
+
+        # extract counter nodes for the new (refined) TIPS nodes
+        own_counter_information: CounterInformationData = extract_counter_information_data_from_tips_nodes(new_nodes)
+        counter_groups = counter_groups_from_counter_information_data(own_counter_information)
+        relevant_counters = filter_counter_groups_by_id(counter_groups, relevant_tips_nodes)
 
-        motion_result = motion.perform_protocol_secure_sums_gt_k(self._parties, self._box_id, relevant_counters, 0)  # box does not need k
+        motion_result = self._perform_secure_sums(relevant_counters, batch)
+        # preprocess for the next round, while the central chooses the next refinement
+        self._motion_session.preprocess(*next_round_counter_groups_upper_bound(self._tips_link_heads))
 
-    def perform_secure_data_union_action(self, data_rows: EncryptedData):
+    def perform_secure_data_union_action(self, data_rows: EncryptedData, row_encryption: str = ROW_ENCRYPTION_SEALED,
+                                         session_keys: Optional[List[SessionKey]] = None, row_codec: str = ROW_CODEC_PICKLE,
+                                         aggregated: bool = False):
         """
         Perform the actions required for the final secure set union algorithm phase:
         encrypt local data, combine encrypted data, shuffle lists, send data to successor.
 
         :param data_rows: the encrypted result data rows coming from the previous box/central unit
+        :param row_encryption: how the rows are encrypted, chosen by the central (see crypto.ROW_ENCRYPTIONS)
+        :param session_keys: the session keys of the previous parties (hybrid row encryption only)
+        :param row_codec: how the rows are encoded before encryption, chosen by the central (see row_codec.ROW_CODECS)
+        :param aggregated: send identical rows as a single row with their multiplicity, chosen by the central
         """
         anonymized_rows = get_anonymous_result_data_from_link_heads(self._tips_link_heads)
+        if aggregated:
+            anonymized_rows = aggregate_rows(anonymized_rows)
+        codec = RowCodec(self._qid_attribute_trees) if row_codec == ROW_CODEC_COMPACT else None
 
-        my_encrypted_rows = encrypt_data_rows(anonymized_rows, self._central_pk)
+        data = {
+            REQUEST_TYPE: RequestType.END,
+            REQUEST_ID: self._request_id,
+            ROW_ENCRYPTION: row_encryption,
+            ROW_CODEC: row_codec,
+            AGGREGATE_ROWS: aggregated
+        }
+        if row_encryption == ROW_ENCRYPTION_HYBRID:
+            my_encrypted_rows, session_key = encrypt_data_rows_hybrid(anonymized_rows, self._central_pk, self._number_of_crypto_workers, codec)
+            # shuffle to hide, which session key belongs to which party
+            data[SESSION_KEYS] = session_keys + [session_key]
+            shuffle(data[SESSION_KEYS])
+        else:
+            my_encrypted_rows = encrypt_data_rows(anonymized_rows, self._central_pk, self._number_of_crypto_workers, codec)
         my_encrypted_rows.extend(data_rows)
 
         # shuffle to make data origin less obvious
         shuffle(my_encrypted_rows)
+        data[DATA_ROWS] = my_encrypted_rows
 
-        data = {
-            REQUEST_TYPE: RequestType.END,
-            DATA_ROWS: my_encrypted_rows
-        }
         # send this box's result to the next box (or the central unit)
-        communication.send_data_to_other_party(data, self._next_party.host, self._next_party.ring_port)
+        self._transport.send_data_to_other_party(data, self._next_party.host, self._next_party.ring_port)
+
+        # for later requests continuing this specialization
+        self._box_data.keep_tips_tree(self._request_criteria, self._qid_attribute_trees, self._specialization, self._tips_link_heads,
+                                      self._number_of_rows)
+
+
+def answer_request(box_data: Data, box_data_categories: List[str], box_id: int, box_host: str, box_ring_port: int,
+                   transport: Optional[Transport] = None, motion_backend=None, number_of_crypto_workers: int = 1):
+    """
+    Perform the required steps in the distributed algorithm to compute a request result.
+
+    :param box_data: the local data
+    :param box_data_categories: categories in the local data
+    :param box_id: the box id
+    :param box_host: the box host
+    :param box_ring_port: the box port for ring communication
+    :param transport: the transport used for ring communication (default: sockets)
+    :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+    :param number_of_crypto_workers: the number of processes encrypting the result rows in parallel
+    """
+    transport = transport if transport is not None else communication.SocketTransport()
+    # a single request keeps no TIPS tree and caches nothing
+    _answer_request(lambda: transport.receive_data(box_host, box_ring_port),
+                    BoxData(box_data_categories, box_data, max_cached_trees=0, max_cache_bytes=0),
+                    box_id, transport, motion_backend, number_of_crypto_workers)
+
+
+def serve_requests(box_data: BoxData, box_id: int, box_host: str, box_ring_port: int, transport: Optional[Transport] = None,
+                   motion_backend=None, number_of_crypto_workers: int = 1, number_of_requests: Optional[int] = None):
+    """
+    Answer requests until the given number of requests was answered (daemon mode).
+
+    All messages of a request carry its id. The messages of each request are handed to a thread of its own, which
+    holds the Box of the request, so concurrent requests are processed side by side. The data (to which records can be
+    appended meanwhile), the criteria index, the TIPS trees kept for warm starts (see box_data.BoxData) and the MOTION
+    sessions (see motion.open_session) are kept for all requests. Concurrent requests of the same central share its
+    MOTION sessions, so the central has to batch their rounds (see Central). Queries of the data version (see
+    central.query_data_versions) are answered right away and are not counted as requests.
+
+    :param box_data: the local data
+    :param box_id: the box id
+    :param box_host: the box host
+    :param box_ring_port: the box port for ring communication, shared by all requests
+    :param transport: the transport used for ring communication (default: sockets)
+    :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+    :param number_of_crypto_workers: the number of processes encrypting the result rows in parallel
+    :param number_of_requests: the number of requests to answer (default: serve forever)
+    """
+    transport = transport if transport is not None else communication.SocketTransport()
+
+    messages_by_request: Dict[Any, Queue] = {}  # of the requests in progress
+    request_threads = []
+    while number_of_requests is None or len(request_threads) < number_of_requests or messages_by_request:
+        message = transport.receive_data(box_host, box_ring_port)
+        if message[REQUEST_TYPE] == RequestType.VERSIONS:
+            message[DATA_VERSIONS][box_id] = box_data.data_version()
+            next_party = next_party_in_ring(box_id, message[PARTIES])
+            transport.send_data_to_other_party(message, next_party.host, next_party.ring_port)
+            continue
+        request_id = message.get(REQUEST_ID)
+
+        if request_id not in messages_by_request:
+            messages = messages_by_request[request_id] = Queue()
+            thread = threading.Thread(target=_answer_request, daemon=True,
+                                      args=(messages.get, box_data, box_id, transport, motion_backend, number_of_crypto_workers))
+            thread.start()
+            request_threads.append(thread)
+        messages_by_request[request_id].put(message)
+        if message[REQUEST_TYPE] == RequestType.END:
+            del messages_by_request[request_id]  # the last message of the request
+
+    for thread in request_threads:
+        thread.join()
+
+
+def _answer_request(receive: Callable[[], Data], box_data: BoxData, box_id: int, transport: Transport, motion_backend,
+                    number_of_crypto_workers: int):
+    # wait for connections
+    request_from_predecessor = receive()
+
+    # data = {REQUEST_TYPE: RequestType.INFORMATION,
+    #         CRITERIA: criteria_list,
+    #         INFO: counter_link_heads_init,
+    #         QID_ATTRIBUTE_TREES: qid_attribute_trees,
+    #         CENTRAL_PK: pickle.dumps(public_key)}
+
+    central_pk = pickle.loads(request_from_predecessor[CENTRAL_PK])
+    criteria = request_from_predecessor[CRITERIA]
+    qid_trees = request_from_predecessor[QID_ATTRIBUTE_TREES]
+    counter_information_data = request_from_predecessor[INFO]
+    parties = request_from_predecessor[PARTIES]
+    bit_width = request_from_predecessor.get(BIT_WIDTH)
+    number_of_motion_shards = request_from_predecessor.get(MOTION_SHARDS, 1)
+
+    # forward the unchanged request first, so the next box can set up its local data concurrently
+    next_party = next_party_in_ring(box_id, parties)
+    transport.send_data_to_other_party(request_from_predecessor, next_party.host, next_party.ring_port)
+
+    b = Box(box_data, criteria, central_pk, qid_trees, box_id, parties, transport, motion_backend, bit_width, number_of_motion_shards,
+            number_of_crypto_workers, request_from_predecessor.get(REQUEST_ID), request_from_predecessor.get(SPECIALIZATION),
+            request_from_predecessor.get(MOTION_SESSION))
+    b.perform_initial_round(counter_information_data, request_from_predecessor.get(BATCH))
+
+    while True:
+        request_from_predecessor = receive()
+
+        # data = {REQUEST_TYPE: RequestType.INSTRUCTION,
+        #         INFO: extracted_counter_nodes,
+        #         BEST_REFINEMENTS: best_refinements}
+
+        # data = {REQUEST_TYPE: RequestType.END,
+        #         DATA_ROWS: encrypted_rows}
+
+        if request_from_predecessor[REQUEST_TYPE] == RequestType.INSTRUCTION and SPECIALIZATION in request_from_predecessor:
+            b.perform_replay_round(request_from_predecessor[SPECIALIZATION], request_from_predecessor[INFO], request_from_predecessor.get(BATCH))
+        elif request_from_predecessor[REQUEST_TYPE] == RequestType.INSTRUCTION:
+            best_attr_index = request_from_predecessor[BEST_ATTRIBUTE_INDEX]
+            best_gen_label = request_from_predecessor[BEST_LABEL]
+            counter_information_data = request_from_predecessor[INFO]
+
+            b.perform_regular_round(best_attr_index, best_gen_label, counter_information_data, request_from_predecessor.get(BATCH))
+        elif request_from_predecessor[REQUEST_TYPE] == RequestType.END:
+            data_rows = request_from_predecessor[DATA_ROWS]
+
+            b.perform_secure_data_union_action(data_rows, request_from_predecessor.get(ROW_ENCRYPTION, ROW_ENCRYPTION_SEALED),
+                                               request_from_predecessor.get(SESSION_KEYS), request_from_predecessor.get(ROW_CODEC, ROW_CODEC_PICKLE),
+                                               request_from_predecessor.get(AGGREGATE_ROWS, False))
+            break
+        else:
+            raise Exception("Unexpected request type: {}".format(request_from_predecessor[REQUEST_TYPE]))
+
+    if box_data.cache.max_bytes > 0:
+        print(f"Box {box_id} cache: {box_data.cache}")
@@ -0,0 +1,266 @@
+"""
+The local data of a box serving several requests (see box.serve_requests), to which new records can be appended while
+the box is running, e.g., the records a hospital adds every day (see follow_append_file).
+
+The TIPS trees of finished requests are kept. A later request with the same criteria and QID hierarchies, which
+continues the specialization of the earlier request (a warm start, see central.Central), takes over its tree: the
+records appended in the meantime are routed down to the leaf nodes (see tips_nodes.append_records_to_link_heads), so
+only the counters of the leaf nodes they reach are updated, and only the refinements missing in the tree are performed.
+All other requests count the records matching their criteria from the root node.
+
+Requests with the same criteria (e.g., runs for several k or QID sets) share further results in a least recently used
+cache bounded by their estimated memory: the indices of the rows matching the criteria, the QID columns of these rows
+encoded as the children of the root of each QID hierarchy (see qid_hierarchy_node.QidNodeCoder) and the counters of the
+root node derived from them. The QID columns are encoded from the indices of the leaves covering the values, if the
+snapshot of the data stores them (see snapshot.read_data_leaf_codes), which saves looking up each value. The keys include the version of the data, which each append increments, and outdated
+results are dropped by the append.
+"""
+import csv
+import os
+import threading
+import uuid
+from typing import List, Optional, Tuple, Dict
+
+import numpy as np
+
+from src.constants import Data, Specialization, AttributeIndex, GeneralizationLabel
+from src.criteria import CriteriaIndex, Criterion, select_rows, matching_row_indices, select_by_row_indices
+from src.data_utils import parse_data_point
+from src.lru_cache import LruCache
+from src.qid_hierarchy_node import QidAttributeTrees, AbstractQidHierarchyNode, QidNodeCoder, qid_attribute_trees_key
+from src.tips_nodes import LinkHeads, setup_tips_root_node, setup_tips_link_heads, replay_refinements, \
+    append_records_to_link_heads
+
+DEFAULT_MAX_CACHED_TREES = 8
+DEFAULT_MAX_CACHE_BYTES = 64 * 2 ** 20
+DEFAULT_APPEND_POLL_INTERVAL = 1.0
+
+_COUNTER_BYTES = 100  # estimated size of a cached counter
+
+# the criteria and the labels of the QID hierarchies of a request
+_TreeKey = Tuple[tuple, tuple]
+# the labels of the leaves of a QID hierarchy and the index of the leaf covering the value of each row (-1 for none)
+LeafCodes = Tuple[List[GeneralizationLabel], np.ndarray]
+
+
+class _TipsTree:
+    """ The TIPS tree of a finished request and the number of rows of the data it includes. """
+
+    def __init__(self, specialization: Specialization, link_heads: LinkHeads, number_of_rows: int):
+        self.specialization = specialization
+        self.link_heads = link_heads
+        self.number_of_rows = number_of_rows
+
+
+class BoxData:
+    """
+    The local data of a box and the TIPS trees kept for later requests, see module description.
+    """
+
+    def __init__(self, categories: List[str], rows: Data, criteria_index: Optional[CriteriaIndex] = None,
+                 max_cached_trees: int = DEFAULT_MAX_CACHED_TREES, max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+                 leaf_codes: Optional[Dict[AttributeIndex, LeafCodes]] = None):
+        """
+        :param categories: the categories of the data
+        :param rows: the data, appended records are added to this list
+        :param criteria_index: an index of the rows for selecting the rows matching the criteria of a request, shared
+            by all requests (default: a single pass over the rows for each request, see criteria.select_rows)
+        :param max_cached_trees: the maximum number of kept TIPS trees, the trees kept first are dropped first
+        :param max_cache_bytes: the maximum estimated memory of the cached selections, encoded columns and counters,
+            0 disables the cache
+        :param leaf_codes: the leaf codes of the QID columns of the rows, e.g., read from the snapshot of the data (see
+            snapshot.read_data_leaf_codes), appended records are encoded from their values
+        """
+        self.categories = categories
+        self.rows = rows
+        self.criteria_index = criteria_index
+        self.max_cached_trees = max_cached_trees
+        self.leaf_codes = leaf_codes or {}
+        self.version = 0  # incremented by each append
+        # distinguishes the data of this instance from the data of restarted boxes with the same version
+        self._data_id = uuid.uuid4().hex
+        # hit and miss counts of the cache are kept for all requests
+        self.cache = LruCache(max_cache_bytes)
+
+        self._tips_trees: Dict[_TreeKey, _TipsTree] = {}  # in the order they were kept
+        self._lock = threading.Lock()
+
+    def append(self, rows: Data):
+        """
+        Append records to the data. They are used by all requests starting afterwards, requests in progress keep
+        their records.
+
+        :param rows: the new records
+        """
+        with self._lock:
+            self.rows.extend(rows)
+            self.version += 1
+            version = self.version
+        self.cache.remove_if(lambda cache_key: cache_key[2] != version)
+
+    def data_version(self) -> str:
+        """
+        :return: the version of the data announced to the central, which changes with each append (see
+            central.query_data_versions)
+        """
+        return f"{self._data_id}:{self.version}"
+
+    def tips_tree(self, criteria: List[Criterion], qid_attribute_trees: QidAttributeTrees,
+                  specialization: Specialization) -> Tuple[LinkHeads, int]:
+        """
+        Set up the TIPS tree of a request for the records matching its criteria and perform the given refinements. The
+        kept tree of an earlier request, whose refinements are the first of the given ones, is taken over (see module
+        description).
+
+        :param criteria: the criteria of the request
+        :param qid_attribute_trees: the unspecialized qid attribute hierarchies of the request
+        :param specialization: the refinements to perform, e.g., of a warm start
+        :return: a tuple consisting of the TIPS tree (represented by link heads) and the number of rows of the data it
+            includes, which must be passed to keep_tips_tree
+        """
+        key = _tree_key(criteria, qid_attribute_trees)
+        with self._lock:
+            number_of_rows, version = len(self.rows), self.version
+            tree = self._tips_trees.get(key)
+            if tree is not None and tree.specialization == specialization[:len(tree.specialization)]:
+                # the tree is used by this request only
+                del self._tips_trees[key]
+                new_records = select_rows(self.categories, self.rows[tree.number_of_rows:number_of_rows], criteria)
+            else:
+                tree = None
+                records, row_indices = self._select(criteria, key[0], version)
+
+        if tree is None:
+            child_counts = self._root_child_counts(key[0], version, qid_attribute_trees, records, row_indices)
+            tips_root = setup_tips_root_node(records, qid_attribute_trees, child_counts)
+            return replay_refinements(setup_tips_link_heads(tips_root, qid_attribute_trees), specialization), number_of_rows
+
+        append_records_to_link_heads(tree.link_heads, new_records)
+        return replay_refinements(tree.link_heads, specialization[len(tree.specialization):]), number_of_rows
+
+    def keep_tips_tree(self, criteria: List[Criterion], qid_attribute_trees: QidAttributeTrees, specialization: Specialization,
+                       link_heads: LinkHeads, number_of_rows: int):
+        """
+        Keep the final TIPS tree of a request for later requests, see tips_tree.
+
+        :param criteria: the criteria of the request
+        :param qid_attribute_trees: the unspecialized qid attribute hierarchies of the request
+        :param specialization: the refinements performed in the tree
+        :param link_heads: the TIPS tree link heads
+        :param number_of_rows: the number of rows of the data included in the tree, as returned by tips_tree
+        """
+        if self.max_cached_trees <= 0:
+            return
+
+        key = _tree_key(criteria, qid_attribute_trees)
+        with self._lock:
+            self._tips_trees.pop(key, None)
+            self._tips_trees[key] = _TipsTree(list(specialization), link_heads, number_of_rows)
+            while len(self._tips_trees) > self.max_cached_trees:
+                del self._tips_trees[next(iter(self._tips_trees))]
+
+    def _select(self, criteria: List[Criterion], criteria_key: tuple, version: int) -> Tuple[Data, Optional[np.ndarray]]:
+        # the indices of the selected rows are None without criteria
+        if not criteria:
+            return list(self.rows), None
+
+        cache_key = ("rows", criteria_key, version)
+        row_indices = self.cache.get(cache_key)
+        if row_indices is None:
+            row_indices = self.criteria_index.matching_row_indices(criteria) if self.criteria_index is not None else \
+                matching_row_indices(self.categories, self.rows, criteria)
+            self.cache.put(cache_key, row_indices, row_indices.nbytes)
+        return select_by_row_indices(self.rows, row_indices), row_indices
+
+    def _root_child_counts(self, criteria_key: tuple, version: int, qid_attribute_trees: QidAttributeTrees,
+                           records: Data, row_indices: Optional[np.ndarray]) -> Dict[AttributeIndex, List[int]]:
+        cache_key = ("counters", criteria_key, version, qid_attribute_trees_key(qid_attribute_trees))
+        child_counts = self.cache.get(cache_key)
+        if child_counts is None:
+            child_counts = {attr_index: self._root_child_counts_for_attribute(criteria_key, version, attr_index, tree, records, row_indices)
+                            for attr_index, tree in qid_attribute_trees.items()}
+            self.cache.put(cache_key, child_counts, _COUNTER_BYTES * sum(len(counts) for counts in child_counts.values()))
+        return child_counts
+
+    def _root_child_counts_for_attribute(self, criteria_key: tuple, version: int, attr_index: AttributeIndex,
+                                         tree: AbstractQidHierarchyNode, records: Data, row_indices: Optional[np.ndarray]) -> List[int]:
+        if not tree.children:
+            return []
+
+        # shared by all QID sets containing the attribute
+        cache_key = ("column", criteria_key, version, qid_attribute_trees_key({attr_index: tree}))
+        codes = self.cache.get(cache_key)
+        if codes is None:
+            codes = self._root_child_codes(attr_index, tree, records, row_indices)
+            self.cache.put(cache_key, codes, codes.nbytes)
+        return np.bincount(codes[codes >= 0], minlength=len(tree.children)).tolist()
+
+    def _root_child_codes(self, attr_index: AttributeIndex, tree: AbstractQidHierarchyNode, records: Data,
+                          row_indices: Optional[np.ndarray]) -> np.ndarray:
+        child_coder = QidNodeCoder(tree.children)
+        children_of_leaves = _children_of_leaves(tree, self.leaf_codes[attr_index][0]) if attr_index in self.leaf_codes else None
+        # the center numbers of selected rows are removed (see criteria.select_by_row_indices)
+        if children_of_leaves is None or (attr_index == 0 and row_indices is not None):
+            return child_coder.codes([row[attr_index] for row in records])
+
+        leaf_codes = self.leaf_codes[attr_index][1]
+        if row_indices is None:
+            row_indices = np.arange(len(records))
+        coded = row_indices < len(leaf_codes)
+        codes = np.full(len(row_indices), -1, dtype=np.int32)
+        codes[coded] = leaf_codes[row_indices[coded]]
+        codes = children_of_leaves[codes]
+        # appended records and values not covered by a leaf, which can be covered by a child, e.g., the value of a child
+        uncoded = np.flatnonzero(codes < 0)
+        if len(uncoded):
+            codes[uncoded] = child_coder.codes([records[position][attr_index] for position in uncoded.tolist()])
+        return codes
+
+
+def follow_append_file(box_data: BoxData, path: str, poll_interval: float = DEFAULT_APPEND_POLL_INTERVAL,
+                       stop: Optional[threading.Event] = None, missing_value: str = '?'):
+    """
+    Append the records of a CSV file to the data of a running box, as long as records are written to the file, e.g., by
+    the system of the hospital running the box. The file has no header and the columns of the data. Its records are
+    appended once they are complete (end with a line break), the ones present initially right away. Records with
+    missing values (like data_utils.read_csv_data) or another number of fields are dropped.
+
+    :param box_data: the data of the box (see box.serve_requests)
+    :param path: the path of the file, which is waited for if it does not exist yet. The file must only grow.
+    :param poll_interval: seconds between checking the file for new records
+    :param stop: if set, following the file ends (default: follow it forever)
+    :param missing_value: records with fields being set to this value are dropped
+    """
+    stop = stop if stop is not None else threading.Event()
+    offset = 0
+    while not stop.is_set():
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(offset)
+                # an incomplete last line is read again with the next poll
+                complete = f.read().rpartition(b"\n")[0]
+            if complete:
+                offset += len(complete) + 1
+                records = [row for row in csv.reader(complete.decode().splitlines(), delimiter=',', quotechar='|') if row]
+                rows = [[parse_data_point(field) for field in row] for row in records
+                        if len(row) == len(box_data.categories) and missing_value not in row]
+                if rows:
+                    box_data.append(rows)
+                print(f"Appended {len(rows)} records of {path}, {len(records) - len(rows)} dropped (data version {box_data.version})", flush=True)
+        stop.wait(poll_interval)
+
+
+def _children_of_leaves(tree: AbstractQidHierarchyNode, leaf_labels: List[GeneralizationLabel]) -> Optional[np.ndarray]:
+    """
+    :return: the index of the child of the root covering each leaf, None if the leaves are not the ones of the tree
+    """
+    children_by_label = {leaf.node_label(): index for index, child in enumerate(tree.children) for leaf in child.leaves}
+    if len(children_by_label) != len(leaf_labels) or any(label not in children_by_label for label in leaf_labels):
+        return None
+    # the last entry is indexed by the code -1 of uncovered values
+    return np.array([children_by_label[label] for label in leaf_labels] + [-1], dtype=np.int32)
+
+
+def _tree_key(criteria: List[Criterion], qid_attribute_trees: QidAttributeTrees) -> _TreeKey:
+    return (tuple(tuple(str(part) for part in criterion) for criterion in criteria),
+            qid_attribute_trees_key(qid_attribute_trees))
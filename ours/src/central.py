@@ -1,21 +1,29 @@
 import pickle
 import time
-from operator import itemgetter
+import uuid
 from random import randint
 from typing import List, Callable, Dict, Any, Optional, Tuple
 
 from src import motion, communication, counter_information_data
+from src.aggregation import secure_sum_bit_width
+from src.communication import Transport
 from src.constants import REQUEST_TYPE, RequestType, CRITERIA, INFO, QID_ATTRIBUTE_TREES, CENTRAL_PK, \
     BEST_REFINEMENTS, DATA_ROWS, NR_DUMMIES_MIN, NR_DUMMIES_MAX, DUMMY_ROW, DUMMY, EncryptedData, Data, \
-    BestRefinements, PARTIES, BEST_ATTRIBUTE_INDEX, BEST_LABEL
+    BestRefinements, PARTIES, BEST_ATTRIBUTE_INDEX, BEST_LABEL, BIT_WIDTH, MOTION_SHARDS, BATCH, MOTION_SESSION, ROW_ENCRYPTION, SESSION_KEYS, ROW_CODEC, \
+    AGGREGATE_ROWS, REQUEST_ID, SPECIALIZATION, Specialization, DATA_VERSIONS
 from src.counter_information_data import CounterInformationData, counter_information_data_with_random_numbers, \
     substract_counter_information_data, counter_groups_from_counter_information_data, NodeCounterType, \
     CounterGroup, node_ids_from_counter_groups
-from src.crypto import generate_keys, encrypt_data_rows, decrypt_result
+from src.crypto import generate_keys, encrypt_data_rows, encrypt_data_rows_hybrid, decrypt_sorted_result, \
+    ROW_ENCRYPTION_SEALED, ROW_ENCRYPTION_HYBRID, SessionKey
+from src.data_utils import aggregate_rows, expand_rows, ROW_AGGREGATION_NONE, ROW_AGGREGATION_EXPANDED
+from src.row_codec import RowCodec, ROW_CODEC_COMPACT
 from src.qid_hierarchy_node import QidAttributeTrees
 from src.tips_nodes import setup_tips_root_node, setup_tips_leaf_nodes, TipsNode, perform_refinements, \
     extract_counter_information_data_from_tips_nodes, LeafNodes, find_best_refinements, setup_tips_link_heads, \
-    LinkHeads, perform_refinement, find_best_tips_link_head
+    LinkHeads, perform_refinement, find_best_tips_link_head, counter_groups_upper_bound, \
+    next_round_counter_groups_upper_bound, determine_counters, replay_refinements, leaf_nodes_from_link_heads, \
+    longest_valid_specialization
 
 
 class Central:
@@ -23,13 +31,35 @@ class Central:
 
     CENTRAL_ID = 0
 
-    def __init__(self, k: int, qid_attribute_trees: QidAttributeTrees, criteria_list: List, parties: [motion.Party], central_host, central_ring_port, central_motion_port):
+    def __init__(self, k: int, qid_attribute_trees: QidAttributeTrees, criteria_list: List, parties: [motion.Party], central_host, central_ring_port, central_motion_port,
+                 transport: Optional[Transport] = None, motion_backend=None, max_records_per_box: Optional[int] = None,
+                 number_of_motion_shards: int = 1, batch_window: Optional[float] = None, row_encryption: str = ROW_ENCRYPTION_SEALED,
+                 number_of_crypto_workers: int = 1, row_codec: str = ROW_CODEC_COMPACT, row_aggregation: str = ROW_AGGREGATION_NONE,
+                 specialization: Optional[Specialization] = None):
         """
         Initialize central component.
 
         :param k: the anonymity parameter for k-anonymity
         :param criteria_list: the requested criteria
-        :param send_data: a callable to send data to the next box in the ring topology
+        :param transport: the transport used to send data to the next box in the ring topology (default: sockets)
+        :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+        :param max_records_per_box: a public upper bound for the number of records of each box, used to choose the
+            bit width of the secure computation (default: the widest circuit of the backend)
+        :param number_of_motion_shards: the maximum number of concurrent MOTION sessions per round, announced to the
+            boxes (see motion.SecureSumsSession), reduced to the number of shards with valid ports
+        :param batch_window: if set, the secure computations of concurrent requests for the same boxes starting a round
+            within this many seconds are performed in a single call (see motion.SecureSumsSession.join_batch)
+        :param row_encryption: how all parties encrypt the rows of the secure set union (see crypto.ROW_ENCRYPTIONS)
+        :param number_of_crypto_workers: the number of processes decrypting the result rows in parallel
+        :param row_codec: how all parties encode the rows of the secure set union before encryption (see row_codec.ROW_CODECS)
+        :param row_aggregation: whether all parties send identical rows of the secure set union as a single row with their
+            multiplicity, and whether the result is expanded again (see data_utils.ROW_AGGREGATIONS)
+        :param specialization: warm start: the refinements of an earlier request with the same criteria and QID
+            hierarchies (see self.specialization), e.g., before records were appended to the boxes. All parties replay
+            them, the initial round validates the counters of all resulting leaf nodes and, if some leaf node has less
+            than k records, a second round sets up the TIPS tree with the first refinements only (see
+            tips_nodes.longest_valid_specialization). The regular rounds continue from there. (default: start from the
+            root node)
         """
         self.k = k
         self.criteria_list = criteria_list
@@ -39,26 +69,65 @@ class Central:
         self.qid_attribute_trees = qid_attribute_trees
 
         self._private_key, self._public_key = generate_keys()
+        # tags all messages of this request, so boxes can process several requests at once (see box.serve_requests)
+        self.request_id = uuid.uuid4().hex
 
         tips_root = setup_tips_root_node(raw_data_rows=None, qid_attributes=self.qid_attribute_trees)
         self._tips_link_heads: LinkHeads = setup_tips_link_heads(tips_root, self.qid_attribute_trees)
         self._newest_tips_nodes: List[TipsNode] = [tips_root]
+        # the refinements performed so far, which warm start later requests
+        self.specialization: Specialization = []
+        # whether the newest TIPS nodes are the leaf nodes of replayed refinements, which are validated by the next round
+        self._replayed = False
+        if specialization:
+            self._replay(specialization)
         # TODO LH which of these variables are still necessary for easy motion usage?
         # self._leaf_nodes: LeafNodes = setup_tips_leaf_nodes(tips_root)
         self._newest_counter_inf_data: Optional[CounterInformationData] = None
         self._relevant_counter_groups: Optional[List[CounterGroup]] = None
 
         self._best_refinement: Optional[Tuple[int, str]] = None
+        self._batch_window = batch_window
+        self._batch: Optional[motion.Batch] = None
+        self._row_encryption = row_encryption
+        self._number_of_crypto_workers = number_of_crypto_workers
+        self._row_codec = row_codec
+        self._codec = RowCodec(qid_attribute_trees) if row_codec == ROW_CODEC_COMPACT else None
+        self._row_aggregation = row_aggregation
+
+        # counters input into the secure computation, and counters with an already known result, which are not
+        self.number_of_secure_counters = 0
+        self.number_of_pruned_counter_groups = 0
+        self.number_of_pruned_counters = 0
+
+        self._transport = transport if transport is not None else communication.SocketTransport()
+        self._motion_backend = motion_backend
 
         if len(parties) <= 1:
             raise Exception("we require more than 1 party")
         for idx, p in enumerate(parties):
             if idx + 1 != p.id:
                 raise Exception("we expect ascending ids starting with 1, given: {}".format(parties))
-        self._parties = parties
         self._first_party = parties[0]  # used for ring topology
+        # all sums are bounded by the number of boxes times the maximum box size
+        self.bit_width = secure_sum_bit_width(len(parties), max_records_per_box, k) if max_records_per_box is not None else None
         central_party = motion.Party(self.CENTRAL_ID, central_host, central_ring_port, central_motion_port)
-        self._parties.insert(0, central_party)  # add central as party for other boxes
+        # add central as party for other boxes, the given list is left unchanged for further requests
+        self._parties = [central_party] + list(parties)
+
+        # the MOTION session is kept open for all rounds (and further requests with the same parties)
+        self.number_of_motion_shards = min(number_of_motion_shards, motion.max_number_of_shards(self._parties))
+        if self.number_of_motion_shards < number_of_motion_shards:
+            print(f"Using {self.number_of_motion_shards} instead of {number_of_motion_shards} MOTION shards, the ports of further shards would exceed {motion.MAX_PORT}")
+        self._motion_session = motion.open_session(self._parties, self.CENTRAL_ID, self._motion_backend, self.number_of_motion_shards)
+        self._motion_session.preprocess(*counter_groups_upper_bound(self._newest_tips_nodes))
+
+    def _replay(self, specialization: Specialization):
+        tips_root = setup_tips_root_node(raw_data_rows=None, qid_attributes=self.qid_attribute_trees)
+        self._tips_link_heads = replay_refinements(setup_tips_link_heads(tips_root, self.qid_attribute_trees), specialization)
+        self._newest_tips_nodes = leaf_nodes_from_link_heads(self._tips_link_heads)
+        self.specialization = list(specialization)
+        self._replayed = True
 
     def start_initial_round(self):
         """
@@ -69,18 +138,32 @@ class Central:
         relevant_tips_node_ids = node_ids_from_counter_groups(self._relevant_counter_groups)
 
         print(f"Central initial round: {relevant_tips_node_ids}", flush=True)
+        print(f"Central bit width: {self.bit_width}", flush=True)
+        if self.specialization:
+            print(f"Central warm start: {len(self.specialization)} replayed refinements", flush=True)
+        self._join_batch()
 
         data = {
             REQUEST_TYPE: RequestType.INFORMATION,
+            REQUEST_ID: self.request_id,
             CRITERIA: self.criteria_list,
             INFO: relevant_tips_node_ids,
+            SPECIALIZATION: self.specialization,
             QID_ATTRIBUTE_TREES: self.qid_attribute_trees,
             CENTRAL_PK: pickle.dumps(self._public_key),
-            PARTIES: self._parties
+            PARTIES: self._parties,
+            BIT_WIDTH: self.bit_width,
+            MOTION_SHARDS: self.number_of_motion_shards,
+            MOTION_SESSION: self._motion_session.session_id,
+            BATCH: self._batch
         }
 
         # query leading box
-        communication.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
+        self._transport.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
+
+    def _join_batch(self):
+        if self._batch_window is not None:
+            self._batch = self._motion_session.join_batch(self.k, self.bit_width, self._batch_window)
 
     def can_perform_round(self) -> bool:
         """
@@ -88,31 +171,66 @@ class Central:
 
         :return: True, if the data can be further specialized
         """
-        return self._best_refinement is not None
+        return self._replayed or self._best_refinement is not None
 
     def start_round(self):
         """
         Start a regular round of the algorithm:
         Refine the best suited attribute generalization and collect new count statistics (via secure sum protocol).
+        After an invalid warm start, the TIPS tree with the first refinements only is set up instead (see
+        complete_round).
         """
+        if self._replayed:
+            self._start_replay_round()
+            return
+
         best_attr_index, best_label = self._best_refinement
+        refined_nodes = list(self._tips_link_heads[best_attr_index][best_label])
         self._tips_link_heads, self._newest_tips_nodes = perform_refinement(self._tips_link_heads, best_attr_index,
                                                                             best_label)
+        self.specialization.append((best_attr_index, best_label))
 
         self._newest_counter_inf_data = extract_counter_information_data_from_tips_nodes(self._newest_tips_nodes)
+        # counter groups with an already known result are not requested
+        self._newest_counter_inf_data, pruned_groups, pruned_counters = determine_counters(self._newest_counter_inf_data,
+                                                                                           refined_nodes, best_attr_index)
+        self.number_of_pruned_counter_groups += pruned_groups
+        self.number_of_pruned_counters += pruned_counters
         self._relevant_counter_groups = counter_groups_from_counter_information_data(self._newest_counter_inf_data, only_undefined=True)
         relevant_tips_node_ids = node_ids_from_counter_groups(self._relevant_counter_groups)
 
         print(f"Central regular round: {relevant_tips_node_ids}", flush=True)
+        print(f"Central pruned counters: {pruned_counters} in {pruned_groups} groups, secure inputs: {len(relevant_tips_node_ids)}", flush=True)
+        self._join_batch()
 
         data = {
             REQUEST_TYPE: RequestType.INSTRUCTION,
+            REQUEST_ID: self.request_id,
             INFO: relevant_tips_node_ids,
             BEST_ATTRIBUTE_INDEX: best_attr_index,
-            BEST_LABEL: best_label
+            BEST_LABEL: best_label,
+            BATCH: self._batch
         }
 
-        communication.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
+        self._transport.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
+
+    def _start_replay_round(self):
+        self._newest_counter_inf_data = extract_counter_information_data_from_tips_nodes(self._newest_tips_nodes)
+        self._relevant_counter_groups = counter_groups_from_counter_information_data(self._newest_counter_inf_data, only_undefined=True)
+        relevant_tips_node_ids = node_ids_from_counter_groups(self._relevant_counter_groups)
+
+        print(f"Central replay round: {len(self.specialization)} refinements, {relevant_tips_node_ids}", flush=True)
+        self._join_batch()
+
+        data = {
+            REQUEST_TYPE: RequestType.INSTRUCTION,
+            REQUEST_ID: self.request_id,
+            INFO: relevant_tips_node_ids,
+            SPECIALIZATION: self.specialization,
+            BATCH: self._batch
+        }
+
+        self._transport.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
 
     def complete_round(self, blinded_counter_information: CounterInformationData):
         """
@@ -121,11 +239,12 @@ class Central:
         :param blinded_counter_information: the (blinded) count statistics
         """
         # run motion
-        motion_result_counters = motion.perform_protocol_secure_sums_gt_k(self._parties,
-                                                                          self.CENTRAL_ID,
-                                                                          self._relevant_counter_groups,
-                                                                          self.k
-                                                                          )
+        if self._batch is not None:
+            motion_result_counters = self._motion_session.perform_batched_secure_sums_gt_k(self._batch, self._relevant_counter_groups,
+                                                                                           self.k, self.bit_width)
+        else:
+            motion_result_counters = self._motion_session.perform_secure_sums_gt_k(self._relevant_counter_groups, self.k, self.bit_width)
+        self.number_of_secure_counters += len(node_ids_from_counter_groups(self._relevant_counter_groups))
 
         # incorporate motion results in counter_inf_data/leaf_nodes
         self._newest_counter_inf_data = counter_information_data.incorporate_counter_groups(self._newest_counter_inf_data,
@@ -133,22 +252,54 @@ class Central:
         for node in self._newest_tips_nodes:
             node.set_counter_values(self._newest_counter_inf_data[node.id])
 
+        if self._replayed and self._undo_invalid_refinements():
+            self._motion_session.preprocess(*counter_groups_upper_bound(self._newest_tips_nodes))
+            return
+        # preprocess for the next round, while choosing the next refinement
+        self._motion_session.preprocess(*next_round_counter_groups_upper_bound(self._tips_link_heads))
+
         self._best_refinement = find_best_tips_link_head(self._tips_link_heads, self.k)
         print(f"Next best refinement: {self._best_refinement}", flush=True)
 
+    def _undo_invalid_refinements(self) -> bool:
+        """
+        Undo replayed refinements, which result in leaf nodes with less than k records, by replaying the first
+        refinements only. Their leaf nodes are validated by the next round.
+
+        :return: True, if refinements were undone
+        """
+        self._replayed = False
+        number_of_refinements = longest_valid_specialization(self._newest_tips_nodes, self.specialization, self.k)
+        if number_of_refinements == len(self.specialization):
+            return False
+
+        print(f"Central warm start: undoing {len(self.specialization) - number_of_refinements} of {len(self.specialization)} refinements", flush=True)
+        self._replay(self.specialization[:number_of_refinements])
+        self._best_refinement = None
+        return True
+
     def start_secure_data_union(self):
         """
         Start the final algorithm phase: Collecting the data via secure set union protocol.
         """
         dummies = self._generate_dummies()
-        encrypted_rows = encrypt_data_rows(dummies, self._public_key)
+        if self._row_aggregation != ROW_AGGREGATION_NONE:
+            dummies = aggregate_rows(dummies)
 
         data = {
             REQUEST_TYPE: RequestType.END,
-            DATA_ROWS: encrypted_rows
+            REQUEST_ID: self.request_id,
+            ROW_ENCRYPTION: self._row_encryption,
+            ROW_CODEC: self._row_codec,
+            AGGREGATE_ROWS: self._row_aggregation != ROW_AGGREGATION_NONE
         }
+        if self._row_encryption == ROW_ENCRYPTION_HYBRID:
+            data[DATA_ROWS], session_key = encrypt_data_rows_hybrid(dummies, self._public_key, self._number_of_crypto_workers, self._codec)
+            data[SESSION_KEYS] = [session_key]
+        else:
+            data[DATA_ROWS] = encrypt_data_rows(dummies, self._public_key, self._number_of_crypto_workers, self._codec)
 
-        communication.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
+        self._transport.send_data_to_other_party(data, self._first_party.host, self._first_party.ring_port)
 
     @staticmethod
     def _generate_dummies(number_of_dummies: int = randint(NR_DUMMIES_MIN, NR_DUMMIES_MAX)) -> Data:
@@ -160,15 +311,115 @@ class Central:
 
         return [generate_dummy_row() for _ in range(number_of_dummies)]
 
-    def complete_secure_data_union(self, encrypted_result: EncryptedData) -> Data:
+    def complete_secure_data_union(self, encrypted_result: EncryptedData, session_keys: Optional[List[SessionKey]] = None) -> Data:
         """
         Complete the final algorithm phase.
 
         :param encrypted_result: the encrypted received secure set union protocol result data
-        :return: the anonymized result data
+        :param session_keys: the session keys of all parties (hybrid row encryption only)
+        :return: the anonymized result data (weighted rows for ROW_AGGREGATION_WEIGHTED)
         """
-        anonymized_result = decrypt_result(encrypted_result, self._private_key)
-        anonymized_result_without_dummies = [item for item in anonymized_result if item[0] != DUMMY]
-        sorted_anon_result = sorted(anonymized_result_without_dummies, key=itemgetter(1))
-
-        return sorted_anon_result
+        # dummies are dropped and rows are sorted by the worker processes
+        result = decrypt_sorted_result(encrypted_result, self._private_key, session_keys if self._row_encryption == ROW_ENCRYPTION_HYBRID else None,
+                                       self._number_of_crypto_workers, self._codec)
+        return expand_rows(result) if self._row_aggregation == ROW_AGGREGATION_EXPANDED else result
+
+
+def run_request(k: int, criteria_list: List, parties: [motion.Party], central_host, central_ring_port, central_motion_port,
+                qid_attribute_trees: QidAttributeTrees, transport: Optional[Transport] = None, motion_backend=None,
+                max_records_per_box: Optional[int] = None, number_of_motion_shards: int = 1, batch_window: Optional[float] = None,
+                row_encryption: str = ROW_ENCRYPTION_SEALED, number_of_crypto_workers: int = 1, row_codec: str = ROW_CODEC_COMPACT,
+                row_aggregation: str = ROW_AGGREGATION_NONE, specialization: Optional[Specialization] = None) -> Data:
+    """
+    Perform the required steps in the distributed algorithm to compute a request result.
+
+    :param k: the parameter for the anonymity metric
+    :param criteria_list: criteria for the request
+    :param parties: the participating boxes
+    :param central_host: the central host
+    :param central_ring_port: the central port for ring communication
+    :param central_motion_port: the central port for MOTION communication
+    :param qid_attribute_trees: the unspecialized qid attribute hierarchies
+    :param transport: the transport used for ring communication (default: sockets)
+    :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+    :param max_records_per_box: a public upper bound for the number of records of each box (see Central)
+    :param number_of_motion_shards: the maximum number of concurrent MOTION sessions per round (see Central)
+    :param batch_window: batch the secure computations of concurrent requests (see Central)
+    :param row_encryption: how the rows of the secure set union are encrypted (see Central)
+    :param number_of_crypto_workers: the number of processes decrypting the result rows in parallel
+    :param row_codec: how the rows of the secure set union are encoded before encryption (see Central)
+    :param row_aggregation: whether identical rows of the secure set union are sent once with their multiplicity (see Central)
+    :param specialization: the refinements of an earlier request to warm start from (see Central)
+    :return: the anonymized result data
+    """
+    transport = transport if transport is not None else communication.SocketTransport()
+    c = Central(k, qid_attribute_trees, criteria_list, parties, central_host, central_ring_port, central_motion_port,
+                transport, motion_backend, max_records_per_box, number_of_motion_shards, batch_window, row_encryption, number_of_crypto_workers,
+                row_codec, row_aggregation, specialization)
+    return perform_request(c, transport, central_host, central_ring_port)
+
+
+def perform_request(c: Central, transport: Transport, central_host, central_ring_port) -> Data:
+    """
+    Perform all rounds of a request, e.g., to keep its Central for the specialization afterwards (see run_request).
+
+    The boxes open their MOTION sessions on the box MOTION ports of the parties of the request. Requests performed at
+    the same time by independent centrals must therefore use disjoint box MOTION ports (including the ports of the
+    shards), otherwise their sessions collide. Requests of the same central either batch their rounds in its sessions
+    (see Central) or use shifted ports (see central_service.CentralService).
+
+    :param c: the central of the request
+    :param transport: the transport of the central
+    :param central_host: the central host
+    :param central_ring_port: the central port for ring communication
+    :return: the anonymized result data
+    """
+    # run initial round
+    c.start_initial_round()
+
+    response = transport.receive_data(central_host, central_ring_port)
+    counter_information: CounterInformationData = response[INFO]
+
+    c.complete_round(counter_information)
+
+    # perform rounds as long as further refinements are possible
+    while c.can_perform_round():
+        c.start_round()
+
+        response = transport.receive_data(central_host, central_ring_port)
+        blinded_counter_information: CounterInformationData = response[INFO]
+
+        c.complete_round(blinded_counter_information)
+
+    print(f"Central secure inputs: {c.number_of_secure_counters}, pruned counters: {c.number_of_pruned_counters} "
+          f"in {c.number_of_pruned_counter_groups} groups", flush=True)
+
+    # final secure set union
+    c.start_secure_data_union()
+
+    response = transport.receive_data(central_host, central_ring_port)
+    encrypted_result = response[DATA_ROWS]
+
+    anonymized_result = c.complete_secure_data_union(encrypted_result, response.get(SESSION_KEYS))
+    return anonymized_result
+
+
+def query_data_versions(parties: [motion.Party], central_host, central_ring_port, transport: Optional[Transport] = None) -> Dict[int, str]:
+    """
+    Collect the versions of the data of all boxes in one pass through the ring, e.g., to check whether a cached result
+    is still up to date. The boxes must serve requests in daemon mode (see box.serve_requests).
+
+    :param parties: the participating boxes
+    :param central_host: the central host
+    :param central_ring_port: the central port for ring communication
+    :param transport: the transport used for ring communication (default: sockets)
+    :return: the data version of each box by box id (see box_data.BoxData.data_version)
+    """
+    transport = transport if transport is not None else communication.SocketTransport()
+    central_party = motion.Party(Central.CENTRAL_ID, central_host, central_ring_port, None)
+    transport.send_data_to_other_party({
+        REQUEST_TYPE: RequestType.VERSIONS,
+        PARTIES: [central_party] + list(parties),
+        DATA_VERSIONS: {}
+    }, parties[0].host, parties[0].ring_port)
+    return transport.receive_data(central_host, central_ring_port)[DATA_VERSIONS]
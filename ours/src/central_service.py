@@ -0,0 +1,272 @@
+"""
+A central serving many requests for the same boxes, e.g., the requests of several analysts or the runs of an
+evaluation (see run_central.py).
+
+Each request is still performed by a Central of its own (see central.perform_request), the service multiplexes them
+over the boxes: It runs up to max_concurrent_requests requests side by side, each in a slot with ports of its own. The
+central ring port of slot i is the central ring port plus i * RING_PORT_STRIDE, so the responses of the boxes reach the
+Central of the request, and the MOTION ports of all parties are shifted by i times the ports used by the shards of a
+session (see motion.SecureSumsSession), so each slot has MOTION sessions of its own and the secure computations of
+concurrent requests do not interfere. The boxes take all ports from the requests and process the requests of all slots
+side by side (see box.serve_requests). The slots of independent services for the same boxes must not share box MOTION
+ports, e.g., by shifting the MOTION ports of the parties of one service beyond the slots of the other (see
+central.perform_request).
+
+Further requests wait in a queue of at most max_queued_requests requests, which are admitted in the order they were
+submitted. Requests exceeding the queue are rejected instead of delaying all others.
+
+Optionally, the results of finished requests are cached with their specialization and the data versions of the boxes
+(see central.query_data_versions), keyed by k, the criteria and the QID hierarchies of the request. Before each request,
+the service collects the data versions in one pass through the ring: If they equal the versions of a cached result, the
+result is returned right away, without any round or secure set union. Otherwise, the request warm starts from the
+cached specialization (see central.Central), so it validates the final TIPS tree of the cached result in one round and
+continues from there. The cache is least recently used and bounded by the size of the pickled results, results older
+than the time to live are dropped.
+
+Requests without a cached result can warm start from the specializations of related requests, e.g., with another k or
+further QIDs (see specialization_store.SpecializationStore).
+"""
+import pickle
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional, Dict, Deque
+
+from src import motion, communication
+from src.central import Central, perform_request, query_data_versions
+from src.communication import Transport
+from src.constants import Specialization, Data
+from src.lru_cache import LruCache
+from src.qid_hierarchy_node import QidAttributeTrees, qid_attribute_trees_key
+from src.specialization_store import SpecializationStore
+
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+DEFAULT_MAX_QUEUED_REQUESTS = 16
+DEFAULT_RESULT_TTL = 3600.0
+
+
+class AdmissionError(Exception):
+    """ Raised if a request exceeds the queue of the service. """
+
+
+class AnonymizationRequest:
+    """ A request of an analyst, see central.Central for the parameters. """
+
+    def __init__(self, k: int, criteria_list: List, qid_attribute_trees: QidAttributeTrees,
+                 specialization: Optional[Specialization] = None):
+        self.k = k
+        self.criteria_list = criteria_list
+        self.qid_attribute_trees = qid_attribute_trees
+        self.specialization = specialization
+
+        # set by the service
+        self.submission_time: Optional[float] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self.result_specialization: Optional[Specialization] = None  # the refinements of the result
+        self.cached_result = False  # whether the result was taken from the cache
+        self.warm_started = False  # whether the request warm started from the specialization of an earlier request
+
+
+class CentralService:
+    """
+    Performs the requests submitted by any number of threads, see module description.
+    """
+
+    RING_PORT_STRIDE = 100
+
+    def __init__(self, parties: List[motion.Party], central_host, central_ring_port, central_motion_port,
+                 transport: Optional[Transport] = None, motion_backend=None, number_of_motion_shards: int = 1,
+                 max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 max_queued_requests: int = DEFAULT_MAX_QUEUED_REQUESTS, max_cached_result_bytes: int = 0,
+                 result_ttl: Optional[float] = DEFAULT_RESULT_TTL, specialization_store: Optional[SpecializationStore] = None,
+                 **central_options):
+        """
+        :param parties: the participating boxes
+        :param central_host: the central host
+        :param central_ring_port: the central port for ring communication of the first slot
+        :param central_motion_port: the central port for MOTION communication of the first slot
+        :param transport: the transport used for ring communication (default: sockets)
+        :param motion_backend: the aggregation backend performing the secure computation (default: MOTION)
+        :param number_of_motion_shards: the number of concurrent MOTION sessions per round of each request
+        :param max_concurrent_requests: the number of requests performed side by side
+        :param max_queued_requests: the number of further requests waiting for a slot
+        :param max_cached_result_bytes: the maximum size of the cached results, 0 disables the cache. The boxes must
+            serve requests in daemon mode to announce their data versions (see box.serve_requests).
+        :param result_ttl: seconds a result is cached (None: until it is evicted)
+        :param specialization_store: if set, requests without a specialization warm start from related requests, and
+            the specializations of all requests are added to it
+        :param central_options: further parameters of the Central of each request, e.g., max_records_per_box
+        :raises ValueError: if the ports of the slots overlap or exceed the valid port numbers
+        """
+        self._central_host = central_host
+        self._transport = transport if transport is not None else communication.SocketTransport()
+        self._motion_backend = motion_backend
+        self._number_of_motion_shards = number_of_motion_shards
+        self._central_options = central_options
+        self.max_queued_requests = max_queued_requests
+        # (data versions, result, specialization) by request key
+        self.result_cache = LruCache(max_cached_result_bytes, result_ttl)
+        self.specialization_store = specialization_store
+
+        motion_port_stride = number_of_motion_shards * motion.SecureSumsSession.SHARD_PORT_STRIDE
+        # (central ring port, central motion port, boxes) of each slot
+        self._slots = [(central_ring_port + slot * self.RING_PORT_STRIDE, central_motion_port + slot * motion_port_stride,
+                        [motion.Party(p.id, p.host, p.ring_port, p.motion_port + slot * motion_port_stride) for p in parties])
+                       for slot in range(max_concurrent_requests)]
+        box_ring_ports = {p.ring_port for p in parties}
+        for ring_port, motion_port, slot_parties in self._slots:
+            if ring_port in box_ring_ports:
+                raise ValueError(f"The central ring port {ring_port} of a slot is the ring port of a box")
+            if motion.max_number_of_shards([motion.Party(0, central_host, ring_port, motion_port)] + slot_parties) < number_of_motion_shards:
+                raise ValueError(f"The MOTION ports of {max_concurrent_requests} slots with {number_of_motion_shards} shards exceed {motion.MAX_PORT}")
+
+        # the metrics of all finished requests
+        self.number_of_completed_requests = 0
+        self.number_of_failed_requests = 0
+        self.number_of_rejected_requests = 0
+        self.number_of_cached_results = 0
+        self.number_of_warm_starts = 0
+        self.latencies: List[float] = []  # seconds from submission to result
+        self.waiting_times: List[float] = []  # seconds from submission to start
+        self._first_submission_time: Optional[float] = None
+        self._last_end_time: Optional[float] = None
+
+        self._queue: Deque = deque()  # (request, future)
+        self._number_of_running_requests = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._serve_slot, args=slot, daemon=True) for slot in self._slots]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, request: AnonymizationRequest) -> Future:
+        """
+        Queue a request.
+
+        :param request: the request
+        :return: a future of the anonymized result data
+        :raises AdmissionError: if max_queued_requests requests are waiting already
+        """
+        with self._condition:
+            if self._closed:
+                raise AdmissionError("The service is closed")
+            # requests taken by a slot are running already, so admissions do not depend on the timing of the slots
+            if self._number_of_running_requests + len(self._queue) >= len(self._slots) + self.max_queued_requests:
+                self.number_of_rejected_requests += 1
+                raise AdmissionError(f"{self.max_queued_requests} requests are waiting already")
+            request.submission_time = time.perf_counter()
+            if self._first_submission_time is None:
+                self._first_submission_time = request.submission_time
+            future = Future()
+            self._queue.append((request, future))
+            self._condition.notify()
+            return future
+
+    def close(self):
+        """
+        Perform the queued requests and stop the service afterwards.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _serve_slot(self, central_ring_port: int, central_motion_port: int, parties: List[motion.Party]):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                request, future = self._queue.popleft()
+                self._number_of_running_requests += 1
+
+            request.start_time = time.perf_counter()
+            try:
+                result = self._perform(request, central_ring_port, central_motion_port, parties)
+            except Exception as e:
+                self._finish(request, failed=True)
+                future.set_exception(e)
+            else:
+                self._finish(request, failed=False)
+                future.set_result(result)
+
+    def _perform(self, request: AnonymizationRequest, central_ring_port: int, central_motion_port: int, parties: List[motion.Party]) -> Data:
+        key = None
+        specialization = request.specialization
+        if self.result_cache.max_bytes > 0:
+            key = (request.k, tuple(tuple(criterion) for criterion in request.criteria_list), qid_attribute_trees_key(request.qid_attribute_trees))
+            data_versions = query_data_versions(parties, self._central_host, central_ring_port, self._transport)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                cached_data_versions, cached_result, cached_specialization = cached
+                if cached_data_versions == data_versions:
+                    request.cached_result = True
+                    request.result_specialization = list(cached_specialization)
+                    return [list(row) for row in cached_result]
+                if specialization is None:
+                    request.warm_started = True
+                    specialization = cached_specialization
+        if specialization is None and self.specialization_store is not None:
+            specialization = self.specialization_store.related_specialization(request.k, request.criteria_list, request.qid_attribute_trees)
+            request.warm_started = specialization is not None
+
+        c = Central(request.k, request.qid_attribute_trees, request.criteria_list, parties, self._central_host, central_ring_port,
+                    central_motion_port, self._transport, self._motion_backend, number_of_motion_shards=self._number_of_motion_shards,
+                    specialization=specialization, **self._central_options)
+        result = perform_request(c, self._transport, self._central_host, central_ring_port)
+        request.result_specialization = c.specialization
+
+        if self.specialization_store is not None:
+            self.specialization_store.add(request.k, request.criteria_list, request.qid_attribute_trees, c.specialization)
+        if key is not None:
+            self.result_cache.put(key, (data_versions, [list(row) for row in result], list(c.specialization)), len(pickle.dumps(result)))
+        return result
+
+    def _finish(self, request: AnonymizationRequest, failed: bool):
+        request.end_time = time.perf_counter()
+        with self._condition:
+            self._number_of_running_requests -= 1
+            if failed:
+                self.number_of_failed_requests += 1
+                return
+            self.number_of_completed_requests += 1
+            self.number_of_cached_results += request.cached_result
+            self.number_of_warm_starts += request.warm_started
+            self.latencies.append(request.end_time - request.submission_time)
+            self.waiting_times.append(request.start_time - request.submission_time)
+            self._last_end_time = request.end_time
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        :return: the throughput (completed requests per second since the first submission) and the mean, median and
+            95th percentile of the latencies of the completed requests, the waiting times and the request counts
+            (including the requests answered from the cache or warm started from a cached result)
+        """
+        with self._condition:
+            latencies, waiting_times = sorted(self.latencies), list(self.waiting_times)
+            metrics = {"completed": self.number_of_completed_requests, "failed": self.number_of_failed_requests,
+                       "rejected": self.number_of_rejected_requests, "cached": self.number_of_cached_results,
+                       "warm_started": self.number_of_warm_starts, "running": self._number_of_running_requests,
+                       "queued": len(self._queue)}
+            duration = self._last_end_time - self._first_submission_time if self._last_end_time is not None else 0.0
+        if latencies:
+            metrics.update({"throughput": len(latencies) / duration if duration > 0 else 0.0,
+                            "latency_mean": statistics.mean(latencies), "latency_median": statistics.median(latencies),
+                            "latency_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                            "waiting_time_mean": statistics.mean(waiting_times)})
+        return metrics
+
+    def __str__(self) -> str:
+        metrics = self.metrics()
+        text = f"{metrics['completed']} completed ({metrics['cached']} cached, {metrics['warm_started']} warm started), " \
+               f"{metrics['failed']} failed, {metrics['rejected']} rejected requests"
+        if "throughput" in metrics:
+            text += f", {metrics['throughput']:.2f} requests/s, latency mean {metrics['latency_mean']:.3f} s, " \
+                    f"median {metrics['latency_median']:.3f} s, 95th percentile {metrics['latency_p95']:.3f} s, " \
+                    f"waiting time mean {metrics['waiting_time_mean']:.3f} s"
+        return text
@@ -1,34 +1,64 @@
 """
 This module contains simple communication related functions for initial testing, which will be replaced by
 more suitable communication methods in the productive system.
+
+Parties do not use these functions directly, but a Transport. The SocketTransport uses the plain socket functions
+below, the UnixSocketTransport avoids the TCP stack for parties on the same host and the InProcessTransport allows
+running all parties as threads of a single process.
 """
 
+import errno
+import ipaddress
+import os
 import pickle
 import socket
-from typing import Any, Dict
+import struct
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Queue
+from typing import Any, Dict, Tuple, Optional
 
 
 DEFAULT_PORT = 4442
 LOCALHOST = "localhost"
 
+UNIX_SOCKET_DIR = tempfile.gettempdir()
+SHARED_MEMORY_THRESHOLD = 4 * 1024 * 1024  # payloads of at least this size are handed over via shared memory
+CONNECT_RETRY_INTERVAL = 0.0001  # seconds, yields the CPU to the (local) receiver while it is not listening yet
+
+_INLINE_PAYLOAD = b"D"
+_SHARED_MEMORY_PAYLOAD = b"S"
+
 
 def receive_data(host: str = LOCALHOST, port: int = DEFAULT_PORT) -> Any:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))  # wait for response and collect parts
+    with _listen(host, port) as s:
+        return _receive_pickled(s)
 
-        s.listen()
-        conn, addr = s.accept()
 
-        data = []
-        with conn:
-            while True:
-                packet = conn.recv(4096)
-                if not packet:
-                    break
-                data.append(packet)
+def _listen(host: str, port: int) -> socket.socket:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((host, port))
+    s.listen()
+    return s
 
-        return pickle.loads(b"".join(data))
+
+def _receive_pickled(listener: socket.socket) -> Any:
+    conn, addr = listener.accept()
+
+    data = []
+    with conn:
+        while True:
+            packet = conn.recv(4096)
+            if not packet:
+                break
+            data.append(packet)
+
+    return pickle.loads(b"".join(data))
 
 
 def send_data_to_other_party(data: Dict, host: str = LOCALHOST, port: int = DEFAULT_PORT) -> Any:
@@ -44,3 +74,267 @@ def send_data_to_other_party(data: Dict, host: str = LOCALHOST, port: int = DEFA
                 pass
 
         s.sendall(pickle.dumps(data))
+
+
+class Transport(ABC):
+    """
+    A transport delivers protocol messages between parties, which are addressed by host and (ring) port.
+    """
+
+    @abstractmethod
+    def receive_data(self, host: str, port: int) -> Any:
+        """
+        Block until a message for the given address arrives and return it.
+
+        :param host: the own host
+        :param port: the own port
+        :return: the received message
+        """
+        pass
+
+    @abstractmethod
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        """
+        Deliver a message to another party.
+
+        :param data: the message
+        :param host: the host of the receiving party
+        :param port: the port of the receiving party
+        """
+        pass
+
+    def close(self):
+        """
+        Stop listening on all addresses of this transport, e.g., so another transport can receive on them.
+        """
+        pass
+
+
+class _Listeners:
+    """
+    The listening sockets of a transport, one per address, which are kept open for all messages. Messages of several
+    senders arriving at the same time (e.g., of concurrent requests) wait in the backlog of the socket for the next
+    receive_data, instead of being lost while no socket is listening.
+    """
+
+    def __init__(self, listen):
+        self._listen = listen
+        self._sockets: Dict[Any, socket.socket] = {}
+        self._lock = threading.Lock()
+
+    def get(self, address) -> socket.socket:
+        with self._lock:
+            if address not in self._sockets:
+                self._sockets[address] = self._listen(address)
+            return self._sockets[address]
+
+    def close(self):
+        with self._lock:
+            for s in self._sockets.values():
+                if s.family == socket.AF_UNIX:
+                    os.unlink(s.getsockname())
+                s.close()
+            self._sockets.clear()
+
+
+class SocketTransport(Transport):
+    """
+    Transport via one TCP connection per message, as used by the run_box and run_central scripts.
+    """
+
+    def __init__(self):
+        self._listeners = _Listeners(lambda address: _listen(*address))
+
+    def receive_data(self, host: str, port: int) -> Any:
+        return _receive_pickled(self._listeners.get((host, port)))
+
+    def close(self):
+        self._listeners.close()
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        send_data_to_other_party(data, host, port)
+
+
+def is_local_host(host: str) -> bool:
+    """
+    Returns True, if the host is a loopback address. Parties addressed this way necessarily run on the same host as
+    their peers, so both sides can decide about local communication based on the party configuration alone.
+    """
+    if host == LOCALHOST:
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def unix_socket_path(port: int) -> str:
+    return os.path.join(UNIX_SOCKET_DIR, "dsp-{}.sock".format(port))
+
+
+def _receive_all(conn: socket.socket) -> bytes:
+    data = []
+    while True:
+        packet = conn.recv(65536)
+        if not packet:
+            break
+        data.append(packet)
+    return b"".join(data)
+
+
+def _is_listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
+class UnixSocketTransport(Transport):
+    """
+    Transport via one Unix domain socket connection per message for parties on the same host. The socket path is
+    derived from the port of the receiving party.
+
+    Large payloads are written to a shared memory segment instead, only its name is sent via the socket. The receiver
+    unlinks the segment after reading it.
+    """
+
+    def __init__(self, shared_memory_threshold: Optional[int] = SHARED_MEMORY_THRESHOLD):
+        """
+        :param shared_memory_threshold: minimal payload size for using shared memory, None disables shared memory
+        """
+        self._shared_memory_threshold = shared_memory_threshold
+        self._listeners = _Listeners(self._listen)
+
+    @staticmethod
+    def _listen(port: int) -> socket.socket:
+        path = unix_socket_path(port)
+        if os.path.exists(path):
+            if _is_listening(path):
+                # like binding a TCP port in use, instead of taking over the socket of a running party
+                raise OSError(errno.EADDRINUSE, f"Port {port} is used by a running process", path)
+            os.unlink(path)  # stale socket of a previous process
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(path)
+        s.listen()
+        return s
+
+    def close(self):
+        self._listeners.close()
+
+    def receive_data(self, host: str, port: int) -> Any:
+        message = b""
+        while not message:  # empty connections only check whether the socket is in use (see _is_listening)
+            conn, _ = self._listeners.get(port).accept()
+            with conn:
+                message = _receive_all(conn)
+
+        kind, payload = message[:1], message[1:]
+        if kind == _SHARED_MEMORY_PAYLOAD:
+            return self._load_from_shared_memory(payload)
+        return pickle.loads(payload)
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        payload = pickle.dumps(data)
+        if self._shared_memory_threshold is not None and len(payload) >= self._shared_memory_threshold:
+            message = _SHARED_MEMORY_PAYLOAD + self._write_shared_memory(payload)
+        else:
+            message = _INLINE_PAYLOAD + payload
+
+        path = unix_socket_path(port)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            connected = False
+            while not connected:
+                try:
+                    s.connect(path)
+                    connected = True
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # We expect the next party to be online, otherwise we just simply try again
+                    time.sleep(CONNECT_RETRY_INTERVAL)
+
+            s.sendall(message)
+
+    @staticmethod
+    def _write_shared_memory(payload: bytes) -> bytes:
+        shm = SharedMemory(create=True, size=len(payload))
+        shm.buf[:len(payload)] = payload
+        # ownership passes to the receiver, which unlinks the segment after reading
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm.close()
+        return struct.pack("!Q", len(payload)) + shm.name.encode()
+
+    @staticmethod
+    def _load_from_shared_memory(reference: bytes) -> Any:
+        length = struct.unpack("!Q", reference[:8])[0]
+        shm = SharedMemory(name=reference[8:].decode())
+        payload = shm.buf[:length]
+        try:
+            return pickle.loads(payload)  # unpickle without copying the payload first
+        finally:
+            payload.release()
+            shm.close()
+            shm.unlink()
+
+
+class AutoTransport(Transport):
+    """
+    Chooses the transport per address based on the party configuration: Unix domain sockets (and shared memory) for
+    loopback addresses, TCP sockets otherwise.
+    """
+
+    def __init__(self, shared_memory_threshold: Optional[int] = SHARED_MEMORY_THRESHOLD):
+        self._local_transport = UnixSocketTransport(shared_memory_threshold)
+        self._remote_transport = SocketTransport()
+
+    def _transport_for(self, host: str) -> Transport:
+        return self._local_transport if is_local_host(host) else self._remote_transport
+
+    def receive_data(self, host: str, port: int) -> Any:
+        return self._transport_for(host).receive_data(host, port)
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        self._transport_for(host).send_data_to_other_party(data, host, port)
+
+    def close(self):
+        self._local_transport.close()
+        self._remote_transport.close()
+
+
+TRANSPORTS = {
+    "auto": AutoTransport,
+    "tcp": SocketTransport,
+    "unix": UnixSocketTransport,
+}
+
+
+class InProcessTransport(Transport):
+    """
+    Transport between threads of one process using one queue per address.
+
+    Messages are pickled on sending, so receivers never share objects with senders (just like with real sockets),
+    and the number of messages and bytes is recorded.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Tuple[str, int], Queue] = {}
+        self._lock = threading.Lock()
+        self.number_of_messages = 0
+        self.number_of_bytes = 0
+
+    def _queue(self, host: str, port: int) -> Queue:
+        with self._lock:
+            if (host, port) not in self._queues:
+                self._queues[(host, port)] = Queue()
+            return self._queues[(host, port)]
+
+    def receive_data(self, host: str, port: int) -> Any:
+        return pickle.loads(self._queue(host, port).get())
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        serialized_data = pickle.dumps(data)
+        with self._lock:
+            self.number_of_messages += 1
+            self.number_of_bytes += len(serialized_data)
+        self._queue(host, port).put(serialized_data)
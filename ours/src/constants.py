@@ -1,5 +1,5 @@
 from enum import IntEnum
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Tuple
 
 
 # constants for dummies used in secure set union
@@ -21,12 +21,24 @@ BEST_ATTRIBUTE_INDEX = "best_attribute_index"
 BEST_LABEL = "best_label"
 DATA_ROWS = "data_rows"
 PARTIES = "parties"
+BIT_WIDTH = "bit_width"
+MOTION_SHARDS = "motion_shards"
+BATCH = "batch"
+MOTION_SESSION = "motion_session"
+ROW_ENCRYPTION = "row_encryption"
+SESSION_KEYS = "session_keys"
+ROW_CODEC = "row_codec"
+AGGREGATE_ROWS = "aggregate_rows"
+REQUEST_ID = "request_id"
+SPECIALIZATION = "specialization"
+DATA_VERSIONS = "data_versions"
 
 
 class RequestType(IntEnum):
     INFORMATION = 1
     INSTRUCTION = 2
     END = 3
+    VERSIONS = 4  # collects the data versions of all boxes, not part of a request
 
 
 # Supporting types placed here to prevent circular imports occuring otherwise
@@ -42,3 +54,6 @@ Data = List[List[Any]]
 EncryptedData = List[bytes]
 
 BestRefinements = Dict[TipsNodeId, AttributeIndex]
+
+# refinements given by attribute index and generalization label, in the order they were performed
+Specialization = List[Tuple[AttributeIndex, GeneralizationLabel]]
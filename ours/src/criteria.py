@@ -0,0 +1,184 @@
+"""
+Selection of the local rows matching the criteria of a request (see Box).
+
+A criterion is a list [category, operator, value] with the operators "=", "<", ">" and a numerical value. The index
+keeps for each column the numerical values sorted with their row indices, so the matching rows of each operator are a
+range found by binary search. It is built on the first criterion for a column, further criteria cost O(log n + matches)
+instead of a pass over all rows. Row indices of several criteria are intersected, the source rows are never changed.
+
+Building the index of a column costs several passes, so it pays off only if it is reused by several requests (see
+serve_requests). A single selection uses select_rows, which compares each criterion column in one vectorised pass.
+Rows appended to the data (see box_data.BoxData) are merged into the built column indices by the next selection.
+"""
+import threading
+from typing import List, Dict, Tuple, Optional, Union, Callable
+
+import numpy as np
+
+from src.constants import Data
+
+Criterion = List  # [category, operator, value]
+
+_OPERATORS = ["=", "<", ">"]
+
+# the sorted numerical values of a column, their row indices and the number of indexed rows
+_ColumnIndex = Tuple[np.ndarray, np.ndarray, int]
+
+
+class CriteriaIndex:
+    """
+    Indexes of the numerical values of a data set, see module description. Values of other types (e.g., the empty
+    strings of missing values) match no criterion.
+    """
+
+    def __init__(self, data_categories: List[str], data: Data):
+        self._data_categories = data_categories
+        self._data = data
+        self._column_indices: Dict[int, _ColumnIndex] = {}
+        self._lock = threading.Lock()
+
+    def build(self, categories: Optional[List[str]] = None):
+        """
+        Build the indices of the columns in advance, e.g., when a box is started, so no request pays for them.
+
+        :param categories: the categories of the columns to index (default: all)
+        """
+        for category in categories if categories is not None else self._data_categories:
+            self._column_index(self._data_categories.index(category))
+
+    def select(self, criteria: List[Criterion]) -> Data:
+        """
+        :param criteria: the criteria of the request
+        :return: all rows without criteria, otherwise copies of the matching rows with their center number removed
+        """
+        return select_by_row_indices(self._data, _matching_row_indices(self._data_categories, criteria, self._matching_row_indices))
+
+    def matching_row_indices(self, criteria: List[Criterion]) -> Optional[np.ndarray]:
+        """
+        :param criteria: the criteria of the request
+        :return: the ascending indices of the rows matching all criteria, None without criteria
+        """
+        return _matching_row_indices(self._data_categories, criteria, self._matching_row_indices)
+
+    def _matching_row_indices(self, column: int, operator: str, value: Union[int, float]) -> np.ndarray:
+        sorted_values, row_indices, _ = self._column_index(column)
+        if operator == "=":
+            # the sort is stable, so the row indices of equal values are ascending
+            return row_indices[np.searchsorted(sorted_values, value, side="left"):np.searchsorted(sorted_values, value, side="right")]
+        if operator == "<":
+            matches = row_indices[:np.searchsorted(sorted_values, value, side="left")]
+        else:
+            matches = row_indices[np.searchsorted(sorted_values, value, side="right"):]
+        return np.sort(matches)
+
+    def _column_index(self, column: int) -> _ColumnIndex:
+        with self._lock:
+            number_of_rows = len(self._data)
+            if column not in self._column_indices:
+                values, row_indices = _numerical_column(self._data, column)
+                order = np.argsort(values, kind="stable")
+                self._column_indices[column] = values[order], row_indices[order], number_of_rows
+            elif self._column_indices[column][2] < number_of_rows:
+                sorted_values, sorted_row_indices, number_of_indexed_rows = self._column_indices[column]
+                new_values, new_row_indices = _numerical_column(self._data[number_of_indexed_rows:number_of_rows], column)
+                # the indexed rows come first, so the row indices of equal values stay ascending
+                values = np.concatenate((sorted_values, new_values))
+                row_indices = np.concatenate((sorted_row_indices, new_row_indices + number_of_indexed_rows))
+                order = np.argsort(values, kind="stable")
+                self._column_indices[column] = values[order], row_indices[order], number_of_rows
+            return self._column_indices[column]
+
+
+def select_rows(data_categories: List[str], data: Data, criteria: List[Criterion]) -> Data:
+    """
+    Select the rows matching the criteria without building an index, for a single request.
+
+    :param data_categories: the categories of the data
+    :param data: the data
+    :param criteria: the criteria of the request
+    :return: all rows without criteria, otherwise copies of the matching rows with their center number removed
+    """
+    return select_by_row_indices(data, matching_row_indices(data_categories, data, criteria))
+
+
+def matching_row_indices(data_categories: List[str], data: Data, criteria: List[Criterion]) -> Optional[np.ndarray]:
+    """
+    Same as CriteriaIndex.matching_row_indices, but without building an index.
+    """
+    def column_matches(column: int, operator: str, value: Union[int, float]) -> np.ndarray:
+        values, row_indices = _numerical_column(data, column)
+        if operator == "=":
+            return row_indices[values == value]
+        return row_indices[values < value] if operator == "<" else row_indices[values > value]
+
+    return _matching_row_indices(data_categories, criteria, column_matches)
+
+
+def select_by_row_indices(data: Data, row_indices: Optional[np.ndarray]) -> Data:
+    """
+    :param data: the data
+    :param row_indices: the indices of the rows matching the criteria of a request, None without criteria
+    :return: all rows without criteria, otherwise copies of the given rows with their center number removed
+    """
+    if row_indices is None:
+        return list(data)
+
+    result = []
+    for row_index in row_indices.tolist():
+        row = list(data[row_index])
+        row[0] = "*"  # remove center number
+        result.append(row)
+    return result
+
+
+def _matching_row_indices(data_categories: List[str], criteria: List[Criterion],
+                          column_matches: Callable[[int, str, Union[int, float]], np.ndarray]) -> Optional[np.ndarray]:
+    if not criteria:
+        return None
+
+    row_indices = None
+    for category, operator, raw_value in criteria:
+        if category not in data_categories:
+            print("Criterion '" + category + "' is not present in my database.")
+            return np.empty(0, dtype=np.int64)
+        value = _parse_value(raw_value)
+        if value is None:
+            print("This is not a numerical value: " + raw_value)
+            return np.empty(0, dtype=np.int64)
+        if operator not in _OPERATORS or value != value:  # NaN
+            return np.empty(0, dtype=np.int64)
+
+        matches = column_matches(data_categories.index(category), operator, value)
+        row_indices = matches if row_indices is None else np.intersect1d(row_indices, matches, assume_unique=True)
+        if len(row_indices) == 0:
+            break
+    return row_indices
+
+
+def _numerical_column(data: Data, column: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: the numerical values of a column except NaN and their ascending row indices
+    """
+    column_values = [row[column] for row in data]
+    values = np.array(column_values)
+    if values.dtype.kind in "iuf":
+        row_indices = np.arange(len(values))
+    else:
+        # values of other types, only the numerical ones are kept
+        numerical_rows = [(row_index, value) for row_index, value in enumerate(column_values) if type(value) in (int, float)]
+        row_indices = np.array([row_index for row_index, _ in numerical_rows], dtype=np.int64)
+        values = np.array([value for _, value in numerical_rows])
+    if values.dtype.kind == "f":
+        not_nan = ~np.isnan(values)
+        row_indices, values = row_indices[not_nan], values[not_nan]
+    return values, row_indices
+
+
+def _parse_value(raw_value) -> Optional[Union[int, float]]:
+    try:
+        return int(raw_value)
+    except ValueError:
+        try:
+            return float(raw_value)
+        except ValueError:
+            return None
@@ -1,9 +1,31 @@
+import heapq
+import multiprocessing
 import pickle
-from typing import List, Tuple
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from operator import itemgetter
+from typing import List, Tuple, Dict, Optional
 
-from nacl.public import SealedBox, PublicKey, PrivateKey
+from nacl.exceptions import CryptoError
+from nacl.public import SealedBox, PublicKey, PrivateKey, Box
 
-from src.constants import EncryptedData, Data
+from src.constants import EncryptedData, Data, DUMMY
+from src.row_codec import RowCodec
+
+# how the rows of the secure set union are encrypted for the central
+ROW_ENCRYPTION_SEALED = "sealed"  # a sealed box per row
+ROW_ENCRYPTION_HYBRID = "hybrid"  # one key agreement per party, a secret box per row
+ROW_ENCRYPTIONS = [ROW_ENCRYPTION_SEALED, ROW_ENCRYPTION_HYBRID]
+
+# the session public key and the number of rows encrypted with it, sealed for the central, so the parties forwarding it
+# learn neither
+SessionKey = bytes
+
+_NONCE_PERSONALIZATION = b"row nonce"
+
+# rows are only split into chunks for several worker processes, if each chunk contains at least this many rows
+MIN_ROWS_PER_CHUNK = 2000
 
 
 def generate_keys() -> Tuple[PrivateKey, PublicKey]:
@@ -17,35 +39,184 @@ def generate_keys() -> Tuple[PrivateKey, PublicKey]:
     return private_key, public_key
 
 
-def encrypt_data_rows(anonymized_rows: Data, central_pk: PublicKey) -> EncryptedData:
+def encrypt_data_rows(anonymized_rows: Data, central_pk: PublicKey, number_of_workers: int = 1, codec: Optional[RowCodec] = None) -> EncryptedData:
     """
     Encrypt data rows rowwise.
 
     :param anonymized_rows: the data rows
     :param central_pk: the required public key
+    :param number_of_workers: the number of processes encrypting chunks of the rows in parallel
+    :param codec: the encoding of the rows (default: pickle)
     :return: the encrypted data rows
     """
-    result: List[bytes] = []
-    sealed_box = SealedBox(central_pk)
-    for row in anonymized_rows:
-        serialized_row = pickle.dumps(row)
-        encrypted_row = sealed_box.encrypt(serialized_row)
-        result.append(encrypted_row)
-    return result
+    chunks = _chunks(anonymized_rows, number_of_workers)
+    return _map_chunks(_encrypt_sealed_chunk, [(chunk, bytes(central_pk), codec) for chunk in chunks], number_of_workers)
 
 
-def decrypt_result(encrypted_data_rows: EncryptedData, private_key: PrivateKey) -> Data:
+def decrypt_result(encrypted_data_rows: EncryptedData, private_key: PrivateKey, number_of_workers: int = 1, codec: Optional[RowCodec] = None) -> Data:
     """
     Decrypt encrypted data rows rowwise.
 
     :param encrypted_data_rows: the encrypted rows
     :param private_key: the required private key
+    :param number_of_workers: the number of processes decrypting chunks of the rows in parallel
+    :param codec: the encoding of the rows (default: pickle)
     :return: the decrypted data rows
     """
-    anonymized_result = []
+    return [row for chunk in _decrypt_chunks(encrypted_data_rows, private_key, None, number_of_workers, False, codec) for row in chunk]
+
+
+def encrypt_data_rows_hybrid(anonymized_rows: Data, central_pk: PublicKey, number_of_workers: int = 1,
+                             codec: Optional[RowCodec] = None) -> Tuple[EncryptedData, SessionKey]:
+    """
+    Encrypt data rows rowwise with a symmetric key, which is derived from a single key agreement with the central.
+    This avoids the key generation and key agreement per row of encrypt_data_rows.
+
+    The nonces are derived from the shared key (see _nonces), so they look random to everybody but the central and the
+    rows of all parties have the same shape. Unlike encrypt_data_rows, the central learns which rows were encrypted
+    by the same party (but not by which one, if the session keys are shuffled). The session key is sealed for the
+    central, the parties forwarding it only learn the total number of rows they receive, like with encrypt_data_rows.
+
+    :param anonymized_rows: the data rows
+    :param central_pk: the required public key
+    :param number_of_workers: the number of processes encrypting chunks of the rows in parallel
+    :param codec: the encoding of the rows (default: pickle)
+    :return: the encrypted data rows and the session key required for decryption
+    """
+    session_key = PrivateKey.generate()
+    shared_key = Box(session_key, central_pk).shared_key()
+
+    chunks = _chunks(anonymized_rows, number_of_workers)
+    first_row_indices = [sum(len(chunk) for chunk in chunks[:i]) for i in range(len(chunks))]
+    result = _map_chunks(_encrypt_hybrid_chunk, [(chunk, shared_key, i, codec) for chunk, i in zip(chunks, first_row_indices)], number_of_workers)
+    sealed_session_key = SealedBox(central_pk).encrypt(bytes(session_key.public_key) + len(anonymized_rows).to_bytes(8, "big"))
+    return result, bytes(sealed_session_key)
+
+
+def decrypt_result_hybrid(encrypted_data_rows: EncryptedData, private_key: PrivateKey, session_keys: List[SessionKey],
+                          number_of_workers: int = 1, codec: Optional[RowCodec] = None) -> Data:
+    """
+    Decrypt data rows encrypted by encrypt_data_rows_hybrid.
+
+    :param encrypted_data_rows: the encrypted rows
+    :param private_key: the required private key
+    :param session_keys: the session keys of all parties, which encrypted rows
+    :param number_of_workers: the number of processes decrypting chunks of the rows in parallel
+    :param codec: the encoding of the rows (default: pickle)
+    :return: the decrypted data rows
+    """
+    return [row for chunk in _decrypt_chunks(encrypted_data_rows, private_key, session_keys, number_of_workers, False, codec) for row in chunk]
+
+
+def decrypt_sorted_result(encrypted_data_rows: EncryptedData, private_key: PrivateKey, session_keys: Optional[List[SessionKey]] = None,
+                          number_of_workers: int = 1, codec: Optional[RowCodec] = None) -> Data:
+    """
+    Decrypt the result of the secure set union, drop the dummy rows and sort the remaining rows by their second column.
+    Each worker process sorts its chunk, the sorted chunks are merged while they are received.
+
+    :param encrypted_data_rows: the encrypted rows
+    :param private_key: the required private key
+    :param session_keys: the session keys of all parties for hybrid row encryption, None for sealed rows
+    :param number_of_workers: the number of processes decrypting chunks of the rows in parallel
+    :param codec: the encoding of the rows (default: pickle)
+    :return: the sorted rows without dummies
+    """
+    sorted_chunks = _decrypt_chunks(encrypted_data_rows, private_key, session_keys, number_of_workers, True, codec)
+    return list(heapq.merge(*sorted_chunks, key=itemgetter(1)))
+
+
+def _decrypt_chunks(encrypted_data_rows: EncryptedData, private_key: PrivateKey, session_keys: Optional[List[SessionKey]],
+                    number_of_workers: int, sorted_without_dummies: bool, codec: Optional[RowCodec]) -> List[Data]:
+    if session_keys is None:
+        chunks = _chunks(encrypted_data_rows, number_of_workers)
+        return _map_chunks(_decrypt_sealed_chunk, [(chunk, bytes(private_key), sorted_without_dummies, codec) for chunk in chunks],
+                           number_of_workers, concatenate=False)
+
     unseal_box = SealedBox(private_key)
-    for row in encrypted_data_rows:
-        decrypted_encoded_row = unseal_box.decrypt(row)
-        decrypted_row = pickle.loads(decrypted_encoded_row)
-        anonymized_result.append(decrypted_row)
-    return anonymized_result
+    opened_session_keys = [unseal_box.decrypt(session_key) for session_key in session_keys]
+    shared_keys = [Box(private_key, PublicKey(session_key[:PublicKey.SIZE])).shared_key() for session_key in opened_session_keys]
+
+    # the nonce of each row identifies its key, so no row has to be decrypted with several keys
+    key_indices_by_nonce: Dict[bytes, int] = {}
+    for key_index, (shared_key, session_key) in enumerate(zip(shared_keys, opened_session_keys)):
+        number_of_rows = int.from_bytes(session_key[PublicKey.SIZE:], "big")
+        key_indices_by_nonce.update((nonce, key_index) for nonce in _nonces(shared_key, number_of_rows))
+    key_indices = [key_indices_by_nonce.get(row[:Box.NONCE_SIZE]) for row in encrypted_data_rows]
+    if None in key_indices:
+        raise CryptoError("A row was not encrypted with any of the session keys")
+
+    chunks = _chunks(list(zip(encrypted_data_rows, key_indices)), number_of_workers)
+    return _map_chunks(_decrypt_hybrid_chunk, [(chunk, shared_keys, sorted_without_dummies, codec) for chunk in chunks],
+                       number_of_workers, concatenate=False)
+
+
+def _nonces(shared_key: bytes, number_of_nonces: int, first_index: int = 0) -> List[bytes]:
+    # unique per key, keys are never reused
+    keyed_hash = blake2b(digest_size=Box.NONCE_SIZE, key=shared_key, person=_NONCE_PERSONALIZATION)
+    nonces = []
+    for i in range(first_index, first_index + number_of_nonces):
+        h = keyed_hash.copy()
+        h.update(i.to_bytes(8, "big"))
+        nonces.append(h.digest())
+    return nonces
+
+
+# Chunks are handed to the worker processes as serialized bytes, the workers return serialized bytes as well.
+
+def _encrypt_sealed_chunk(serialized_rows: bytes, central_pk: bytes, codec: Optional[RowCodec]) -> bytes:
+    encode = codec.encode if codec is not None else pickle.dumps
+    sealed_box = SealedBox(PublicKey(central_pk))
+    return pickle.dumps([sealed_box.encrypt(encode(row)) for row in pickle.loads(serialized_rows)])
+
+
+def _encrypt_hybrid_chunk(serialized_rows: bytes, shared_key: bytes, first_row_index: int, codec: Optional[RowCodec]) -> bytes:
+    encode = codec.encode if codec is not None else pickle.dumps
+    rows = pickle.loads(serialized_rows)
+    box = Box.decode(shared_key)
+    return pickle.dumps([bytes(box.encrypt(encode(row), nonce)) for row, nonce in zip(rows, _nonces(shared_key, len(rows), first_row_index))])
+
+
+def _decrypt_sealed_chunk(serialized_rows: bytes, private_key: bytes, sorted_without_dummies: bool, codec: Optional[RowCodec]) -> bytes:
+    decode = codec.decode if codec is not None else pickle.loads
+    unseal_box = SealedBox(PrivateKey(private_key))
+    rows = [decode(unseal_box.decrypt(row)) for row in pickle.loads(serialized_rows)]
+    return pickle.dumps(_sort_without_dummies(rows) if sorted_without_dummies else rows)
+
+
+def _decrypt_hybrid_chunk(serialized_rows: bytes, shared_keys: List[bytes], sorted_without_dummies: bool, codec: Optional[RowCodec]) -> bytes:
+    decode = codec.decode if codec is not None else pickle.loads
+    boxes = [Box.decode(shared_key) for shared_key in shared_keys]
+    rows = [decode(boxes[key_index].decrypt(row)) for row, key_index in pickle.loads(serialized_rows)]
+    return pickle.dumps(_sort_without_dummies(rows) if sorted_without_dummies else rows)
+
+
+def _sort_without_dummies(rows: Data) -> Data:
+    return sorted((row for row in rows if row[0] != DUMMY), key=itemgetter(1))
+
+
+def _chunks(rows: list, number_of_workers: int) -> List[list]:
+    number_of_chunks = max(1, min(number_of_workers, len(rows) // MIN_ROWS_PER_CHUNK))
+    chunk_size = -(-len(rows) // number_of_chunks)
+    return [rows[i * chunk_size:(i + 1) * chunk_size] for i in range(number_of_chunks)]
+
+
+_process_pools: Dict[int, ProcessPoolExecutor] = {}
+_process_pools_lock = threading.Lock()
+
+
+def _map_chunks(function, arguments: List[tuple], number_of_workers: int, concatenate: bool = True) -> list:
+    # the first argument is the chunk
+    arguments = [(pickle.dumps(chunk),) + tuple(other_arguments) for chunk, *other_arguments in arguments]
+    if len(arguments) == 1:
+        results = [function(*arguments[0])]
+    else:
+        with _process_pools_lock:
+            if number_of_workers not in _process_pools:
+                # the worker processes are started from a separate server process, not from this multi-threaded one
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _process_pools[number_of_workers] = ProcessPoolExecutor(number_of_workers, multiprocessing.get_context(method))
+            pool = _process_pools[number_of_workers]
+        results = list(pool.map(function, *zip(*arguments)))
+
+    chunks = [pickle.loads(result) for result in results]
+    return [item for chunk in chunks for item in chunk] if concatenate else chunks
@@ -1,10 +1,34 @@
 import csv
 import itertools
 from collections import defaultdict, Counter
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
 
 from src.constants import AttributeIndex, Data
 
+# how the rows of the secure set union are sent: one row per record, or distinct rows with their multiplicity, which the
+# central expands again or returns as weighted rows (multiplicity as last column)
+ROW_AGGREGATION_NONE = "none"
+ROW_AGGREGATION_EXPANDED = "expanded"
+ROW_AGGREGATION_WEIGHTED = "weighted"
+ROW_AGGREGATIONS = [ROW_AGGREGATION_NONE, ROW_AGGREGATION_EXPANDED, ROW_AGGREGATION_WEIGHTED]
+
+
+class CsvStatistics:
+    """
+    Counts the data rows of a csv file and the rows dropped because of missing values.
+    """
+
+    def __init__(self, categories: List[str]):
+        self.categories = categories
+        self.number_of_rows = 0  # non-empty data rows, including the dropped ones
+        self.number_of_dropped_rows = 0
+        self.missing_values: Counter = Counter()  # number of missing values of the dropped rows per category
+
+    def __str__(self) -> str:
+        missing_values = ", ".join(f"{category}: {count}" for category, count in self.missing_values.most_common())
+        return f"{self.number_of_rows} rows, {self.number_of_dropped_rows} dropped because of missing values" + \
+            (f" ({missing_values})" if missing_values else "")
+
 
 def read_csv_data(data_path: str, delimiter: str = ',', missing_value: str = '?') -> Tuple[List[str], Data]:
     """
@@ -16,17 +40,40 @@ def read_csv_data(data_path: str, delimiter: str = ',', missing_value: str = '?'
 
     :return: the read data
     """
-    with open(data_path, newline='') as csvfile:
-        data_read = []
-        all_data = csv.reader(csvfile, delimiter=delimiter, quotechar='|')
-        categories = all_data.__next__()
+    categories, rows, _ = stream_csv_data(data_path, delimiter, missing_value)
+    return categories, [[parse_data_point(data_point) for data_point in row] for row in rows]
+
+
+def stream_csv_data(data_path: str, delimiter: str = ',', missing_value: str = '?') -> Tuple[List[str], Iterator[List[str]], CsvStatistics]:
+    """
+    Stream the unparsed rows of a csv file, which read_csv_data incorporates, without holding the file in memory.
+
+    :param data_path: the file path
+    :param delimiter: the csv file data delimiter
+    :param missing_value: rows with fields being set to this value are dropped
+    :return: the categories, the rows (as lists of fields) and the statistics, which are complete once all rows were read
+    """
+    csvfile = open(data_path, newline='')
+    all_data = csv.reader(csvfile, delimiter=delimiter, quotechar='|')
+    categories = all_data.__next__()
+    statistics = CsvStatistics(categories)
+    return categories, _complete_rows(csvfile, all_data, missing_value, statistics), statistics
+
+
+def _complete_rows(csvfile, all_data, missing_value: str, statistics: CsvStatistics) -> Iterator[List[str]]:
+    with csvfile:
         for row in itertools.islice(all_data, 1, None):
-            if missing_value not in row and len(row) > 0:  # remove missing value rows
-                data_read.append([_parse_data_point(data_point) for data_point in row])
-    return categories, data_read
+            if len(row) == 0:
+                continue
+            statistics.number_of_rows += 1
+            if missing_value in row:  # remove missing value rows
+                statistics.number_of_dropped_rows += 1
+                statistics.missing_values.update(category for category, data_point in zip(statistics.categories, row) if data_point == missing_value)
+                continue
+            yield row
 
 
-def _parse_data_point(data_point):
+def parse_data_point(data_point):
     my_value = str(data_point)
     try:
         my_value = int(data_point)
@@ -81,3 +128,25 @@ def compute_equivalence_class_sizes(data: Data, relevant_attribute_indices: List
     equiv_classes = extract_equivalence_classes(data, relevant_attribute_indices)
 
     return Counter([len(ec) for ec in equiv_classes.values()])
+
+
+def aggregate_rows(data: Data) -> Data:
+    """
+    Merge identical rows into a single row with their multiplicity appended as last column.
+
+    :param data: the data
+    :return: the distinct rows with their multiplicities, in order of their first occurrence
+    """
+    # the types are part of the key, so e.g. 1 and 1.0 are not merged
+    multiplicities = Counter((tuple(row), tuple(map(type, row))) for row in data)
+    return [list(row) + [multiplicity] for (row, _), multiplicity in multiplicities.items()]
+
+
+def expand_rows(weighted_data: Data) -> Data:
+    """
+    Inverse of aggregate_rows: repeat each row according to its multiplicity (the last column).
+
+    :param weighted_data: the rows with their multiplicities
+    :return: the data
+    """
+    return [row[:-1] for row in weighted_data for _ in range(row[-1])]
@@ -0,0 +1,148 @@
+"""
+A local stand-in for the MOTION pandapython library, which can be used if all parties run as threads of one process.
+
+It computes the same outputs as `pandapython.perform_arithmetic_then_bool_with_groups` in plain, i.e., it provides
+no security at all and must only be used for testing and profiling.
+"""
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+from src.aggregation import AggregationBackend, MotionParty, ZERO_MASK_VALUE, grouped_sums_gt_k
+
+
+class LocalMotion(AggregationBackend):
+    """
+    All parties (threads) call `perform_arithmetic_then_bool_with_groups` in each round. The call blocks until every
+    party has provided its inputs, then all parties receive the same result. Calls for different parties (e.g., the
+    shards of motion.SecureSumsSession on different ports) are independent rounds.
+
+    Like MOTION, each call sets up the party first. Sessions (see motion.SecureSumsSession) only set up once.
+    """
+
+    def __init__(self, delay_per_call: float = 0.0, setup_delay: float = 0.0, preprocessing_delay: float = 0.0):
+        """
+        :param delay_per_call: seconds added to each call, e.g., to emulate the communication rounds of MOTION in a WAN
+        :param setup_delay: seconds added to each party setup, e.g., to emulate base OTs
+        :param preprocessing_delay: seconds added per input counter, e.g., to emulate the input-independent MOTION
+            preprocessing (multiplication triples, OT extension)
+        """
+        self._delay_per_call = delay_per_call
+        self._setup_delay = setup_delay
+        self._preprocessing_delay = preprocessing_delay
+        self._condition = threading.Condition()
+        self._rounds: Dict[Tuple[MotionParty, ...], _Round] = {}
+        self.number_of_calls = 0
+        self.number_of_inputs = 0  # inputs of each party over all calls, the circuit size grows linearly with them
+        self.number_of_setups = 0
+        self.number_of_inputs_preprocessed_online = 0  # inputs, which required preprocessing on the critical path
+
+    def get_zero_mask_value(self) -> int:
+        return ZERO_MASK_VALUE
+
+    def perform_arithmetic_then_bool_with_groups(self, parties: List[MotionParty], my_id: int, my_inputs: List[List[int]], k: int,
+                                                 bit_width: Optional[int] = None) -> List[List[int]]:
+        self._setup_party()
+        self._preprocess(sum(len(g) for g in my_inputs), online=True)
+        return self._perform_round(parties, my_id, my_inputs, k, bit_width)
+
+    def open_session(self, parties: List[MotionParty], my_id: int) -> 'LocalMotionSession':
+        self._setup_party()
+        return LocalMotionSession(self, parties, my_id)
+
+    def _setup_party(self):
+        with self._condition:
+            self.number_of_setups += 1
+        if self._setup_delay:
+            time.sleep(self._setup_delay)
+
+    def _preprocess(self, number_of_counters: int, online: bool):
+        if online:
+            with self._condition:
+                self.number_of_inputs_preprocessed_online += number_of_counters
+        if self._preprocessing_delay:
+            time.sleep(number_of_counters * self._preprocessing_delay)
+
+    def _perform_round(self, parties: List[MotionParty], my_id: int, my_inputs: List[List[int]], k: int, bit_width: Optional[int]) -> List[List[int]]:
+        with self._condition:
+            current_round = self._rounds.setdefault(tuple(parties), _Round())
+            if my_id in current_round.inputs:
+                raise Exception("Party {} provided inputs twice in one round".format(my_id))
+            current_round.inputs[my_id] = my_inputs
+            current_round.k = max(current_round.k, k)  # only the central knows k, boxes use 0
+            current_round.bit_widths.add(bit_width)
+
+            if len(current_round.inputs) == len(parties):
+                current_round.results = current_round.evaluate()
+                self.number_of_calls += 1
+                self.number_of_inputs += sum(len(g) for g in my_inputs)
+                if self._delay_per_call:
+                    time.sleep(self._delay_per_call)  # all other parties are waiting for the result anyway
+                current_round.finished = True
+                del self._rounds[tuple(parties)]
+                self._condition.notify_all()
+            else:
+                while not current_round.finished:
+                    self._condition.wait()
+
+            return current_round.results
+
+
+class _Round:
+    """
+    The inputs of one round of LocalMotion, collected until all parties provided theirs.
+    """
+
+    def __init__(self):
+        self.inputs: Dict[int, List[List[int]]] = {}
+        self.k = 0
+        self.bit_widths = set()
+        self.finished = False
+        self.results: List[List[int]] = []
+
+    def evaluate(self) -> List[List[int]]:
+        all_inputs = list(self.inputs.values())
+        group_shapes = [[len(g) for g in inputs] for inputs in all_inputs]
+        if any(shape != group_shapes[0] for shape in group_shapes):
+            raise Exception("Parties provided differently shaped inputs: {}".format(group_shapes))
+
+        if len(self.bit_widths) > 1:
+            raise Exception("Parties provided different bit widths: {}".format(self.bit_widths))
+        bit_width = next(iter(self.bit_widths))
+
+        summed_inputs = [[sum(values) for values in zip(*groups)] for groups in zip(*all_inputs)]
+        if bit_width is not None and any(s >= 2 ** bit_width for group in summed_inputs for s in group):
+            # a real circuit would silently compute wrong results
+            raise Exception("Sums exceed the bit width of {} bits".format(bit_width))
+        return grouped_sums_gt_k(summed_inputs, self.k)
+
+
+class LocalMotionSession:
+    """
+    A set up party of the LocalMotion stand-in, which performs any number of rounds.
+    Preprocessing for upcoming rounds can be done in advance, only missing preprocessed inputs are produced online.
+    """
+
+    def __init__(self, local_motion: LocalMotion, parties: List[MotionParty], my_id: int):
+        self._local_motion = local_motion
+        self._parties = parties
+        self._my_id = my_id
+        self._preprocessed_counters = 0
+
+    def preprocess(self, number_of_groups: int, number_of_counters: int):
+        missing_counters = number_of_counters - self._preprocessed_counters
+        if missing_counters > 0:
+            self._local_motion._preprocess(missing_counters, online=False)
+            self._preprocessed_counters = number_of_counters
+
+    def perform_arithmetic_then_bool_with_groups(self, my_inputs: List[List[int]], k: int, bit_width: Optional[int] = None) -> List[List[int]]:
+        number_of_counters = sum(len(g) for g in my_inputs)
+        missing_counters = number_of_counters - self._preprocessed_counters
+        if missing_counters > 0:
+            self._local_motion._preprocess(missing_counters, online=True)
+        self._preprocessed_counters = 0  # correlated randomness must not be reused
+
+        return self._local_motion._perform_round(self._parties, self._my_id, my_inputs, k, bit_width)
+
+    def close(self):
+        pass
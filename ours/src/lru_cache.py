@@ -0,0 +1,88 @@
+"""
+A least recently used cache, which is bounded by the estimated memory of its values and counts its hits and misses.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Callable
+
+
+class LruCache:
+    """
+    Keeps values up to a maximum number of bytes, the least recently used values are evicted first. The sizes of the
+    values are estimated by the callers. Values older than the time to live are dropped on access. Thread-safe.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        """
+        :param max_bytes: the maximum sum of the sizes of all values, 0 disables the cache
+        :param ttl: seconds a value is kept after it was put (default: until it is evicted)
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.number_of_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict = OrderedDict()  # key -> (value, size, time put), the least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        :param key: the key
+        :return: the value, None if it is not kept
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, number_of_bytes: int):
+        """
+        Keep a value and evict the least recently used values exceeding the maximum size. Values larger than the
+        maximum size are not kept.
+
+        :param key: the key
+        :param value: the value, must not be None
+        :param number_of_bytes: the estimated size of the value
+        """
+        with self._lock:
+            self._remove(key)
+            if number_of_bytes > self.max_bytes:
+                return
+            self._entries[key] = value, number_of_bytes, time.monotonic()
+            self.number_of_bytes += number_of_bytes
+            while self.number_of_bytes > self.max_bytes:
+                _, (_, size, _) = self._entries.popitem(last=False)
+                self.number_of_bytes -= size
+                self.evictions += 1
+
+    def remove_if(self, predicate: Callable[[Hashable], bool]):
+        """
+        Remove all values, whose keys fulfill the predicate, e.g., outdated values.
+
+        :param predicate: the predicate for the keys
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.number_of_bytes -= entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __str__(self) -> str:
+        return f"{len(self)} entries, {self.number_of_bytes / 2 ** 20:.1f} MiB, {self.hits} hits, {self.misses} misses, " \
+               f"{self.evictions} evictions"
@@ -1,19 +1,23 @@
-from typing import Tuple, List
 import os
-import sys
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future
+from queue import Queue
+from typing import Tuple, List, Dict, Optional
+import threading
+import time
 
+from src.aggregation import AggregationBackend, MotionBackend
 from src.counter_information_data import NodeCounterType, CounterGroup
 
-MOTION_LIB_PATH = os.environ.get("MOTION_PANDA_LIB_PATH")
-if not MOTION_LIB_PATH:
-    raise Exception("You must set the path for the required motion lib in the environment variable MOTION_PANDA_LIB_PATH. Contact the readme for details.")
-sys.path.append(MOTION_LIB_PATH)
-import pandapython
-
 
 PartyId = int
 Host = str
 Port = int
+# (session id of the central, batch id, position of the request in the batch, number of requests in the batch)
+Batch = Tuple[str, int, int, int]
+
+MAX_PORT = 65535
 
 
 class Party:
@@ -30,8 +34,21 @@ class Party:
         self.motion_port = motion_port
 
 
-def result_from_sum(s: int) -> Tuple[NodeCounterType, int]:
-    if s == pandapython.get_zero_mask_value():
+_default_backend: Optional[MotionBackend] = None
+
+
+def default_backend() -> AggregationBackend:
+    """
+    Returns the MOTION backend, which performs the secure computation between the real parties.
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = MotionBackend()
+    return _default_backend
+
+
+def result_from_sum(s: int, zero_mask_value: int) -> Tuple[NodeCounterType, int]:
+    if s == zero_mask_value:
         return NodeCounterType.Empty, 0 
     elif s == 0:
         return NodeCounterType.SmallerThanK, 0
@@ -39,7 +56,8 @@ def result_from_sum(s: int) -> Tuple[NodeCounterType, int]:
         return NodeCounterType.Valid, s
 
 
-def perform_protocol_secure_sums_gt_k(parties: List[Party], own_id: PartyId, counters: List[CounterGroup], k: int) -> List[CounterGroup]:
+def perform_protocol_secure_sums_gt_k(parties: List[Party], own_id: PartyId, counters: List[CounterGroup], k: int, backend=None,
+                                      bit_width: Optional[int] = None) -> List[CounterGroup]:
     """
     MOTION framework
     Secure protocol: sum(input[i]) > k
@@ -56,21 +74,40 @@ def perform_protocol_secure_sums_gt_k(parties: List[Party], own_id: PartyId, cou
     my_id=1
     my_inputs=[[1, 2, 3], [4, 5, 6]]
     k=5
+
+    The computation itself is done by `backend` (see aggregation.AggregationBackend, default: MOTION). `bit_width` is
+    the number of bits needed for all sums and k (see aggregation.secure_sum_bit_width), the backend chooses a matching
+    circuit. It must be the same for all parties.
     """
     if not counters:
         return []
-    
-    motion_parties = list(map(lambda p: (p.id, p.host, p.motion_port), parties))
+    if backend is None:
+        backend = default_backend()
+
+    motion_parties = _motion_parties(parties)
+    inputs, clean_inputs = _clean_inputs(counters)
+
+    results = backend.perform_arithmetic_then_bool_with_groups(parties=motion_parties, my_id=own_id, my_inputs=clean_inputs, k=k, bit_width=bit_width)
+    return _motion_results(inputs, results, backend.get_zero_mask_value())
+
 
+def _motion_parties(parties: List[Party]) -> List[Tuple[PartyId, Host, Port]]:
+    return list(map(lambda p: (p.id, p.host, p.motion_port), parties))
+
+
+def _clean_inputs(counters: List[CounterGroup]):
     inputs = [list(c.items()) for c in counters]
     for i in inputs:
         i.sort(key=lambda inp: inp[0])  # sort by key for consistent input order over all boxes
     clean_inputs = [list(map(lambda inp: inp[1][1], inpu)) for inpu in inputs]
-    
+
     print(f"MOTION: perform_protocol_secure_sums_gt_k\n\tCOUNTERS: {counters}\n\tCLEAN INPUTS: {clean_inputs}", flush=True)
 
-    results = pandapython.perform_arithmetic_then_bool_with_groups(parties=motion_parties, my_id=own_id, my_inputs=clean_inputs, k=k)
-    results = [list(map(result_from_sum, r)) for r in results]
+    return inputs, clean_inputs
+
+
+def _motion_results(inputs, results: List[List[int]], zero_mask_value: int) -> List[CounterGroup]:
+    results = [[result_from_sum(s, zero_mask_value) for s in r] for r in results]
 
     # map resulting (NodeCounterType, int) tuples to node_ids for each group
     motion_results = []
@@ -78,3 +115,321 @@ def perform_protocol_secure_sums_gt_k(parties: List[Party], own_id: PartyId, cou
         motion_results.append({inp[0]: mr for inp, mr in zip(input_list, result_list)})
 
     return motion_results
+
+
+def default_number_of_shards() -> int:
+    """
+    One shard per core, all parties should have a similar number of cores.
+    """
+    return os.cpu_count() or 1
+
+
+def shard_ranges(group_sizes: List[int], number_of_shards: int, min_counters_per_shard: int = 1) -> List[Tuple[int, int]]:
+    """
+    Split counter groups into contiguous shards with similar numbers of counters. Groups are never split. The result
+    only depends on the group sizes, so all parties compute the same shards.
+
+    :param group_sizes: the number of counters of each group
+    :param number_of_shards: the maximum number of shards
+    :param min_counters_per_shard: fewer shards are used, if a shard would contain fewer counters
+    :return: the (start, end) group index ranges of the non-empty shards
+    """
+    total = sum(group_sizes)
+    number_of_shards = max(1, min(number_of_shards, total // max(1, min_counters_per_shard), len(group_sizes)))
+
+    ranges = []
+    start, counters = 0, 0
+    for i, size in enumerate(group_sizes):
+        counters += size
+        # close the shard as soon as its share of all counters is reached
+        if len(ranges) < number_of_shards - 1 and counters * number_of_shards >= total * (len(ranges) + 1):
+            ranges.append((start, i + 1))
+            start = i + 1
+    if start < len(group_sizes):
+        ranges.append((start, len(group_sizes)))
+    return ranges
+
+
+class _BackendWorker:
+    """
+    A thread performing all backend calls of one party for one set of ports.
+
+    Setting up a MOTION party (connections, base OTs, OT extension, ...) is expensive. If the backend offers
+    `open_session(parties, my_id)`, the worker opens one backend session and only submits the new inputs in each round.
+    The session object provides `perform_arithmetic_then_bool_with_groups(my_inputs, k, bit_width)` and `close()`.
+    Otherwise, each round performs a complete call of the backend.
+
+    All backend calls happen in the worker thread, so backend sessions never switch threads. This also allows
+    preprocessing (multiplication triples, OT extension, ...) for the next round in the background, while the party
+    performs its local work: If the backend session offers `preprocess(number_of_groups, number_of_counters)`, the
+    worker produces correlated randomness for at most that many inputs before performing the next online phase.
+    """
+
+    _PREPROCESS = "preprocess"
+    _COMPUTE = "compute"
+
+    def __init__(self, motion_parties: List[Tuple[PartyId, Host, Port]], own_id: PartyId, backend: AggregationBackend):
+        self._motion_parties = motion_parties
+        self._own_id = own_id
+        self._backend = backend
+
+        self._jobs: Queue = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        backend_session = None
+        open_error = None
+        if hasattr(self._backend, "open_session"):
+            try:
+                backend_session = self._backend.open_session(self._motion_parties, self._own_id)
+            except Exception as e:
+                open_error = e  # reported to each call of this session
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if job[0] == self._PREPROCESS:
+                _, number_of_groups, number_of_counters = job
+                if hasattr(backend_session, "preprocess"):
+                    backend_session.preprocess(number_of_groups, number_of_counters)
+                continue
+
+            _, future, my_inputs, k, bit_width = job
+            try:
+                if open_error is not None:
+                    raise open_error
+                if backend_session is not None:
+                    results = backend_session.perform_arithmetic_then_bool_with_groups(my_inputs=my_inputs, k=k, bit_width=bit_width)
+                else:
+                    results = self._backend.perform_arithmetic_then_bool_with_groups(parties=self._motion_parties, my_id=self._own_id, my_inputs=my_inputs, k=k,
+                                                                                     bit_width=bit_width)
+                future.set_result(results)
+            except Exception as e:
+                future.set_exception(e)
+
+        if backend_session is not None:
+            backend_session.close()
+
+    def compute(self, my_inputs: List[List[int]], k: int, bit_width: Optional[int]) -> Future:
+        future = Future()
+        self._jobs.put((self._COMPUTE, future, my_inputs, k, bit_width))
+        return future
+
+    def preprocess(self, number_of_groups: int, number_of_counters: int):
+        self._jobs.put((self._PREPROCESS, number_of_groups, number_of_counters))
+
+    def close(self):
+        self._jobs.put(None)
+        self._thread.join()
+
+
+class SecureSumsSession:
+    """
+    Performs the secure computations of one party for all protocol rounds, see _BackendWorker.
+
+    Large rounds can be split into shards (see shard_ranges), which are computed concurrently by independent backend
+    sessions, so parties with several cores use them during the secure computation. Shard i uses the motion ports of
+    all parties plus i * SHARD_PORT_STRIDE, so the number of shards is limited by the highest motion port (see
+    max_number_of_shards). All parties must use the same number of shards.
+
+    Concurrent requests for the same parties can share one call of the backend: The central assigns the rounds of its
+    requests to batches (see join_batch) and announces them to the boxes. Each party then inputs the counters of all
+    requests of a batch in a single call, each request receives its part of the results. Batches are computed in the
+    order of their ids, which the central assigns consecutively for each session, so all parties input the same
+    batches in the same order. Calls with and without a batch must not be mixed within a session. The batches are
+    numbered per session of the central, so the session of a box, which is kept for further requests, also computes the
+    batches of a restarted central, whose batch ids start from 0 again.
+    """
+
+    SHARD_PORT_STRIDE = 1000
+    MIN_COUNTERS_PER_SHARD = 64  # smaller shards do not pay off the additional communication
+
+    def __init__(self, parties: List[Party], own_id: PartyId, backend=None, number_of_shards: int = 1):
+        """
+        :param parties: all parties (including the central)
+        :param own_id: the id of this party
+        :param backend: the aggregation backend performing the secure computation (default: MOTION)
+        :param number_of_shards: the maximum number of concurrent backend sessions
+        :raises ValueError: if the ports of the shards exceed the valid port numbers
+        """
+        if number_of_shards > max_number_of_shards(parties):
+            raise ValueError(f"{number_of_shards} shards exceed the valid port numbers, at most {max_number_of_shards(parties)} shards are possible")
+        self._backend = backend if backend is not None else default_backend()
+        self.number_of_shards = number_of_shards
+        self.number_of_calls = 0
+        self.number_of_batched_requests = 0
+
+        self._batch_condition = threading.Condition()
+        self._open_batches: Dict[Tuple[int, Optional[int]], List[int]] = {}  # (k, bit width) -> [batch id, size]
+        self.session_id = uuid.uuid4().hex  # announced with the requests and batches (central only)
+        self._next_batch_id = 0  # assigned by join_batch (central only)
+        self._pending_batches: Dict[Tuple[str, int], _PendingBatch] = {}  # by session id of the central and batch id
+        self._next_computed_batch_ids: Dict[str, int] = defaultdict(int)  # by session id of the central
+
+        motion_parties = _motion_parties(parties)
+        self._workers = [_BackendWorker([(i, host, port + shard * self.SHARD_PORT_STRIDE) for i, host, port in motion_parties], own_id, self._backend)
+                         for shard in range(number_of_shards)]
+
+    def perform_secure_sums_gt_k(self, counters: List[CounterGroup], k: int, bit_width: Optional[int] = None) -> List[CounterGroup]:
+        """
+        Same as perform_protocol_secure_sums_gt_k, but within this session.
+        """
+        if not counters:
+            return []
+
+        inputs, clean_inputs = _clean_inputs(counters)
+        results = [group_results for future in self._compute(clean_inputs, k, bit_width) for group_results in future.result()]
+
+        return _motion_results(inputs, results, self._backend.get_zero_mask_value())
+
+    def join_batch(self, k: int, bit_width: Optional[int] = None, window: float = 0.0) -> Batch:
+        """
+        Assign the next round of a request to a batch (central only). The first request opens a new batch, all requests
+        with the same k and bit width joining within the given window are added to it. Blocks until the batch is closed.
+
+        :param k: the anonymity parameter of the request
+        :param bit_width: the bit width of the request
+        :param window: seconds a batch stays open for further requests
+        :return: the batch, which must be announced to the boxes and passed to perform_batched_secure_sums_gt_k
+        """
+        key = (k, bit_width)
+        with self._batch_condition:
+            batch = self._open_batches.get(key)
+            opened = batch is None
+            if opened:
+                batch = self._open_batches[key] = [self._next_batch_id, 0]
+                self._next_batch_id += 1
+            position = batch[1]
+            batch[1] += 1
+
+        if opened:
+            time.sleep(window)
+            with self._batch_condition:
+                del self._open_batches[key]
+                self._batch_condition.notify_all()
+        else:
+            with self._batch_condition:
+                while self._open_batches.get(key) is batch:
+                    self._batch_condition.wait()
+
+        return self.session_id, batch[0], position, batch[1]
+
+    def perform_batched_secure_sums_gt_k(self, batch: Batch, counters: List[CounterGroup], k: int, bit_width: Optional[int] = None) -> List[CounterGroup]:
+        """
+        Same as perform_secure_sums_gt_k, but the counters are input together with the counters of the other requests
+        of the batch. Blocks until all requests of the batch provided their counters and the batch was computed.
+
+        :param batch: the batch of this round, assigned by the central (see join_batch)
+        """
+        session_id, batch_id, position, size = batch
+        inputs, clean_inputs = _clean_inputs(counters)
+
+        with self._batch_condition:
+            pending = self._pending_batches.setdefault((session_id, batch_id), _PendingBatch(size))
+            pending.inputs[position] = clean_inputs
+            pending.k = max(pending.k, k)  # only the central knows k, boxes use 0
+            pending.bit_width = bit_width
+            self._compute_complete_batches(session_id)
+            while pending.futures is None:
+                self._batch_condition.wait()
+
+        results = [group_results for future in pending.futures for group_results in future.result()]
+        offset = sum(len(request_inputs) for request_inputs in pending.inputs[:position])
+        return _motion_results(inputs, results[offset:offset + len(clean_inputs)], self._backend.get_zero_mask_value())
+
+    def _compute_complete_batches(self, session_id: str):
+        # the backend workers process their jobs in order, so submitting the batches in the order of their ids suffices
+        while True:
+            key = session_id, self._next_computed_batch_ids[session_id]
+            if key not in self._pending_batches or not self._pending_batches[key].is_complete():
+                break
+            pending = self._pending_batches.pop(key)
+            clean_inputs = [group for request_inputs in pending.inputs for group in request_inputs]
+            pending.futures = self._compute(clean_inputs, pending.k, pending.bit_width) if clean_inputs else []
+            self.number_of_batched_requests += len(pending.inputs)
+            self._next_computed_batch_ids[session_id] += 1
+            self._batch_condition.notify_all()
+
+    def _compute(self, clean_inputs: List[List[int]], k: int, bit_width: Optional[int]) -> List[Future]:
+        shards = shard_ranges([len(g) for g in clean_inputs], self.number_of_shards, self.MIN_COUNTERS_PER_SHARD)
+        self.number_of_calls += 1
+        return [worker.compute(clean_inputs[start:end], k, bit_width) for worker, (start, end) in zip(self._workers, shards)]
+
+    def preprocess(self, number_of_groups: int, number_of_counters: int):
+        """
+        Start preprocessing for the next call in the background, if supported by the backend session.
+        Returns immediately.
+
+        :param number_of_groups: upper bound for the number of counter groups of the next call
+        :param number_of_counters: upper bound for the number of counters of the next call
+        """
+        if number_of_counters <= 0:
+            return
+        # the shards of a call are balanced, a shard only exceeds its share by less than one group
+        number_of_shards = len(shard_ranges([1] * number_of_counters, self.number_of_shards, self.MIN_COUNTERS_PER_SHARD))
+        for worker in self._workers[:number_of_shards]:
+            worker.preprocess(-(-number_of_groups // number_of_shards), -(-number_of_counters // number_of_shards))
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+
+
+class _PendingBatch:
+    """
+    The inputs of the requests of a batch, collected until all requests provided theirs.
+    """
+
+    def __init__(self, size: int):
+        self.inputs: List[Optional[List[List[int]]]] = [None] * size
+        self.k = 0
+        self.bit_width: Optional[int] = None
+        self.futures: Optional[List[Future]] = None  # the results of the shards, once submitted
+
+    def is_complete(self) -> bool:
+        return all(request_inputs is not None for request_inputs in self.inputs)
+
+
+_sessions: Dict[Tuple, SecureSumsSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def max_number_of_shards(parties: List[Party]) -> int:
+    """
+    The number of shards of a SecureSumsSession, whose motion ports are valid for all parties.
+    """
+    return max(1, (MAX_PORT - max(p.motion_port for p in parties)) // SecureSumsSession.SHARD_PORT_STRIDE + 1)
+
+
+def open_session(parties: List[Party], own_id: PartyId, backend=None, number_of_shards: int = 1,
+                 central_session_id: Optional[str] = None) -> SecureSumsSession:
+    """
+    Returns the open session of a party for the given parties, backend and number of shards, a new session is only
+    created if there is none yet. This way, sessions are reused across the requests processed in one process.
+
+    The boxes pass the session id of the central announced with the request. A session of the box for the same ports,
+    which was opened for another session of the central, is closed first: the central was restarted or replaced, so the
+    connections of the old session are gone, and its ports are needed by the new session.
+    """
+    backend = backend if backend is not None else default_backend()
+    ports_key = (backend, own_id, tuple(_motion_parties(parties)), number_of_shards)
+    key = ports_key + (central_session_id,)
+    with _sessions_lock:
+        if key not in _sessions:
+            for outdated_key in [other_key for other_key in _sessions if other_key[:-1] == ports_key]:
+                _sessions.pop(outdated_key).close()
+            _sessions[key] = SecureSumsSession(parties, own_id, backend, number_of_shards)
+        return _sessions[key]
+
+
+def close_sessions(backend=None):
+    """
+    Close all open sessions, or only the sessions for one backend.
+    """
+    with _sessions_lock:
+        keys = [key for key in _sessions if backend is None or key[0] is backend]
+        sessions = [_sessions.pop(key) for key in keys]
+    for session in sessions:
+        session.close()
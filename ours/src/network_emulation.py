@@ -0,0 +1,135 @@
+"""
+User space network emulation for benchmarking WAN deployments on one machine.
+
+An EmulatedTransport wraps another transport and delays each message according to the profile of the link between
+sender and receiver (latency, jitter and bandwidth). Messages are delivered asynchronously and in order per link, so
+senders are not blocked, just like with real network buffers.
+"""
+import json
+import pickle
+import threading
+import time
+from queue import Queue
+from random import Random
+from typing import Dict, Tuple, Optional, List, Any
+
+from src.communication import Transport
+from src.motion import Party, PartyId
+
+Link = Tuple[PartyId, PartyId]
+
+
+class LinkProfile:
+    rtt: float  # round trip time in seconds
+    jitter: float  # maximum deviation of the one-way latency in seconds
+    bandwidth: Optional[float]  # bytes per second, None for unlimited bandwidth
+
+    def __init__(self, rtt: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None) -> None:
+        super().__init__()
+        if rtt < 0 or jitter < 0:
+            raise ValueError("RTT and jitter must not be negative")
+        if bandwidth is not None and bandwidth <= 0:
+            raise ValueError("Bandwidth must be positive")
+        self.rtt = rtt
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+
+    @staticmethod
+    def from_milliseconds(rtt_ms: float = 0.0, jitter_ms: float = 0.0, bandwidth_mbit: Optional[float] = None) -> 'LinkProfile':
+        bandwidth = bandwidth_mbit * 1000 * 1000 / 8 if bandwidth_mbit else None
+        return LinkProfile(rtt_ms / 1000, jitter_ms / 1000, bandwidth)
+
+    def transmission_time(self, number_of_bytes: int) -> float:
+        return number_of_bytes / self.bandwidth if self.bandwidth else 0.0
+
+
+class NetworkEmulation:
+    """
+    The link profiles of a topology. Links without an explicit profile use the default profile.
+    """
+
+    def __init__(self, default_profile: LinkProfile, link_profiles: Optional[Dict[Link, LinkProfile]] = None, seed: Optional[int] = None):
+        self.default_profile = default_profile
+        self.link_profiles = link_profiles if link_profiles is not None else {}
+        self._random = Random(seed)
+        self._lock = threading.Lock()
+
+    def profile(self, sender: PartyId, receiver: PartyId) -> LinkProfile:
+        return self.link_profiles.get((sender, receiver), self.default_profile)
+
+    def one_way_latency(self, sender: PartyId, receiver: PartyId) -> float:
+        profile = self.profile(sender, receiver)
+        with self._lock:
+            jitter = self._random.uniform(-profile.jitter, profile.jitter)
+        return max(0.0, profile.rtt / 2 + jitter)
+
+    def max_rtt(self) -> float:
+        return max([self.default_profile.rtt] + [p.rtt for p in self.link_profiles.values()])
+
+    @staticmethod
+    def from_json(path: str, default_profile: LinkProfile) -> 'NetworkEmulation':
+        """
+        Load link profiles from a json file of the form {"0-1": {"rtt_ms": 40, "jitter_ms": 5, "bandwidth_mbit": 100}, ...}
+        with party ids (0 is the central).
+        """
+        with open(path) as f:
+            raw_profiles: Dict[str, Dict[str, Any]] = json.load(f)
+
+        link_profiles = {}
+        for link, profile in raw_profiles.items():
+            sender, receiver = (int(p) for p in link.split("-"))
+            link_profiles[(sender, receiver)] = LinkProfile.from_milliseconds(**profile)
+        return NetworkEmulation(default_profile, link_profiles)
+
+
+class EmulatedTransport(Transport):
+    """
+    Transport for one party, which delays all outgoing messages according to the network emulation.
+    """
+
+    def __init__(self, transport: Transport, emulation: NetworkEmulation, own_id: PartyId, parties: List[Party]):
+        """
+        :param transport: the wrapped transport delivering the messages
+        :param emulation: the link profiles
+        :param own_id: the id of the sending party
+        :param parties: all parties (including the central), used to map addresses to party ids
+        """
+        self._transport = transport
+        self._emulation = emulation
+        self._own_id = own_id
+        self._party_ids: Dict[Tuple[str, int], PartyId] = {(p.host, p.ring_port): p.id for p in parties}
+
+        self._lock = threading.Lock()
+        self._link_queues: Dict[PartyId, Queue] = {}
+        self._link_free_at: Dict[PartyId, float] = {}  # end of the last transmission on a link
+        self._last_delivery_at: Dict[PartyId, float] = {}
+
+    def receive_data(self, host: str, port: int) -> Any:
+        return self._transport.receive_data(host, port)
+
+    def send_data_to_other_party(self, data: Dict, host: str, port: int):
+        receiver = self._party_ids[(host, port)]
+        profile = self._emulation.profile(self._own_id, receiver)
+        serialized_data = pickle.dumps(data)  # the sender may modify data before it is delivered
+
+        with self._lock:
+            now = time.perf_counter()
+            transmission_end = max(now, self._link_free_at.get(receiver, now)) + profile.transmission_time(len(serialized_data))
+            self._link_free_at[receiver] = transmission_end
+            # messages on one link never overtake each other
+            deliver_at = max(transmission_end + self._emulation.one_way_latency(self._own_id, receiver),
+                             self._last_delivery_at.get(receiver, now))
+            self._last_delivery_at[receiver] = deliver_at
+
+            if receiver not in self._link_queues:
+                self._link_queues[receiver] = Queue()
+                threading.Thread(target=self._deliver, args=(self._link_queues[receiver],), daemon=True).start()
+            self._link_queues[receiver].put((deliver_at, serialized_data, host, port))
+
+    def _deliver(self, link_queue: Queue):
+        while True:
+            deliver_at, serialized_data, host, port = link_queue.get()
+            delay = deliver_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._transport.send_data_to_other_party(pickle.loads(serialized_data), host, port)
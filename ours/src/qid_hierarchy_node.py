@@ -1,7 +1,8 @@
 import math
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+import numpy as np
 from anytree import AnyNode, PreOrderIter
 
 from src.constants import GeneralizationLabel, AttributeIndex
@@ -160,4 +161,45 @@ class CategoricalQidHierarchyNode(AbstractQidHierarchyNode):
                 c.check_consistency()
 
 
-QidAttributeTrees = Dict[AttributeIndex, AbstractQidHierarchyNode]
\ No newline at end of file
+QidAttributeTrees = Dict[AttributeIndex, AbstractQidHierarchyNode]
+
+
+def qid_attribute_trees_key(qid_attribute_trees: QidAttributeTrees) -> tuple:
+    """
+    A hashable key of the attributes and the nodes of their hierarchies, e.g., for caching the results of a request.
+    """
+    return tuple((attr_index, tuple((node.node_label(), node.depth) for node in PreOrderIter(tree)))
+                 for attr_index, tree in qid_attribute_trees.items())
+
+
+class QidNodeCoder:
+    """
+    Maps values to the indices of the QID hierarchy nodes covering them (-1 for uncovered values), e.g., to the leaves
+    of a tree or the children of a node. The nodes must not overlap. Numerical values are mapped in a vectorised pass.
+    """
+
+    def __init__(self, nodes: List[AbstractQidHierarchyNode]):
+        self.labels = [node.node_label() for node in nodes]
+        self._codes_by_value = None
+        if nodes and all(isinstance(node, NumericalQidHierarchyNode) for node in nodes):
+            order = sorted(range(len(nodes)), key=lambda i: nodes[i].min)
+            self._mins = np.array([nodes[i].min for i in order], dtype=np.float64)
+            self._maxs = np.array([nodes[i].max for i in order], dtype=np.float64)
+            self._node_indices = np.array(order, dtype=np.int32)
+        else:
+            # like covers_value, a node covers its own value and the values of its subtree
+            self._codes_by_value = {descendant.value: i for i, node in enumerate(nodes) for descendant in PreOrderIter(node)}
+
+    def codes(self, values) -> np.ndarray:
+        """
+        :param values: the values, e.g., a column of the data
+        :return: the index of the node covering each value, -1 for none
+        """
+        if self._codes_by_value is not None:
+            return np.array([self._codes_by_value.get(value, -1) for value in values], dtype=np.int32)
+
+        if not isinstance(values, np.ndarray):
+            values = np.array([value if type(value) in (int, float) else np.nan for value in values], dtype=np.float64)
+        positions = np.maximum(np.searchsorted(self._mins, values, side="right") - 1, 0)
+        covered = (values >= self._mins[positions]) & (values <= self._maxs[positions])  # False for NaN
+        return np.where(covered, self._node_indices[positions], -1).astype(np.int32)
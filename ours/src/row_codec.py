@@ -0,0 +1,168 @@
+"""
+A compact encoding of the anonymized rows of the secure set union, which replaces pickling each row on its own.
+
+QID columns are encoded as ids of their generalization labels. The label dictionary is derived from the QID attribute
+trees, which the central sends to all boxes with the request anyway, so it is never sent with the rows. All other
+columns are packed as fixed-width values, the narrowest width representing the value exactly is chosen per value.
+
+Each encoded row starts with its layout: the number of columns and a 4 bit type per column. The layout determines the
+struct format of the remaining bytes, so decoding a row is a single struct call (structs are cached per layout). The
+strings, which occur in the rows besides labels (empty strings of missing values, "*" of removed center numbers and the
+marker of dummy rows), are column types without payload. Rows with values of other types are pickled instead.
+
+The encoded rows are padded to a multiple of a block size, which only depends on the number of columns (two bytes per
+column and the header), so the ciphertexts of almost all rows, including the dummy rows of the central, have the same
+length and do not reveal missing values or the magnitude of values. Only rows with unusually wide values or values
+of other types need more blocks.
+"""
+import math
+import pickle
+import struct
+from typing import Dict, List, Tuple, Any
+
+from anytree import PreOrderIter
+
+from src.constants import AttributeIndex, GeneralizationLabel, DUMMY
+from src.qid_hierarchy_node import QidAttributeTrees
+
+ROW_CODEC_PICKLE = "pickle"
+ROW_CODEC_COMPACT = "compact"
+ROW_CODECS = [ROW_CODEC_PICKLE, ROW_CODEC_COMPACT]
+
+_PICKLED = 0
+_PACKED = 1
+_MAX_COLUMNS = 255
+
+_BLOCK_ALIGNMENT = 16
+_BYTES_PER_COLUMN = 2  # labels, small integers and integral floats need at most two bytes
+
+# 4 bit column types and their struct formats (constant strings have no payload)
+_EMPTY_STRING = 0
+_LABEL = 1
+_INT8, _INT16, _INT32, _INT64 = 2, 3, 4, 5
+_FLOAT16, _FLOAT64 = 6, 7
+_REMOVED = 8
+_DUMMY = 9
+_FORMATS = {_EMPTY_STRING: "", _LABEL: "H", _INT8: "b", _INT16: "h", _INT32: "i", _INT64: "q", _FLOAT16: "e", _FLOAT64: "d",
+            _REMOVED: "", _DUMMY: ""}
+_INT_TYPES = [(_INT8, 2 ** 7), (_INT16, 2 ** 15), (_INT32, 2 ** 31), (_INT64, 2 ** 63)]
+_CONSTANTS = {_EMPTY_STRING: "", _REMOVED: "*", _DUMMY: DUMMY}
+_CONSTANT_TYPES = {value: column_type for column_type, value in _CONSTANTS.items()}
+
+# header length, struct, label columns as (value index, labels), constant columns as (index, value)
+_Layout = Tuple[int, struct.Struct, List[Tuple[int, List[GeneralizationLabel]]], List[Tuple[int, str]]]
+
+
+class RowCodec:
+    """
+    Encodes and decodes rows, see module description. All parties of a request must use the same QID attribute trees.
+    """
+
+    def __init__(self, qid_attribute_trees: QidAttributeTrees):
+        self._labels: Dict[AttributeIndex, List[GeneralizationLabel]] = {}
+        self._label_ids: Dict[AttributeIndex, Dict[GeneralizationLabel, int]] = {}
+        for qid_index, tree in qid_attribute_trees.items():
+            labels = list(dict.fromkeys(node.node_label() for node in PreOrderIter(tree)))
+            self._labels[qid_index] = labels
+            self._label_ids[qid_index] = {label: i for i, label in enumerate(labels)}
+        self._layouts: Dict[bytes, _Layout] = {}  # by header
+        self._encodings: Dict[Tuple[int, ...], Tuple[bytes, struct.Struct]] = {}  # (header, struct) by column types
+
+    def encode(self, row: List[Any]) -> bytes:
+        data = self._encode(row)
+        block_size = _block_size(len(row))
+        return data + bytes(-len(data) % block_size)  # the padding is ignored when decoding
+
+    def _encode(self, row: List[Any]) -> bytes:
+        if len(row) > _MAX_COLUMNS:
+            return bytes([_PICKLED]) + pickle.dumps(row)
+
+        # the hot loop of the encryption, so the common types are checked inline
+        column_types, values = [], []
+        label_ids = self._label_ids
+        for index, value in enumerate(row):
+            value_type = type(value)
+            if value_type is float and -2048 <= value <= 2048 and value.is_integer():
+                column_types.append(_FLOAT16)  # small integral values are exact in half precision
+                values.append(value)
+            elif value_type is int and -128 <= value < 128:
+                column_types.append(_INT8)
+                values.append(value)
+            elif value_type is str and index in label_ids and value in label_ids[index]:
+                column_types.append(_LABEL)
+                values.append(label_ids[index][value])
+            else:
+                column_type = _column_type(value)
+                if column_type is None:
+                    return bytes([_PICKLED]) + pickle.dumps(row)
+                column_types.append(column_type)
+                if column_type not in _CONSTANTS:
+                    values.append(value)
+
+        column_types = tuple(column_types)
+        encoding = self._encodings.get(column_types)
+        if encoding is None:
+            encoding = self._encodings[column_types] = _encoding(column_types)
+        header, packer = encoding
+        return header + packer.pack(*values)
+
+    def decode(self, data: bytes) -> List[Any]:
+        if data[0] == _PICKLED:
+            return pickle.loads(data[1:])
+
+        layout = self._layouts.get(data[:2 + (data[1] + 1) // 2])
+        if layout is None:
+            layout = self._layout(data)
+        header_length, unpacker, label_columns, constant_columns = layout
+
+        row = list(unpacker.unpack_from(data, header_length))
+        for index, labels in label_columns:
+            row[index] = labels[row[index]]
+        for index, value in constant_columns:
+            row.insert(index, value)
+        return row
+
+    def __getstate__(self):
+        # codecs are handed to worker processes, the layouts are cheaply derived again
+        return {**self.__dict__, "_layouts": {}, "_encodings": {}}
+
+    def _layout(self, data: bytes) -> _Layout:
+        number_of_columns = data[1]
+        header_length = 2 + (number_of_columns + 1) // 2
+        column_types = [t for b in data[2:header_length] for t in (b >> 4, b & 0x0F)][:number_of_columns]
+
+        value_columns = [index for index, column_type in enumerate(column_types) if column_type not in _CONSTANTS]
+        label_columns = [(value_index, self._labels[index]) for value_index, index in enumerate(value_columns) if column_types[index] == _LABEL]
+        constant_columns = [(index, _CONSTANTS[column_type]) for index, column_type in enumerate(column_types) if column_type in _CONSTANTS]
+        layout = header_length, struct.Struct(_struct_format(column_types)), label_columns, constant_columns
+        self._layouts[data[:header_length]] = layout
+        return layout
+
+
+def _column_type(value: Any):
+    value_type = type(value)
+    if value_type is float:
+        if math.isfinite(value) and abs(value) <= 65504 and struct.unpack("e", struct.pack("e", value))[0] == value:
+            return _FLOAT16
+        return _FLOAT64
+    if value_type is int:
+        return next((int_type for int_type, bound in _INT_TYPES if -bound <= value < bound), None)
+    if value_type is str:
+        return _CONSTANT_TYPES.get(value)
+    return None
+
+
+def _block_size(number_of_columns: int) -> int:
+    unaligned_block_size = 2 + (number_of_columns + 1) // 2 + _BYTES_PER_COLUMN * number_of_columns
+    return -(-unaligned_block_size // _BLOCK_ALIGNMENT) * _BLOCK_ALIGNMENT
+
+
+def _encoding(column_types: Tuple[int, ...]) -> Tuple[bytes, struct.Struct]:
+    padded_column_types = column_types + (_EMPTY_STRING,) * (len(column_types) % 2)  # the padding is ignored when decoding
+    header = bytes([_PACKED, len(column_types)]) + bytes(padded_column_types[i] << 4 | padded_column_types[i + 1]
+                                                         for i in range(0, len(padded_column_types), 2))
+    return header, struct.Struct(_struct_format(column_types))
+
+
+def _struct_format(column_types: List[int]) -> str:
+    return "<" + "".join(_FORMATS[column_type] for column_type in column_types)
@@ -0,0 +1,368 @@
+"""
+A pure Python/NumPy aggregation backend based on additive secret sharing, which can be used without MOTION.
+
+In each call, every party splits its input vector into additive shares modulo 2^w and sends one share to each other
+party. Each party adds up its own share and the received shares and sends this sum to the output party (the party with
+the lowest id, i.e., the central), which reconstructs the sums and applies the output rules of the MOTION circuit (see
+aggregation.grouped_sums_gt_k). The output party finally sends the results to all other parties. The share width w
+is the smallest of 8, 16, 32 and 64 bits covering the requested bit width, so small bounds reduce the communication.
+
+The outputs are identical to those of MOTION, and the boxes learn nothing beyond them. Unlike MOTION, however, the
+output party learns the unmasked sums, including sums less than k. The backend is therefore meant for running,
+testing and profiling the protocol without a MOTION build, not for productive use.
+"""
+import getpass
+import os
+import secrets
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+from queue import Queue
+from timeit import default_timer as timer
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from src.aggregation import AggregationBackend, MotionParty, ZERO_MASK_VALUE, grouped_sums_gt_k
+
+CONNECT_RETRY_INTERVAL = 0.001
+SHARE_TYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+_LENGTH = struct.Struct("!Q")
+_PARTY_ID = struct.Struct("!q")
+
+
+class CallStatistics:
+    """
+    Run time and communication of one party in one call, in seconds and bytes.
+    """
+    setup: float = 0.0  # connecting to the other parties
+    preprocessing: float = 0.0  # generating the random shares on the critical path
+    gates_setup: float = 0.0  # sharing the inputs
+    gates_online: float = 0.0  # exchanging shares, reconstructing and distributing the results
+    circuit_evaluation: float = 0.0  # the whole call
+    bytes_sent: int = 0
+    messages_sent: int = 0
+    bytes_received: int = 0
+    messages_received: int = 0
+
+
+def format_statistics(calls: List[CallStatistics]) -> str:
+    """
+    Format the statistics of one or more calls like the statistics printed by MOTION, so evaluation scripts parsing
+    MOTION output at fixed line offsets also work for this backend. The layout is the one of the MOTION version parsed by
+    eval/eval.py, with the connection setup in the place of the KK13 OT extension setup (eval/eval_arb_qid.py accepts
+    it as well). Communication is reported per call.
+    """
+    separator = "=" * 75
+    sub_separator = "-" * 75
+
+    def time_line(name: str, values: List[float]) -> str:
+        values_ms = [v * 1000 for v in values]
+        stddev = statistics.stdev(values_ms) if len(values_ms) > 1 else 0.0
+        return f"{name:<19}{statistics.mean(values_ms):>11.3f} ms{statistics.median(values_ms):>11.3f} ms{stddev:>11.3f} ms"
+
+    def mib(number_of_bytes: float) -> float:
+        return number_of_bytes / 1024 ** 2
+
+    def per_call(values: List[int]) -> float:
+        return sum(values) / len(calls)
+
+    zeros = [0.0] * len(calls)
+    lines = [
+        separator,
+        "Statistics",
+        separator,
+        "Secret sharing backend (pure Python stand-in for MOTION)",
+        "invocation: python " + " ".join(sys.argv),
+        f"by {getpass.getuser()}@{socket.gethostname()}, PID {os.getpid()}",
+        separator,
+        f"Run time statistics over {len(calls)} iterations",
+        sub_separator,
+        "                          mean        median        stddev",
+        sub_separator,
+        time_line("MT Presetup", zeros),
+        time_line("MT Setup", zeros),
+        time_line("SP Presetup", zeros),
+        time_line("SP Setup", zeros),
+        time_line("SB Presetup", zeros),
+        time_line("SB Setup", zeros),
+        time_line("Base OTs", zeros),
+        time_line("OT Extension Setup", zeros),
+        time_line("Connection Setup", [c.setup for c in calls]),
+        sub_separator,
+        time_line("Preprocessing Total", [c.preprocessing for c in calls]),
+        time_line("Gates Setup", [c.gates_setup for c in calls]),
+        time_line("Gates Online", [c.gates_online for c in calls]),
+        sub_separator,
+        time_line("Circuit Evaluation", [c.circuit_evaluation for c in calls]),
+        separator,
+        "Communication with each other party:",
+        f"Sent: {mib(per_call([c.bytes_sent for c in calls])):.3f} MiB in {per_call([c.messages_sent for c in calls]):.0f} messages",
+        f"Received: {mib(per_call([c.bytes_received for c in calls])):.3f} MiB in {per_call([c.messages_received for c in calls]):.0f} messages",
+        separator,
+    ]
+    return "\n".join(lines)
+
+
+def _random_masks(number_of_masks: int, length: int) -> np.ndarray:
+    return np.frombuffer(secrets.token_bytes(8 * number_of_masks * length), dtype=np.uint64).reshape(number_of_masks, length)
+
+
+def share_type(bit_width: Optional[int]) -> type:
+    """
+    Returns the smallest unsigned integer type for shares of the given bit width (default: 64 bits).
+    """
+    if bit_width is None:
+        return np.uint64
+    for t in SHARE_TYPES:
+        if bit_width <= np.iinfo(t).bits:
+            return t
+    raise ValueError("Bit widths of more than 64 bits are not supported, {} bits requested".format(bit_width))
+
+
+def _vector(data: bytes, length: int, dtype: type) -> np.ndarray:
+    vector = np.frombuffer(data, dtype=dtype)
+    if len(vector) != length:
+        raise Exception("Parties provided differently shaped inputs: {} and {} inputs".format(length, len(vector)))
+    return vector
+
+
+class _SocketChannels:
+    """
+    Pairwise TCP connections between all parties. Each party listens on its motion port and connects to all parties
+    with a lower id. Outgoing messages are sent by one thread per connection, so sending never blocks.
+    """
+
+    def __init__(self, parties: List[MotionParty], my_id: int):
+        addresses = {party_id: (host, port) for party_id, host, port in parties}
+        lower_ids = [party_id for party_id in addresses if party_id < my_id]
+        higher_ids = [party_id for party_id in addresses if party_id > my_id]
+
+        self._sockets: Dict[int, socket.socket] = {}
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(addresses[my_id])
+            listener.listen(len(higher_ids))
+
+            for party_id in lower_ids:
+                self._sockets[party_id] = self._connect(addresses[party_id])
+                self._sockets[party_id].sendall(_PARTY_ID.pack(my_id))
+            for _ in higher_ids:
+                connection, _ = listener.accept()
+                party_id, = _PARTY_ID.unpack(self._receive_exactly(connection, _PARTY_ID.size))
+                self._sockets[party_id] = connection
+
+        self._send_queues: Dict[int, Queue] = {}
+        self._senders: List[threading.Thread] = []
+        for party_id, s in self._sockets.items():
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._send_queues[party_id] = Queue()
+            sender = threading.Thread(target=self._send_all, args=(s, self._send_queues[party_id]), daemon=True)
+            sender.start()
+            self._senders.append(sender)
+
+    @staticmethod
+    def _connect(address: Tuple[str, int]) -> socket.socket:
+        while True:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                s.connect(address)
+                return s
+            except ConnectionRefusedError:
+                s.close()
+                time.sleep(CONNECT_RETRY_INTERVAL)
+
+    @staticmethod
+    def _receive_exactly(s: socket.socket, number_of_bytes: int) -> bytearray:
+        data = bytearray(number_of_bytes)
+        view = memoryview(data)
+        received = 0
+        while received < number_of_bytes:
+            n = s.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("Connection closed by other party")
+            received += n
+        return data
+
+    @staticmethod
+    def _send_all(s: socket.socket, send_queue: Queue):
+        while True:
+            data = send_queue.get()
+            if data is None:
+                break
+            s.sendall(_LENGTH.pack(len(data)))
+            s.sendall(data)
+
+    def send(self, party_id: int, data: bytes):
+        self._send_queues[party_id].put(data)
+
+    def receive(self, party_id: int) -> bytes:
+        s = self._sockets[party_id]
+        length, = _LENGTH.unpack(self._receive_exactly(s, _LENGTH.size))
+        return bytes(self._receive_exactly(s, length))
+
+    def close(self):
+        for send_queue in self._send_queues.values():
+            send_queue.put(None)
+        for sender in self._senders:
+            sender.join()
+        for s in self._sockets.values():
+            s.close()
+
+
+class _QueueChannels:
+    """
+    Channels between parties running as threads of one process, one queue per direction and pair of parties.
+    Parties are identified by id and motion port, so concurrent sessions on different ports do not interfere.
+    """
+
+    def __init__(self, queues: Dict[Tuple[MotionParty, MotionParty], Queue], lock: threading.Lock, parties: List[MotionParty], my_id: int):
+        self._queues = queues
+        self._lock = lock
+        self._parties = {party[0]: party for party in parties}
+        self._my_id = my_id
+
+    def _queue(self, sender: int, receiver: int) -> Queue:
+        with self._lock:
+            return self._queues.setdefault((self._parties[sender], self._parties[receiver]), Queue())
+
+    def send(self, party_id: int, data: bytes):
+        self._queue(self._my_id, party_id).put(data)
+
+    def receive(self, party_id: int) -> bytes:
+        return self._queue(party_id, self._my_id).get()
+
+    def close(self):
+        pass
+
+
+class SecretSharingBackend(AggregationBackend):
+    """
+    Aggregation backend based on additive secret sharing, see module description.
+    """
+
+    def __init__(self, in_process: bool = False, print_statistics: bool = False):
+        """
+        :param in_process: exchange shares via in-process queues instead of sockets, if all parties run as threads of
+            one process
+        :param print_statistics: benchmark mode, print the statistics of each call like MOTION does
+        """
+        self._in_process = in_process
+        self._print_statistics = print_statistics
+        self._queues: Dict[Tuple[MotionParty, MotionParty], Queue] = {}
+        self._lock = threading.Lock()
+        self.statistics: Dict[int, List[CallStatistics]] = {}  # per party id
+
+    def get_zero_mask_value(self) -> int:
+        return ZERO_MASK_VALUE
+
+    def perform_arithmetic_then_bool_with_groups(self, parties: List[MotionParty], my_id: int, my_inputs: List[List[int]], k: int,
+                                                 bit_width: Optional[int] = None) -> List[List[int]]:
+        session = self.open_session(parties, my_id)
+        try:
+            return session.perform_arithmetic_then_bool_with_groups(my_inputs, k, bit_width)
+        finally:
+            session.close()
+
+    def open_session(self, parties: List[MotionParty], my_id: int) -> 'SecretSharingSession':
+        start = timer()
+        if self._in_process:
+            channels = _QueueChannels(self._queues, self._lock, parties, my_id)
+        else:
+            channels = _SocketChannels(parties, my_id)
+        return SecretSharingSession(self, parties, my_id, channels, timer() - start)
+
+    def _record(self, my_id: int, call_statistics: CallStatistics):
+        with self._lock:
+            self.statistics.setdefault(my_id, []).append(call_statistics)
+        if self._print_statistics:
+            print(format_statistics([call_statistics]), flush=True)
+
+
+class SecretSharingSession:
+    """
+    A party of the SecretSharingBackend with established connections, which performs any number of calls.
+    The random shares are input-independent, so they can be generated in advance by `preprocess`.
+    """
+
+    def __init__(self, backend: SecretSharingBackend, parties: List[MotionParty], my_id: int, channels, setup_time: float):
+        self._backend = backend
+        self._my_id = my_id
+        self._other_ids = sorted(party_id for party_id, _, _ in parties if party_id != my_id)
+        self._output_id = min(party_id for party_id, _, _ in parties)
+        self._channels = channels
+        self._setup_time = setup_time  # reported with the first call
+        self._masks: Optional[np.ndarray] = None
+
+    def preprocess(self, number_of_groups: int, number_of_counters: int):
+        if self._masks is None or self._masks.shape[1] < number_of_counters:
+            self._masks = _random_masks(len(self._other_ids), number_of_counters)
+
+    def perform_arithmetic_then_bool_with_groups(self, my_inputs: List[List[int]], k: int, bit_width: Optional[int] = None) -> List[List[int]]:
+        dtype = share_type(bit_width)
+        result_dtype = np.uint64 if dtype == np.uint64 else np.uint32  # results include the zero mask value
+        call_statistics = CallStatistics()
+        call_statistics.setup, self._setup_time = self._setup_time, 0.0
+        start = timer()
+
+        number_of_inputs = sum(len(g) for g in my_inputs)
+        if self._masks is None or self._masks.shape[1] < number_of_inputs:
+            self.preprocess(len(my_inputs), number_of_inputs)
+            call_statistics.preprocessing = timer() - start
+        masks = self._masks[:, :number_of_inputs].astype(dtype)  # uniformly random modulo 2^w as well
+        self._masks = None  # random shares must not be reused
+
+        gates_start = timer()
+        inputs = np.array([value for group in my_inputs for value in group], dtype=dtype)
+        share_sum = inputs - masks.sum(axis=0, dtype=dtype)  # arithmetic modulo 2^w
+        call_statistics.gates_setup = timer() - gates_start
+
+        online_start = timer()
+        for party_id, mask in zip(self._other_ids, masks):
+            self._send(call_statistics, party_id, mask.tobytes())
+        for party_id in self._other_ids:
+            share_sum += _vector(self._receive(call_statistics, party_id), number_of_inputs, dtype)
+
+        if self._my_id == self._output_id:
+            for party_id in self._other_ids:
+                share_sum += _vector(self._receive(call_statistics, party_id), number_of_inputs, dtype)
+            flat_results = [value for group in grouped_sums_gt_k(self._grouped(share_sum.tolist(), my_inputs), k) for value in group]
+            encoded_results = np.array(flat_results, dtype=result_dtype).tobytes()
+            for party_id in self._other_ids:
+                self._send(call_statistics, party_id, encoded_results)
+        else:
+            self._send(call_statistics, self._output_id, share_sum.tobytes())
+            flat_results = _vector(self._receive(call_statistics, self._output_id), number_of_inputs, result_dtype).tolist()
+
+        end = timer()
+        call_statistics.gates_online = end - online_start
+        call_statistics.circuit_evaluation = end - start
+        self._backend._record(self._my_id, call_statistics)
+
+        return self._grouped(flat_results, my_inputs)
+
+    @staticmethod
+    def _grouped(values: List[int], my_inputs: List[List[int]]) -> List[List[int]]:
+        grouped_values = []
+        offset = 0
+        for group in my_inputs:
+            grouped_values.append(values[offset:offset + len(group)])
+            offset += len(group)
+        return grouped_values
+
+    def _send(self, call_statistics: CallStatistics, party_id: int, data: bytes):
+        self._channels.send(party_id, data)
+        call_statistics.messages_sent += 1
+        call_statistics.bytes_sent += len(data)
+
+    def _receive(self, call_statistics: CallStatistics, party_id: int) -> bytes:
+        data = self._channels.receive(party_id)
+        call_statistics.messages_received += 1
+        call_statistics.bytes_received += len(data)
+        return data
+
+    def close(self):
+        self._channels.close()
@@ -0,0 +1,379 @@
+"""
+Typed columnar snapshots of the CSV data sets, which are loaded in milliseconds instead of parsing the CSV file.
+
+A snapshot of `<name>.csv` consists of
+- `<name>.npy`: a NumPy structured array with one record per data row, which is memory-mapped when loaded
+- `<name>.npy.json`: the categories, the fields of each column, the numbers of read and dropped rows, the SHA-256 hash
+  of the array file, and the sizes and modification times of the array file and the CSV file
+
+Each column is stored in one field per value type occurring in it (int, float, str). Columns with several value types
+have an additional field with the type of each value, so the loaded rows equal the rows of data_utils.read_csv_data,
+including their types. QID columns can additionally be stored as the indices of the leaves of their trees, from which
+the boxes count the records of the root nodes (see box_data.BoxData).
+
+Snapshots are written by streaming the CSV file in chunks (see write_snapshot), so data sets larger than the memory can
+be converted.
+
+Loading only compares the sizes and modification times, the hash of a snapshot is checked once after writing it (see
+verify_snapshot), hashing the files on each load would cost more than loading the snapshot.
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+from typing import List, Tuple, Optional, Dict, Sequence, Union
+
+import numpy as np
+
+from src.constants import Data, AttributeIndex, GeneralizationLabel
+from src.data_utils import read_csv_data, stream_csv_data, parse_data_point, CsvStatistics
+from src.qid_hierarchy_node import QidAttributeTrees, QidNodeCoder
+
+SNAPSHOT_VERSION = 3
+CHUNK_SIZE = 65536  # rows parsed at once
+SAMPLE_SIZE = 10000  # rows the schema is inferred from
+
+_VALUE_TYPES = [int, float, str]  # indices are stored in the type fields
+_TYPE_NAMES = {int: "int", float: "float", str: "str"}
+_HASH_CHUNK_SIZE = 1024 * 1024
+_INT_FIELD = re.compile(r"^[^.eEnN]*$", re.MULTILINE)
+# matches at least all fields, which can be parsed as numbers
+_NUMERICAL_FIELD = re.compile(r"^[\d\s_+\-.eE]+$|inf|nan", re.MULTILINE | re.IGNORECASE)
+
+# row range [start, stop)
+RowRange = Tuple[int, int]
+
+
+def snapshot_path(data_path: str) -> str:
+    return os.path.splitext(data_path)[0] + ".npy"
+
+
+def write_snapshot(data_path: str, qid_attribute_trees: Optional[QidAttributeTrees] = None, chunk_size: int = CHUNK_SIZE,
+                   sample_size: int = SAMPLE_SIZE) -> str:
+    """
+    Parse a CSV data set once and write its snapshot next to it, in memory bounded by the chunk size.
+
+    The schema (the value types and string widths of each column) is inferred from the first rows. The rows are then
+    parsed chunk by chunk: columns of a single numerical type are converted at once into typed arrays, other columns
+    value by value. A value not fitting the schema widens it and restarts parsing, so the snapshot always equals
+    data_utils.read_csv_data.
+
+    :param data_path: the path of the CSV file
+    :param qid_attribute_trees: if given, the QID columns are additionally stored as indices of the leaves of their
+        trees covering the values (see read_leaf_codes)
+    :param chunk_size: the number of rows parsed at once
+    :param sample_size: the number of rows the schema is inferred from
+    :return: the path of the snapshot
+    """
+    path = snapshot_path(data_path)
+    categories, rows, _ = stream_csv_data(data_path)
+    schema = _schema([[parse_data_point(data_point) for data_point in row] for row in itertools.islice(rows, sample_size)], len(categories))
+    rows.close()
+    leaf_coders = {index: QidNodeCoder(tree.leaves) for index, tree in (qid_attribute_trees or {}).items()}
+
+    records_path = path + ".records"
+    try:
+        while True:
+            try:
+                number_of_rows, statistics = _write_records(data_path, records_path, schema, leaf_coders, chunk_size)
+                break
+            except _SchemaViolation as violation:
+                schema = violation.schema
+
+        with open(path, "wb") as f, open(records_path, "rb") as records:
+            header = {"descr": np.lib.format.dtype_to_descr(_dtype(schema, leaf_coders)), "fortran_order": False, "shape": (number_of_rows,)}
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(records, f, _HASH_CHUNK_SIZE)
+    finally:
+        if os.path.exists(records_path):
+            os.remove(records_path)
+
+    metadata = {
+        "version": SNAPSHOT_VERSION,
+        "categories": categories,
+        "fields": [[_TYPE_NAMES[value_type] for value_type in value_types] for value_types, _ in schema],
+        "leaves": {str(index): leaf_coder.labels for index, leaf_coder in leaf_coders.items()},
+        "number_of_rows": statistics.number_of_rows,
+        "number_of_dropped_rows": statistics.number_of_dropped_rows,
+        "missing_values": dict(statistics.missing_values),
+        "sha256": _file_hash(path),
+        "stat": _file_stat(path),
+        "source_stat": _file_stat(data_path)
+    }
+    with open(path + ".json", "w") as metadata_file:
+        json.dump(metadata, metadata_file, indent=2)
+    return path
+
+
+def read_snapshot(path: str, row_range: Optional[RowRange] = None, row_indices: Optional[Sequence[int]] = None) -> Tuple[List[str], Data]:
+    """
+    Load (some of) the rows of a snapshot. The snapshot is memory-mapped, so processes on the same host share the pages
+    of the file in the page cache, and only the loaded rows are read and converted to Python objects. Memory of a box
+    is therefore proportional to its own rows.
+
+    :param path: the path of the snapshot (see snapshot_path)
+    :param row_range: the rows to load as [start, stop) (default: all rows)
+    :param row_indices: the indices of the rows to load in this order, instead of a row range
+    :return: the categories and the rows, equal to the ones of data_utils.read_csv_data
+    :raises ValueError: if the snapshot was changed after writing it
+    """
+    metadata = _read_metadata(path)
+    if metadata.get("version") != SNAPSHOT_VERSION or _file_stat(path) != metadata["stat"]:
+        raise ValueError(f"Snapshot {path} is corrupted or outdated, write it again")
+
+    array = np.load(path, mmap_mode="r", allow_pickle=False)
+    if row_indices is not None:
+        records = array[np.asarray(row_indices, dtype=np.int64)]
+    else:
+        start, stop = row_range if row_range is not None else (0, len(array))
+        records = array[start:stop]
+
+    columns = []
+    for index, column_fields in enumerate(metadata["fields"]):
+        values = {type_name: records[_field_name(index, type_name)].tolist() for type_name in column_fields}
+        if len(column_fields) == 1:
+            columns.append(values[column_fields[0]])
+        else:
+            values_by_type = [values.get(_TYPE_NAMES[value_type]) for value_type in _VALUE_TYPES]
+            columns.append([values_by_type[value_type][row] for row, value_type in enumerate(records[_field_name(index, "type")].tolist())])
+
+    return metadata["categories"], [list(row) for row in zip(*columns)]
+
+
+def verify_snapshot(path: str):
+    """
+    Check the SHA-256 hash of a snapshot, which detects also changes keeping its size and modification time.
+
+    :param path: the path of the snapshot (see snapshot_path)
+    :raises ValueError: if the snapshot does not match its hash
+    """
+    metadata = _read_metadata(path)
+    if metadata.get("version") != SNAPSHOT_VERSION or _file_hash(path) != metadata["sha256"]:
+        raise ValueError(f"Snapshot {path} is corrupted or outdated, write it again")
+
+
+def read_leaf_codes(path: str, attribute_index: AttributeIndex, row_range: Optional[RowRange] = None,
+                    row_indices: Optional[Sequence[int]] = None) -> Tuple[List[GeneralizationLabel], np.ndarray]:
+    """
+    Load the leaf codes of a QID column (see write_snapshot).
+
+    :param path: the path of the snapshot (see snapshot_path)
+    :param attribute_index: the index of the QID column
+    :param row_range: the rows to load as [start, stop) (default: all rows)
+    :param row_indices: the indices of the rows to load in this order, instead of a row range
+    :return: the labels of the leaves and the index of the leaf covering the value of each row (-1 for none)
+    :raises KeyError: if the snapshot has no leaf codes for the column
+    """
+    labels = _read_metadata(path)["leaves"][str(attribute_index)]
+    array = np.load(path, mmap_mode="r", allow_pickle=False)
+    codes = array[_field_name(attribute_index, "leaf")]
+    if row_indices is not None:
+        return labels, codes[np.asarray(row_indices, dtype=np.int64)]
+    start, stop = row_range if row_range is not None else (0, len(array))
+    return labels, np.array(codes[start:stop])
+
+
+def snapshot_metadata(path: str) -> Dict:
+    return _read_metadata(path)
+
+
+def number_of_snapshot_rows(path: str) -> int:
+    return len(np.load(path, mmap_mode="r", allow_pickle=False))
+
+
+def read_data(data_path: str, partition: Optional[Tuple[int, int]] = None, row_range: Optional[RowRange] = None,
+              row_indices: Optional[Sequence[int]] = None) -> Tuple[List[str], Data]:
+    """
+    Read (some of) the rows of a CSV data set, from its snapshot if there is an up-to-date one. At most one of
+    partition, row_range and row_indices may be given.
+
+    :param data_path: the path of the CSV file
+    :param partition: (index, number of partitions) to read only the rows of one of equally sized partitions, like the
+        boxes do (the remaining rows are not part of any partition)
+    :param row_range: the rows to read as [start, stop)
+    :param row_indices: the indices of the rows to read in this order
+    :return: the categories and the rows
+    """
+    if sum(rows is not None for rows in (partition, row_range, row_indices)) > 1:
+        raise ValueError("Only one of partition, row range and row indices can be read")
+
+    path = snapshot_path(data_path)
+    if os.path.exists(path + ".json") and _read_metadata(path).get("source_stat") == _file_stat(data_path):
+        if partition is not None:
+            row_range = _partition_range(number_of_snapshot_rows(path), partition)
+        return read_snapshot(path, row_range, row_indices)
+
+    categories, data = read_csv_data(data_path)
+    if partition is not None:
+        row_range = _partition_range(len(data), partition)
+    if row_range is not None:
+        data = data[row_range[0]:row_range[1]]
+    elif row_indices is not None:
+        data = [data[row_index] for row_index in row_indices]
+    return categories, data
+
+
+def read_data_leaf_codes(data_path: str, partition: Optional[Tuple[int, int]] = None, row_range: Optional[RowRange] = None,
+                         row_indices: Optional[Sequence[int]] = None) -> Dict[AttributeIndex, Tuple[List[GeneralizationLabel], np.ndarray]]:
+    """
+    Read the leaf codes of the QID columns of (some of) the rows of a CSV data set from its snapshot, for the same rows
+    as read_data (see BoxData).
+
+    :param data_path: the path of the CSV file
+    :param partition: (index, number of partitions) to read only the rows of one of equally sized partitions
+    :param row_range: the rows to read as [start, stop)
+    :param row_indices: the indices of the rows to read in this order
+    :return: the labels of the leaves and the leaf codes of the rows by QID column, empty if there is no up-to-date
+        snapshot
+    """
+    path = snapshot_path(data_path)
+    if not os.path.exists(path + ".json") or _read_metadata(path).get("source_stat") != _file_stat(data_path):
+        return {}
+    if partition is not None:
+        row_range = _partition_range(number_of_snapshot_rows(path), partition)
+    return {int(attribute_index): read_leaf_codes(path, int(attribute_index), row_range, row_indices)
+            for attribute_index in _read_metadata(path)["leaves"]}
+
+
+def _partition_range(number_of_rows: int, partition: Tuple[int, int]) -> RowRange:
+    index, number_of_partitions = partition
+    partition_size = number_of_rows // number_of_partitions
+    return index * partition_size, (index + 1) * partition_size
+
+
+def _field_name(column_index: int, type_name: str) -> str:
+    return f"{column_index}:{type_name}"
+
+
+def _numpy_type(value_type: type, string_length: int):
+    if value_type is int:
+        return np.int64
+    if value_type is float:
+        return np.float64
+    return f"U{string_length or 1}"
+
+
+def _read_metadata(path: str) -> Dict:
+    with open(path + ".json") as metadata_file:
+        return json.load(metadata_file)
+
+
+def _file_stat(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _file_hash(path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+# the value types of a column and the maximum length of its strings
+_ColumnSchema = Tuple[List[type], int]
+
+
+class _SchemaViolation(Exception):
+
+    def __init__(self, schema: List[_ColumnSchema]):
+        super().__init__()
+        self.schema = schema
+
+
+def _write_records(data_path: str, records_path: str, schema: List[_ColumnSchema], leaf_coders: Dict[int, QidNodeCoder],
+                   chunk_size: int) -> Tuple[int, CsvStatistics]:
+    """
+    Parse the rows chunk by chunk and append their records to a file.
+
+    :return: the number of records and the statistics of the CSV file
+    :raises _SchemaViolation: with the widened schema, if a value does not fit the schema
+    """
+    dtype = _dtype(schema, leaf_coders)
+    _, rows, statistics = stream_csv_data(data_path)
+    number_of_rows = 0
+    with open(records_path, "wb") as records_file:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return number_of_rows, statistics
+
+            columns, chunk_schema = zip(*[_parse_column(fields, value_types) for fields, (value_types, _) in zip(zip(*chunk), schema)])
+            widened_schema = [_widened(column_schema, new_column_schema) for column_schema, new_column_schema in zip(schema, chunk_schema)]
+            if widened_schema != schema:
+                rows.close()
+                raise _SchemaViolation(widened_schema)
+
+            records = np.zeros(len(chunk), dtype=dtype)
+            for index, (values, (value_types, _)) in enumerate(zip(columns, schema)):
+                _set_column(records, index, values, value_types)
+            for index, leaf_coder in leaf_coders.items():
+                records[_field_name(index, "leaf")] = leaf_coder.codes(columns[index])
+            records.tofile(records_file)
+            number_of_rows += len(chunk)
+
+
+def _parse_column(fields: Sequence[str], value_types: List[type]) -> Tuple[Union[np.ndarray, Sequence], _ColumnSchema]:
+    """
+    Parse the fields of a column like data_utils.parse_data_point. Columns with a single type of the schema are
+    converted at once, only other columns are parsed field by field.
+
+    :return: a typed array for numerical columns of a single type, otherwise the values, and the schema of the values
+    """
+    try:
+        if value_types == [int]:
+            return np.array(fields, dtype=np.int64), ([int], 0)
+        # a float field is an int field, if it has neither a decimal point nor an exponent (nor is nan or infinity)
+        if value_types == [float] and _INT_FIELD.search("\n".join(fields)) is None:
+            return np.array(fields, dtype=np.float64), ([float], 0)
+    except (ValueError, OverflowError):
+        pass
+    if value_types == [str] and _NUMERICAL_FIELD.search("\n".join(fields)) is None:
+        return fields, ([str], max(map(len, fields)))
+
+    values = [parse_data_point(field) for field in fields]
+    return values, _column_schema(values)
+
+
+def _schema(rows: Data, number_of_columns: int) -> List[_ColumnSchema]:
+    if not rows:
+        return [([str], 0) for _ in range(number_of_columns)]
+    return [_column_schema(column) for column in zip(*rows)]
+
+
+def _column_schema(values: Sequence) -> _ColumnSchema:
+    value_types = {type(value) for value in values}
+    if any(value_type not in _VALUE_TYPES for value_type in value_types):
+        raise ValueError("Column contains values, which cannot be stored in a snapshot")
+    return sorted(value_types, key=_VALUE_TYPES.index), max((len(value) for value in values if type(value) is str), default=0)
+
+
+def _widened(column_schema: _ColumnSchema, new_column_schema: _ColumnSchema) -> _ColumnSchema:
+    value_types = sorted(set(column_schema[0]) | set(new_column_schema[0]), key=_VALUE_TYPES.index)
+    return value_types, max(column_schema[1], new_column_schema[1])
+
+
+def _dtype(schema: List[_ColumnSchema], leaf_coders: Dict[int, QidNodeCoder]) -> np.dtype:
+    dtype = []
+    for index, (value_types, string_length) in enumerate(schema):
+        for value_type in value_types:
+            dtype.append((_field_name(index, _TYPE_NAMES[value_type]), _numpy_type(value_type, string_length)))
+        if len(value_types) > 1:
+            dtype.append((_field_name(index, "type"), np.uint8))
+    for index in leaf_coders:
+        dtype.append((_field_name(index, "leaf"), np.int32))
+    return np.dtype(dtype)
+
+
+def _set_column(records: np.ndarray, index: int, values, value_types: List[type]):
+    if len(value_types) == 1:
+        records[_field_name(index, _TYPE_NAMES[value_types[0]])] = values
+        return
+    records[_field_name(index, "type")] = [_VALUE_TYPES.index(type(value)) for value in values]
+    for value_type in value_types:
+        # the other fields of these rows keep their zero values
+        rows = [row for row, value in enumerate(values) if type(value) is value_type]
+        records[_field_name(index, _TYPE_NAMES[value_type])][rows] = [values[row] for row in rows]
@@ -0,0 +1,95 @@
+"""
+The specializations of finished requests, from which related requests warm start (see central.Central), e.g., the runs
+of a sweep over k or over subsets of the QIDs (see eval/run_arb_qid.sh).
+
+A request can warm start from the specialization of an earlier request with the same criteria and a superset of its
+QIDs (with the same hierarchies), restricted to its QIDs (see tips_nodes.specialization_for_qids). If the earlier
+request had at least the same k, all replayed leaf nodes had at least k records, so only records appended meanwhile
+can make refinements invalid. Otherwise, the initial round undoes the refinements leading to leaf nodes with less than
+k records. The store prefers specializations of requests with at least the same k, then the longest specialization.
+
+The store can be kept in a JSON file, so consecutive runs of run_central.py share it.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional, Dict
+
+from src.constants import Specialization
+from src.qid_hierarchy_node import QidAttributeTrees, qid_attribute_trees_key
+from src.tips_nodes import specialization_for_qids
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+class SpecializationStore:
+    """
+    Keeps the specializations of the last max_entries requests, see module description. Thread-safe.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        :param path: the JSON file the specializations are read from (if it exists) and written to after each addition
+            (default: keep them in memory only)
+        :param max_entries: the maximum number of kept specializations, the oldest are dropped first
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: List[Dict] = []
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def add(self, k: int, criteria_list: List, qid_attribute_trees: QidAttributeTrees, specialization: Specialization):
+        """
+        Keep the specialization of a finished request.
+
+        :param k: the anonymity parameter of the request
+        :param criteria_list: the criteria of the request
+        :param qid_attribute_trees: the unspecialized qid attribute hierarchies of the request
+        :param specialization: the refinements of its result (see Central.specialization)
+        """
+        entry = {"k": k, "criteria": _criteria_key(criteria_list), "hierarchies": _hierarchy_fingerprints(qid_attribute_trees),
+                 "specialization": [[attr_index, label] for attr_index, label in specialization]}
+        with self._lock:
+            self._entries.append(entry)
+            del self._entries[:-self.max_entries]
+            if self.path is not None:
+                # replaced at once, so an interrupted run does not leave a partial file
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(self._entries, f)
+                os.replace(self.path + ".tmp", self.path)
+
+    def related_specialization(self, k: int, criteria_list: List, qid_attribute_trees: QidAttributeTrees) -> Optional[Specialization]:
+        """
+        :param k: the anonymity parameter of the request
+        :param criteria_list: the criteria of the request
+        :param qid_attribute_trees: the unspecialized qid attribute hierarchies of the request
+        :return: the specialization to warm start the request from, None if there is no related request (see module
+            description)
+        """
+        criteria = _criteria_key(criteria_list)
+        fingerprints = _hierarchy_fingerprints(qid_attribute_trees)
+        with self._lock:
+            related = [entry for entry in self._entries
+                       if entry["criteria"] == criteria and all(entry["hierarchies"].get(attr) == fingerprint for attr, fingerprint in fingerprints.items())]
+
+        best, best_rank = None, None
+        for entry in related:
+            specialization = specialization_for_qids([(attr_index, label) for attr_index, label in entry["specialization"]], qid_attribute_trees)
+            rank = (entry["k"] >= k, len(specialization))
+            if specialization and (best_rank is None or rank > best_rank):
+                best, best_rank = specialization, rank
+        return best
+
+
+def _criteria_key(criteria_list: List) -> List[List[str]]:
+    return [[str(part) for part in criterion] for criterion in criteria_list]
+
+
+def _hierarchy_fingerprints(qid_attribute_trees: QidAttributeTrees) -> Dict[str, str]:
+    # JSON objects have string keys
+    return {str(attr_index): hashlib.sha256(repr(qid_attribute_trees_key({attr_index: tree})).encode()).hexdigest()
+            for attr_index, tree in qid_attribute_trees.items()}
@@ -3,20 +3,27 @@ from copy import deepcopy
 from typing import List, Dict, Tuple, Optional
 
 import src.counter_information_data
-from src.constants import AttributeIndex, GeneralizationLabel, TipsNodeId, Data, BestRefinements
+from src.constants import AttributeIndex, GeneralizationLabel, TipsNodeId, Data, BestRefinements, Specialization
 from src.counter_information_data import TipsNodeCounter, ChildCounters, CounterInformationData
 from src.qid_hierarchy_node import QidAttributeTrees
 
 
 class TipsNode:
-    def __init__(self, raw_records: Optional[Data], qid_attr_trees: QidAttributeTrees):
+    def __init__(self, raw_records: Optional[Data], qid_attr_trees: QidAttributeTrees,
+                 child_counts: Optional[Dict[AttributeIndex, List[int]]] = None):
+        """
+        :param raw_records: the records of the node, None for nodes without data (central unit)
+        :param qid_attr_trees: the generalization classes of the node
+        :param child_counts: the already known numbers of records of the potential children per attribute in hierarchy
+            order, e.g., cached by the box (default: count the records)
+        """
         if len(qid_attr_trees) < 1:
             raise ValueError("Cannot instantiate TIPS node without QID-attributes.")
 
         self.raw_records: Data = raw_records
         self.node_counter_info = self._get_node_counter_info(raw_records)
         self.qid_attribute_trees = qid_attr_trees
-        self._potential_child_counters: ChildCounters = self._init_potential_child_counters()
+        self._potential_child_counters: ChildCounters = self._init_potential_child_counters(child_counts)
         self.id: TipsNodeId = self._generate_id()
 
     def number_of_records(self):
@@ -45,7 +52,7 @@ class TipsNode:
 
         return result
 
-    def _init_potential_child_counters(self) -> ChildCounters:
+    def _init_potential_child_counters(self, child_counts: Optional[Dict[AttributeIndex, List[int]]]) -> ChildCounters:
         """
         Determines whether the records of this node may be refined for the given attribute (index).
         Should only be called once during initialization as this is an expensive operation.
@@ -57,14 +64,13 @@ class TipsNode:
         for qid_index in self.qid_attribute_trees:
             qid_node_children = self.qid_attribute_trees[qid_index].children
             child_counters = {}
-            for child in qid_node_children:
+            for child_index, child in enumerate(qid_node_children):
                 child_id = self._generate_id(qid_index, child.node_label())  # use fully qualified labels for children here
                 if self.raw_records is not None:
-                    counter = 0
-                    for row in self.raw_records:
-                        value_to_check = row[qid_index]
-                        if child.covers_value(value_to_check):
-                            counter += 1
+                    if child_counts is not None:
+                        counter = child_counts[qid_index][child_index]
+                    else:
+                        counter = _number_of_covered_records(self.raw_records, qid_index, child)
                     child_counters[child_id] = (src.counter_information_data.NodeCounterType.DataContent, counter)
                 else:
                     child_counters[child_id] = (src.counter_information_data.NodeCounterType.Undefined, 0)
@@ -72,6 +78,23 @@ class TipsNode:
 
         return result
 
+    def append_records(self, rows: Data):
+        """
+        Append records to a node with data. Only the new records are counted for the node and its potential children.
+
+        :param rows: the new records, which must be covered by the generalization classes of this node
+        """
+        if self.raw_records is None:
+            raise RuntimeError("append_records called for TIPS node without data")
+
+        self.raw_records.extend(rows)
+        self.node_counter_info = self._get_node_counter_info(self.raw_records)
+        for qid_index, child_counters in self._potential_child_counters.items():
+            for child in self.qid_attribute_trees[qid_index].children:
+                child_id = self._generate_id(qid_index, child.node_label())
+                counter_type, counter = child_counters[child_id]
+                child_counters[child_id] = counter_type, counter + _number_of_covered_records(rows, qid_index, child)
+
     def extract_counter(self) -> TipsNodeCounter:
         """
         Get the counter information (number of records, number of potential children) for this TIPS node.
@@ -194,6 +217,14 @@ class TipsNode:
         return result
 
 
+def _number_of_covered_records(rows: Data, qid_index: AttributeIndex, qid_node) -> int:
+    counter = 0
+    for row in rows:
+        if qid_node.covers_value(row[qid_index]):
+            counter += 1
+    return counter
+
+
 # A dictionary containing all TIPS nodes for all generalisations w.r.t. one attribute
 LinkHeadsForAttribute = Dict[GeneralizationLabel, List[TipsNode]]
 
@@ -210,15 +241,17 @@ LeafNodes = Dict[TipsNodeId, TipsNode]
 
 # setup methods
 
-def setup_tips_root_node(raw_data_rows: Optional[Data], qid_attributes: QidAttributeTrees) -> TipsNode:
+def setup_tips_root_node(raw_data_rows: Optional[Data], qid_attributes: QidAttributeTrees,
+                         child_counts: Optional[Dict[AttributeIndex, List[int]]] = None) -> TipsNode:
     """
     Builds single TIPS node as initial tree, including all raw data rows and most generalized qid_nodes.
 
     :param raw_data_rows: all raw data records
     :param qid_attributes: dictionary of following form { qid_attribute_index: most_generalized_qid_hierarchy_node }
+    :param child_counts: the already known numbers of records of the potential children (see TipsNode)
     :return: single TIPS node as initial TIPS tree
     """
-    return TipsNode(raw_records=raw_data_rows, qid_attr_trees=qid_attributes)
+    return TipsNode(raw_records=raw_data_rows, qid_attr_trees=qid_attributes, child_counts=child_counts)
 
 
 def setup_tips_leaf_nodes(tips_root: TipsNode) -> LeafNodes:
@@ -338,6 +371,51 @@ def _calculate_score_for_label(tips_nodes: List[TipsNode], attribute_index: Attr
     return score
 
 
+def counter_groups_upper_bound(tips_nodes: List[TipsNode]) -> Tuple[int, int]:
+    """
+    Upper bound for the number of counter groups and counters, which are extracted for TIPS nodes.
+
+    :param tips_nodes: the TIPS nodes
+    :return: a tuple consisting of the number of counter groups and the number of counters
+    """
+    number_of_groups, number_of_counters = 0, 0
+    for node in tips_nodes:
+        child_counts = [len(qid_node.children) for qid_node in node.qid_attribute_trees.values()]
+        number_of_groups += 1 + sum(1 for c in child_counts if c > 0)
+        number_of_counters += 1 + sum(child_counts)
+    return number_of_groups, number_of_counters
+
+
+def next_round_counter_groups_upper_bound(link_heads: LinkHeads) -> Tuple[int, int]:
+    """
+    Upper bound for the number of counter groups and counters of the next protocol round, i.e., for the new TIPS
+    nodes of any refinement, which can be chosen next. Only the tree structure is considered, so the central and all
+    boxes compute the same bound.
+
+    :param link_heads: the TIPS tree link heads
+    :return: a tuple consisting of the number of counter groups and the number of counters
+    """
+    max_groups, max_counters = 0, 0
+
+    for attribute_index, link_head in link_heads.items():
+        for generalization_label, nodes in link_head.items():
+            if not _can_be_specialized(attribute_index, generalization_label, link_head):
+                continue
+
+            number_of_groups, number_of_counters = 0, 0
+            for node in nodes:
+                for child in node.qid_attribute_trees[attribute_index].children:
+                    child_counts = [len(child.children) if qid_index == attribute_index else len(qid_node.children)
+                                    for qid_index, qid_node in node.qid_attribute_trees.items()]
+                    number_of_groups += 1 + sum(1 for c in child_counts if c > 0)
+                    number_of_counters += 1 + sum(child_counts)
+
+            max_groups = max(max_groups, number_of_groups)
+            max_counters = max(max_counters, number_of_counters)
+
+    return max_groups, max_counters
+
+
 # perform refinement methods
 
 
@@ -367,6 +445,137 @@ def perform_refinement(tips_link_heads: LinkHeads, best_attr_index: AttributeInd
     return new_tips_link_heads, new_node_list
 
 
+def replay_refinements(tips_link_heads: LinkHeads, specialization: Specialization) -> LinkHeads:
+    """
+    Perform a sequence of refinements, e.g., the refinements chosen for an earlier request (see Central), without
+    choosing them based on the counters.
+
+    :param tips_link_heads: the TIPS tree link heads
+    :param specialization: the refinements given by attribute index and generalization label, in the order they were
+        performed
+    :return: the resulting TIPS tree (represented by link heads)
+    """
+    for attr_index, label in specialization:
+        tips_link_heads, _ = perform_refinement(tips_link_heads, attr_index, label)
+    return tips_link_heads
+
+
+def specialization_for_qids(specialization: Specialization, qid_attribute_trees: QidAttributeTrees) -> Specialization:
+    """
+    The refinements of a specialization, which can be replayed for the given QID hierarchies, e.g., the refinements of
+    an earlier request with further QIDs. Removing the refinements of the other QIDs only merges equivalence classes, so
+    the leaf nodes keep at least as many records.
+
+    :param specialization: the refinements given by attribute index and generalization label, in the order they were
+        performed
+    :param qid_attribute_trees: the unspecialized qid attribute hierarchies
+    :return: the refinements of the given QIDs, whose labels are generalizations of the current specialization
+    """
+    # the labels of the current generalization of each attribute
+    cuts = {attr_index: {tree.node_label(): tree} for attr_index, tree in qid_attribute_trees.items()}
+    result = []
+    for attr_index, label in specialization:
+        node = cuts.get(attr_index, {}).get(label)
+        if node is None or not node.children:
+            continue
+        del cuts[attr_index][label]
+        cuts[attr_index].update({child.node_label(): child for child in node.children})
+        result.append((attr_index, label))
+    return result
+
+
+def leaf_nodes_from_link_heads(tips_link_heads: LinkHeads) -> List[TipsNode]:
+    """
+    :param tips_link_heads: the TIPS tree link heads
+    :return: the leaf nodes of the TIPS tree
+    """
+    # each attribute has links to the whole dataset, just take the first
+    some_attribute_index = next(iter(tips_link_heads))
+    return [tips_node for tips_nodes in tips_link_heads[some_attribute_index].values() for tips_node in tips_nodes]
+
+
+def append_records_to_link_heads(tips_link_heads: LinkHeads, rows: Data) -> List[TipsNode]:
+    """
+    Append records to a TIPS tree (represented by link heads) containing data. Each record is routed to the leaf node
+    covering its values, only the counters of these leaf nodes change.
+
+    All nodes with the same generalization label of an attribute are refined together, so the labels of each attribute
+    partition its values and every combination of labels has a leaf node. Like during a refinement, records with a
+    value not covered by any label of a refined attribute are dropped.
+
+    :param tips_link_heads: the TIPS tree link heads
+    :param rows: the new records
+    :return: the leaf nodes, which received records
+    """
+    leaf_nodes = {tuple(node.qid_attribute_trees[attr_index].node_label() for attr_index in tips_link_heads): node
+                  for node in leaf_nodes_from_link_heads(tips_link_heads)}
+    qid_nodes_by_attribute = {attr_index: [nodes[0].qid_attribute_trees[attr_index] for nodes in link_head.values()]
+                              for attr_index, link_head in tips_link_heads.items()}
+
+    new_records = defaultdict(list)
+    for row in rows:
+        labels = []
+        for attr_index, qid_nodes in qid_nodes_by_attribute.items():
+            # the values of an unrefined attribute are not checked, just like for the root node
+            covering_nodes = qid_nodes if qid_nodes[0].is_root else [n for n in qid_nodes if n.covers_value(row[attr_index])]
+            if not covering_nodes:
+                break
+            labels.append(covering_nodes[0].node_label())
+        else:
+            new_records[tuple(labels)].append(row)
+
+    for labels, records in new_records.items():
+        leaf_nodes[labels].append_records(records)
+    return [leaf_nodes[labels] for labels in new_records]
+
+
+def longest_valid_specialization(leaf_nodes: List[TipsNode], specialization: Specialization, k: int) -> int:
+    """
+    Determine how many of the refinements of a replayed specialization (see replay_refinements) can be kept in the
+    central unit, so that each leaf node is empty or has at least k records. The counters of the given leaf nodes must
+    be known.
+
+    The leaf nodes of the first refinements are unions of the given leaf nodes. Their numbers of records are only known
+    as a range, since a counter SmallerThanK stands for 1 to k - 1 records. A union, which may have 1 to k - 1 records,
+    is considered invalid, so the result is safe, but not necessarily the longest valid specialization.
+
+    :param leaf_nodes: the leaf nodes of the central unit after replaying the specialization
+    :param specialization: the replayed refinements
+    :param k: the anonymization parameter k
+    :return: the number of refinements to keep, 0 keeps only the root node (like a run without refinements)
+    """
+    counter_type = src.counter_information_data.NodeCounterType
+    attr_indices = list(leaf_nodes[0].qid_attribute_trees)
+
+    # ranges of the numbers of records by the QID nodes of the leaf nodes
+    ranges: Dict[tuple, Tuple[int, int]] = {}
+    for node in leaf_nodes:
+        node_counter_type, count = node.node_counter_info
+        if node_counter_type == counter_type.Valid:
+            ranges[tuple(node.qid_attribute_trees.values())] = count, count
+        elif node_counter_type == counter_type.Empty:
+            ranges[tuple(node.qid_attribute_trees.values())] = 0, 0
+        else:
+            ranges[tuple(node.qid_attribute_trees.values())] = 1, k - 1
+
+    number_of_refinements = len(specialization)
+    while number_of_refinements > 0 and not all(maximum == 0 or minimum >= k for minimum, maximum in ranges.values()):
+        # undo the last refinement: merge the nodes of the children of the refined label
+        number_of_refinements -= 1
+        attr_index, label = specialization[number_of_refinements]
+        position = attr_indices.index(attr_index)
+        merged_ranges: Dict[tuple, Tuple[int, int]] = {}
+        for qid_nodes, (minimum, maximum) in ranges.items():
+            qid_node = qid_nodes[position]
+            if qid_node.parent is not None and qid_node.parent.node_label() == label:
+                qid_nodes = qid_nodes[:position] + (qid_node.parent,) + qid_nodes[position + 1:]
+            merged_minimum, merged_maximum = merged_ranges.get(qid_nodes, (0, 0))
+            merged_ranges[qid_nodes] = merged_minimum + minimum, merged_maximum + maximum
+        ranges = merged_ranges
+
+    return number_of_refinements
+
+
 def _gather_child_nodes_for_refinement(tips_nodes_to_refine: List[TipsNode], best_attr_index: AttributeIndex) -> Tuple[LinkHeadsForAttribute, ReplacementDictionary]:
     new_label_tips_node_dict = defaultdict(list)
     replacement_dictionary = {}
@@ -432,6 +641,60 @@ def extract_counter_information_data_from_tips_nodes(new_nodes: List[TipsNode])
     return result
 
 
+def determine_counters(counter_data: CounterInformationData, refined_nodes: List[TipsNode], refined_attribute_index: AttributeIndex) -> Tuple[CounterInformationData, int, int]:
+    """
+    Determine the undefined child counters of new TIPS nodes in the central unit, whose secure computation result is
+    already known. The child counters for one attribute form a counter group and are determined together:
+    - the node is empty: all child counters are empty
+    - the attribute has a single child: the child counter equals the node counter
+    - the counter group of the refined (parent) node for this attribute contains a counter less than k: the attribute
+      can never be refined for this generalization class anyway, since some descendant of the parent keeps a counter
+      less than k for it. All child counters are set to SmallerThanK.
+
+    Determined counters are not requested from the boxes (see INFO), so all parties agree on the pruned groups.
+    Like the protocol in general, this assumes that the children of a QID hierarchy node cover all its values.
+
+    :param counter_data: the counter information data of the new TIPS nodes
+    :param refined_nodes: the TIPS nodes, which have been refined to the new nodes
+    :param refined_attribute_index: the refined attribute
+    :return: a tuple consisting of the counter information data including the determined counters, the number of
+        determined counter groups and the number of determined counters
+    """
+    counter_type = src.counter_information_data.NodeCounterType
+
+    parent_child_counters: Dict[TipsNodeId, ChildCounters] = {}
+    for node in refined_nodes:
+        for child_id in node._potential_child_counters[refined_attribute_index]:
+            parent_child_counters[child_id] = node._potential_child_counters
+
+    result: CounterInformationData = {}
+    number_of_groups, number_of_counters = 0, 0
+
+    for node_id, (node_counter, child_counters) in counter_data.items():
+        new_child_counters: ChildCounters = {}
+        for attr_index, counters in child_counters.items():
+            determined_counter = None
+            if counters and all(c[0] == counter_type.Undefined for c in counters.values()):
+                if node_counter[0] == counter_type.Empty:
+                    determined_counter = counter_type.Empty, 0
+                elif len(counters) == 1 and node_counter[0] == counter_type.Valid:
+                    determined_counter = node_counter
+                elif attr_index != refined_attribute_index and node_id in parent_child_counters \
+                        and any(c[0] == counter_type.SmallerThanK for c in parent_child_counters[node_id][attr_index].values()):
+                    determined_counter = counter_type.SmallerThanK, 0
+
+            if determined_counter is None:
+                new_child_counters[attr_index] = counters
+            else:
+                new_child_counters[attr_index] = {child_id: determined_counter for child_id in counters}
+                number_of_groups += 1
+                number_of_counters += len(counters)
+
+        result[node_id] = node_counter, new_child_counters
+
+    return result, number_of_groups, number_of_counters
+
+
 # anonymized result methods
 
 
@@ -456,12 +719,8 @@ def get_anonymous_result_data_from_link_heads(tips_link_heads: LinkHeads) -> Dat
     """
     result = []
 
-    # each attribute has links to the whole dataset, just take the first
-    some_attribute_index = next(iter(tips_link_heads))
-    for generalization_name in tips_link_heads[some_attribute_index]:
-        tips_nodes = tips_link_heads[some_attribute_index][generalization_name]
-        for tips_node in tips_nodes:
-            result.extend(tips_node.anonymized_data())
+    for tips_node in leaf_nodes_from_link_heads(tips_link_heads):
+        result.extend(tips_node.anonymized_data())
 
     return result
 
@@ -0,0 +1,310 @@
+import contextlib
+import io
+import threading
+import unittest
+from unittest import mock
+
+from ddt import ddt, data
+
+from src import motion
+from src.algorithm_utils import AlgorithmRunner
+from src.data_utils import data_fulfills_k_anonymity, expand_rows, ROW_AGGREGATION_NONE, ROW_AGGREGATION_EXPANDED, \
+    ROW_AGGREGATION_WEIGHTED
+from src.aggregation import grouped_sums_gt_k, ZERO_MASK_VALUE
+from src.counter_information_data import NodeCounterType
+from src.crypto import ROW_ENCRYPTIONS
+from src.local_motion import LocalMotion
+from src.row_codec import ROW_CODECS
+from src.motion import Party, SecureSumsSession, shard_ranges, max_number_of_shards
+from src.secret_sharing import SecretSharingBackend
+from test.testdata import get_test_box_data, get_test_attribute_trees, TEST_CATEGORIES, get_test_center_tree
+
+
+@ddt
+class AlgorithmRunnerTest(unittest.TestCase):
+    TEST_K = 5
+
+    @data(2, 3, 5)
+    def test_result_is_k_anonymous(self, number_of_boxes):
+        # arrange
+        box_data = get_test_box_data(number_of_boxes)
+        attribute_trees = get_test_attribute_trees()
+        runner = AlgorithmRunner()
+
+        # act
+        result = runner.run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, [])
+
+        # assert
+        self.assertEqual(len(result), sum(len(d) for d in box_data))
+        self.assertTrue(data_fulfills_k_anonymity(result, list(attribute_trees.keys()), self.TEST_K))
+        self.assertGreater(runner.number_of_rounds, 0)
+        self.assertGreater(runner.number_of_exchanged_bytes, 0)
+
+    def test_result_does_not_depend_on_number_of_boxes(self):
+        attribute_trees = get_test_attribute_trees()
+        results = [sorted(map(str, AlgorithmRunner().run_algorithm(attribute_trees, get_test_box_data(n, 240), TEST_CATEGORIES, self.TEST_K, [])))
+                   for n in (2, 4)]
+
+        self.assertEqual(results[0], results[1])
+
+    def test_motion_parties_are_set_up_once(self):
+        # arrange
+        local_motion = LocalMotion()
+        runner = AlgorithmRunner(local_motion)
+
+        # act
+        runner.run_algorithm(get_test_attribute_trees(), get_test_box_data(3), TEST_CATEGORIES, self.TEST_K, [])
+
+        # assert
+        self.assertEqual(local_motion.number_of_setups, 4)
+        self.assertGreater(local_motion.number_of_calls, 1)
+
+    @data(5, 20)
+    def test_pruning_does_not_change_the_result(self, k):
+        # arrange
+        attribute_trees = get_test_attribute_trees()
+        attribute_trees[0] = get_test_center_tree()
+        box_data = get_test_box_data(3)
+
+        # act
+        results, number_of_inputs = [], []
+        for pruning in [contextlib.nullcontext(), mock.patch("src.central.determine_counters", lambda counter_data, *args: (counter_data, 0, 0))]:
+            local_motion = LocalMotion()
+            with pruning, contextlib.redirect_stdout(io.StringIO()):
+                results.append(sorted(map(str, AlgorithmRunner(local_motion).run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, k, []))))
+            number_of_inputs.append(local_motion.number_of_inputs)
+
+        # assert
+        self.assertEqual(results[0], results[1])
+        self.assertLess(number_of_inputs[0], number_of_inputs[1])
+
+    @data(LocalMotion, lambda: SecretSharingBackend(in_process=True))
+    def test_sharding_does_not_change_the_result(self, backend_factory):
+        # arrange
+        attribute_trees = get_test_attribute_trees()
+        box_data = get_test_box_data(3)
+
+        # act
+        results, number_of_calls = [], []
+        with mock.patch.object(SecureSumsSession, "MIN_COUNTERS_PER_SHARD", 1), contextlib.redirect_stdout(io.StringIO()):
+            for number_of_motion_shards in (1, 3):
+                backend = backend_factory()
+                runner = AlgorithmRunner(backend, number_of_motion_shards=number_of_motion_shards)
+                results.append(sorted(map(str, runner.run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, []))))
+                number_of_calls.append(backend.number_of_calls if isinstance(backend, LocalMotion) else len(backend.statistics[0]))
+
+        # assert
+        self.assertEqual(results[0], results[1])
+        self.assertGreater(number_of_calls[1], number_of_calls[0])
+
+    def test_hybrid_row_encryption_does_not_change_the_result(self):
+        attribute_trees = get_test_attribute_trees()
+        box_data = get_test_box_data(3)
+
+        results = [sorted(map(str, AlgorithmRunner(row_encryption=row_encryption).run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, [])))
+                   for row_encryption in ROW_ENCRYPTIONS]
+
+        self.assertEqual(results[0], results[1])
+
+    def test_row_codec_does_not_change_the_result(self):
+        attribute_trees = get_test_attribute_trees()
+        box_data = get_test_box_data(3)
+
+        results = [sorted(map(str, AlgorithmRunner(row_codec=row_codec).run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, [])))
+                   for row_codec in ROW_CODECS]
+
+        self.assertEqual(results[0], results[1])
+
+    @data(ROW_AGGREGATION_EXPANDED, ROW_AGGREGATION_WEIGHTED)
+    def test_row_aggregation_does_not_change_the_result(self, row_aggregation):
+        # arrange
+        attribute_trees = get_test_attribute_trees()
+        box_data = get_test_box_data(3)
+        runners = [AlgorithmRunner(row_aggregation=ROW_AGGREGATION_NONE), AlgorithmRunner(row_aggregation=row_aggregation)]
+
+        # act
+        results = [runner.run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, []) for runner in runners]
+
+        # assert
+        expected = sorted(map(str, results[0]))
+        self.assertEqual(sorted(map(str, results[1] if row_aggregation == ROW_AGGREGATION_EXPANDED else expand_rows(results[1]))), expected)
+        self.assertLess(runners[1].number_of_exchanged_bytes, runners[0].number_of_exchanged_bytes)
+
+    def test_concurrent_requests_are_batched(self):
+        # arrange
+        attribute_trees = get_test_attribute_trees()
+        requests = [get_test_box_data(3), get_test_box_data(3, 270)]  # the same bit width
+        expected, number_of_calls = [], 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for box_data in requests:
+                local_motion = LocalMotion()
+                expected.append(sorted(map(str, AlgorithmRunner(local_motion).run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, self.TEST_K, []))))
+                number_of_calls += local_motion.number_of_calls
+        local_motion = LocalMotion()
+        results = [None] * len(requests)
+
+        def run(i: int):
+            runner = AlgorithmRunner(local_motion, batch_window=0.05)
+            results[i] = sorted(map(str, runner.run_algorithm(attribute_trees, requests[i], TEST_CATEGORIES, self.TEST_K, [])))
+
+        # act
+        # both runs use the same parties, so they share the sessions, which are closed afterwards
+        with mock.patch("src.algorithm_utils.motion.close_sessions"), contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        motion.close_sessions(local_motion)
+
+        # assert
+        self.assertEqual(results, expected)
+        self.assertLess(local_motion.number_of_calls, number_of_calls)
+
+
+class LocalMotionTest(unittest.TestCase):
+
+    def test_grouped_sums_gt_k(self):
+        summed_inputs = [[10], [6, 0], [3, 7], [0, 0]]
+
+        results = grouped_sums_gt_k(summed_inputs, 5)
+
+        self.assertEqual(results, [[10], [6, ZERO_MASK_VALUE], [0, 0], [ZERO_MASK_VALUE, ZERO_MASK_VALUE]])
+
+    def test_sums_exceeding_bit_width(self):
+        local_motion = LocalMotion()
+
+        with self.assertRaises(Exception):
+            local_motion.perform_arithmetic_then_bool_with_groups([(0, "127.0.0.1", 5442)], 0, [[8]], 5, bit_width=3)
+
+    def test_shard_ranges(self):
+        self.assertEqual(shard_ranges([1] * 10, 3), [(0, 4), (4, 7), (7, 10)])
+        self.assertEqual(shard_ranges([5, 1, 1, 1, 1, 1], 2), [(0, 1), (1, 6)])
+        self.assertEqual(shard_ranges([10] * 10, 4, min_counters_per_shard=64), [(0, 10)])
+        self.assertEqual(shard_ranges([3], 4), [(0, 1)])
+
+    def test_shard_ports_are_valid(self):
+        # arrange
+        parties = [Party(0, "127.0.0.1", 4442, 5442), Party(1, "127.0.0.1", 4443, 5443)]
+
+        # act
+        number_of_shards = max_number_of_shards(parties)
+
+        # assert
+        self.assertEqual(number_of_shards, 61)
+        self.assertLessEqual(5443 + (number_of_shards - 1) * SecureSumsSession.SHARD_PORT_STRIDE, 65535)
+        self.assertEqual(max_number_of_shards([Party(0, "127.0.0.1", 4442, 65535)]), 1)
+        with self.assertRaises(ValueError):
+            SecureSumsSession(parties, 0, LocalMotion(), number_of_shards + 1)
+
+    def test_batched_requests_receive_their_results(self):
+        # arrange
+        local_motion = LocalMotion()
+        parties = [Party(0, "127.0.0.1", 4442, 5442), Party(1, "127.0.0.1", 4443, 5443)]
+        sessions = [motion.SecureSumsSession(parties, party_id, local_motion) for party_id in (0, 1)]
+        counters = [[{"a": (NodeCounterType.Undefined, 3)}, {"b": (NodeCounterType.Undefined, 1)}],
+                    [{"c": (NodeCounterType.Undefined, 4), "d": (NodeCounterType.Undefined, 0)}]]
+        batches, results = [None] * len(counters), {}
+
+        def join(request: int):
+            batches[request] = sessions[0].join_batch(5, window=0.05)
+
+        def compute(party_id: int, request: int):
+            results[party_id, request] = sessions[party_id].perform_batched_secure_sums_gt_k(batches[request], counters[request], 5 if party_id == 0 else 0)
+
+        # act
+        for target, args in [(join, [(r,) for r in range(len(counters))]), (compute, [(p, r) for p in (0, 1) for r in range(len(counters))])]:
+            threads = [threading.Thread(target=target, args=a) for a in args]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        for session in sessions:
+            session.close()
+
+        # assert
+        self.assertEqual(sorted(batches), [(sessions[0].session_id, 0, 0, 2), (sessions[0].session_id, 0, 1, 2)])
+        self.assertEqual(local_motion.number_of_calls, 1)
+        for party_id in (0, 1):
+            self.assertEqual([g[n][1] for g in results[party_id, 0] for n in g], [6, 0])
+            self.assertEqual([g[n][1] for g in results[party_id, 1] for n in g], [8, 0])
+
+    def test_batches_of_a_restarted_central_are_computed(self):
+        # arrange
+        local_motion = LocalMotion()
+        parties = [Party(0, "127.0.0.1", 4442, 5442), Party(1, "127.0.0.1", 4443, 5443)]
+        box_session = motion.SecureSumsSession(parties, 1, local_motion)
+        counters = [{"a": (NodeCounterType.Undefined, 3)}, {"b": (NodeCounterType.Undefined, 1)}]
+        results = []
+
+        # act
+        # each session of the central numbers its batches from 0, the session of the box is kept
+        for _ in range(2):
+            central_session = motion.SecureSumsSession(parties, 0, local_motion)
+            batch = central_session.join_batch(5, window=0)
+            box_thread = threading.Thread(target=lambda: box_session.perform_batched_secure_sums_gt_k(batch, counters, 0))
+            box_thread.start()
+            results.append(central_session.perform_batched_secure_sums_gt_k(batch, counters, 5))
+            box_thread.join(timeout=5)
+            central_session.close()
+        box_session.close()
+
+        # assert
+        self.assertFalse(box_thread.is_alive())
+        self.assertEqual(local_motion.number_of_calls, 2)
+        self.assertEqual(box_session.number_of_batched_requests, 2)
+        for result in results:
+            self.assertEqual([g[n][1] for g in result for n in g], [6, 0])
+
+    def test_sessions_are_reused(self):
+        # arrange
+        local_motion = LocalMotion()
+        parties = [Party(0, "127.0.0.1", 4442, 5442), Party(1, "127.0.0.1", 4443, 5443)]
+
+        # act
+        session = motion.open_session(parties, 1, local_motion)
+        same_session = motion.open_session(parties, 1, local_motion)
+        other_session = motion.open_session(parties, 0, local_motion)
+        motion.close_sessions(local_motion)
+
+        # assert
+        self.assertIs(session, same_session)
+        self.assertIsNot(session, other_session)
+        self.assertIsNot(session, motion.open_session(parties, 1, local_motion))
+        motion.close_sessions(local_motion)
+
+    def test_box_sessions_are_replaced_for_a_restarted_central(self):
+        # arrange
+        local_motion = LocalMotion()
+        parties = [Party(0, "127.0.0.1", 4442, 5442), Party(1, "127.0.0.1", 4443, 5443)]
+
+        # act
+        session = motion.open_session(parties, 1, local_motion, central_session_id="first")
+        same_session = motion.open_session(parties, 1, local_motion, central_session_id="first")
+        new_session = motion.open_session(parties, 1, local_motion, central_session_id="restarted")
+
+        # assert
+        self.assertIs(session, same_session)
+        self.assertIsNot(session, new_session)
+        self.assertFalse(any(worker._thread.is_alive() for worker in session._workers))  # closed, so its ports are free
+        self.assertIs(motion.open_session(parties, 1, local_motion, central_session_id="restarted"), new_session)
+        motion.close_sessions(local_motion)
+
+    def test_preprocessing_in_session(self):
+        # arrange
+        local_motion = LocalMotion()
+        session = local_motion.open_session([(0, "127.0.0.1", 5442)], 0)
+
+        # act
+        session.preprocess(2, 3)
+        first_results = session.perform_arithmetic_then_bool_with_groups([[1], [5, 6]], 2)
+        second_results = session.perform_arithmetic_then_bool_with_groups([[1], [5, 6]], 2)
+
+        # assert
+        self.assertEqual(first_results, [[0], [5, 6]])
+        self.assertEqual(first_results, second_results)
+        self.assertEqual(local_motion.number_of_inputs_preprocessed_online, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from src import motion
+from src.algorithm_utils import AlgorithmRunner
+from src.box import serve_requests
+from src.box_data import BoxData, follow_append_file
+from src.central import run_request, Central, perform_request
+from src.communication import InProcessTransport
+from src.data_utils import data_fulfills_k_anonymity
+from src.local_motion import LocalMotion
+from src.motion import Party
+from test.testdata import get_test_box_data, get_test_attribute_trees, TEST_CATEGORIES, get_test_data
+
+TEST_K = 5
+HOST = "127.0.0.1"
+
+
+class ServeRequestsTest(unittest.TestCase):
+
+    def run_requests(self, requests, concurrently: bool):
+        """
+        Let box daemons answer the given (central ring port, criteria) requests, returns the results.
+        """
+        box_data = get_test_box_data(3)
+        transport, local_motion = InProcessTransport(), LocalMotion()
+        parties = [Party(i, HOST, 4442 + i, 5442 + i) for i in range(1, len(box_data) + 1)]
+        results = [None] * len(requests)
+
+        def run_central(i: int):
+            central_ring_port, criteria = requests[i]
+            results[i] = sorted(map(str, run_request(TEST_K, criteria, parties, HOST, central_ring_port, central_ring_port + 1000,
+                                                     get_test_attribute_trees(), transport, local_motion)))
+
+        boxes = [threading.Thread(target=serve_requests, args=(BoxData(TEST_CATEGORIES, data), p.id, p.host, p.ring_port, transport, local_motion),
+                                  kwargs={"number_of_requests": len(requests)})
+                 for data, p in zip(box_data, parties)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for box in boxes:
+                box.start()
+            centrals = [threading.Thread(target=run_central, args=(i,)) for i in range(len(requests))]
+            for central in centrals:
+                central.start()
+                if not concurrently:
+                    central.join()
+            for thread in centrals + boxes:
+                thread.join()
+        motion.close_sessions(local_motion)
+        return results
+
+    @staticmethod
+    def expected_result(criteria):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sorted(map(str, AlgorithmRunner().run_algorithm(get_test_attribute_trees(), get_test_box_data(3), TEST_CATEGORIES, TEST_K, criteria)))
+
+    def test_consecutive_requests_are_answered(self):
+        requests = [(4442, []), (4442, [["Age", ">", "30"]])]
+
+        results = self.run_requests(requests, concurrently=False)
+
+        self.assertEqual(results, [self.expected_result(criteria) for _, criteria in requests])
+
+    def test_concurrent_requests_of_several_centrals_are_answered(self):
+        requests = [(4402, []), (4412, [["Sex", "=", "1"]]), (4422, [["Age", "<", "80"]])]
+
+        results = self.run_requests(requests, concurrently=True)
+
+        self.assertEqual(results, [self.expected_result(criteria) for _, criteria in requests])
+
+    def test_warm_starts_after_appending_records(self):
+        # arrange
+        box_data = [BoxData(TEST_CATEGORIES, data) for data in get_test_box_data(3)]
+        new_rows = get_test_data(60, seed=7)
+        transport, local_motion = InProcessTransport(), LocalMotion()
+        parties = [Party(i, HOST, 4442 + i, 5442 + i) for i in range(1, len(box_data) + 1)]
+        boxes = [threading.Thread(target=serve_requests, args=(data, p.id, p.host, p.ring_port, transport, local_motion),
+                                  kwargs={"number_of_requests": 3})
+                 for data, p in zip(box_data, parties)]
+
+        def run_central(k, specialization=None):
+            c = Central(k, get_test_attribute_trees(), [], parties, HOST, 4442, 5442, transport, local_motion, specialization=specialization)
+            return perform_request(c, transport, HOST, 4442), c.specialization
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            for box in boxes:
+                box.start()
+            _, specialization = run_central(TEST_K)
+            for i, data in enumerate(box_data):
+                data.append(new_rows[i * 20:(i + 1) * 20])
+            result, _ = run_central(TEST_K, specialization)
+            # a larger k undoes refinements
+            result_for_larger_k, specialization_for_larger_k = run_central(4 * TEST_K, specialization)
+            for box in boxes:
+                box.join()
+        motion.close_sessions(local_motion)
+
+        # assert
+        qid_indices = list(get_test_attribute_trees())
+        self.assertEqual(len(result), 360)
+        self.assertTrue(data_fulfills_k_anonymity(result, qid_indices, TEST_K))
+        self.assertEqual(len(result_for_larger_k), 360)
+        self.assertTrue(data_fulfills_k_anonymity(result_for_larger_k, qid_indices, 4 * TEST_K))
+        self.assertLess(len(specialization_for_larger_k), len(specialization))
+
+    def test_warm_starts_after_records_were_appended_to_the_files_of_running_boxes(self):
+        # arrange
+        box_data = [BoxData(TEST_CATEGORIES, data) for data in get_test_box_data(3)]
+        new_rows = get_test_data(60, seed=7)
+        transport, local_motion = InProcessTransport(), LocalMotion()
+        parties = [Party(i, HOST, 4442 + i, 5442 + i) for i in range(1, len(box_data) + 1)]
+        directory = tempfile.TemporaryDirectory()
+        paths = [os.path.join(directory.name, f"append_{p.id}.csv") for p in parties]
+        stop = threading.Event()
+        followers = [threading.Thread(target=follow_append_file, args=(data, path, 0.01, stop)) for data, path in zip(box_data, paths)]
+        boxes = [threading.Thread(target=serve_requests, args=(data, p.id, p.host, p.ring_port, transport, local_motion),
+                                  kwargs={"number_of_requests": 2})
+                 for data, p in zip(box_data, parties)]
+
+        def run_central(specialization=None):
+            c = Central(TEST_K, get_test_attribute_trees(), [], parties, HOST, 4442, 5442, transport, local_motion, specialization=specialization)
+            return perform_request(c, transport, HOST, 4442), c
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in followers + boxes:
+                thread.start()
+            _, c = run_central()
+            for i, path in enumerate(paths):
+                with open(path, "w") as f:
+                    f.writelines(",".join(map(str, row)) + "\n" for row in new_rows[i * 20:(i + 1) * 20])
+                    f.write("1,?,2,1.0\n")  # dropped
+            deadline = time.monotonic() + 10
+            while any(data.version == 0 for data in box_data) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            result, warm_started_c = run_central(c.specialization)
+            stop.set()
+            for thread in followers + boxes:
+                thread.join()
+        motion.close_sessions(local_motion)
+        directory.cleanup()
+
+        # assert
+        self.assertEqual([len(data.rows) for data in box_data], [120, 120, 120])
+        self.assertEqual(len(result), 360)
+        self.assertTrue(data_fulfills_k_anonymity(result, list(get_test_attribute_trees()), TEST_K))
+        self.assertLess(warm_started_c.number_of_secure_counters, c.number_of_secure_counters)
+
+
+if __name__ == '__main__':
+    unittest.main()
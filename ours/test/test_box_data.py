@@ -0,0 +1,120 @@
+import unittest
+
+from ddt import ddt, data
+
+from src.box_data import BoxData
+from src.criteria import CriteriaIndex, select_rows
+from src.qid_hierarchy_node import QidNodeCoder
+from src.tips_nodes import setup_tips_root_node, setup_tips_link_heads, replay_refinements, leaf_nodes_from_link_heads, \
+    extract_counter_information_data_from_tips_nodes
+from test.testdata import get_test_data, get_test_attribute_trees, TEST_CATEGORIES
+
+SPECIALIZATION = [(1, "1:119"), (2, "1:2"), (1, "1:76")]
+
+
+def counted_leaf_counters(rows, criteria, qid_attributes, specialization):
+    """
+    The counters of the leaf nodes of a TIPS tree counting the records matching the criteria from the root node.
+    """
+    tips_root = setup_tips_root_node(select_rows(TEST_CATEGORIES, rows, criteria), qid_attributes)
+    link_heads = replay_refinements(setup_tips_link_heads(tips_root, qid_attributes), specialization)
+    return extract_counter_information_data_from_tips_nodes(leaf_nodes_from_link_heads(link_heads))
+
+
+@ddt
+class BoxDataCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.qid_attributes = get_test_attribute_trees()
+
+    def leaf_counters(self, box_data, criteria, specialization):
+        link_heads, _ = box_data.tips_tree(criteria, self.qid_attributes, specialization)
+        return extract_counter_information_data_from_tips_nodes(leaf_nodes_from_link_heads(link_heads))
+
+    @data(([], False), ([["Age", ">", "30"]], False), ([["Age", ">", "30"], ["Center", "<", "3"]], True))
+    def test_cached_counters_equal_counting_from_the_root(self, criteria_and_index):
+        # arrange
+        criteria, with_index = criteria_and_index
+        rows = get_test_data()
+        box_data = BoxData(TEST_CATEGORIES, rows, CriteriaIndex(TEST_CATEGORIES, rows) if with_index else None, max_cached_trees=0)
+
+        # act
+        counters = [self.leaf_counters(box_data, criteria, SPECIALIZATION[:length]) for length in (0, 3, 3)]
+
+        # assert
+        for length, leaf_counters in zip((0, 3, 3), counters):
+            self.assertEqual(leaf_counters, counted_leaf_counters(get_test_data(), criteria, self.qid_attributes, SPECIALIZATION[:length]))
+        self.assertGreater(box_data.cache.hits, 0)
+
+    def test_requests_with_other_qids_share_the_selection_and_encoded_columns(self):
+        # arrange
+        criteria = [["Age", ">", "30"]]
+        box_data = BoxData(TEST_CATEGORIES, get_test_data(), max_cached_trees=0)
+        box_data.tips_tree(criteria, self.qid_attributes, [])
+        misses = box_data.cache.misses
+
+        # act
+        del self.qid_attributes[2]
+        box_data.tips_tree(criteria, self.qid_attributes, [])
+
+        # assert
+        self.assertEqual(box_data.cache.misses - misses, 1)  # only the counters of the new QID set are missing
+        self.assertEqual(box_data.cache.hits, 1 + len(self.qid_attributes))
+
+    def test_appended_records_replace_cached_results(self):
+        # arrange
+        criteria = [["Age", ">", "30"]]
+        rows = get_test_data()
+        box_data = BoxData(TEST_CATEGORIES, rows, max_cached_trees=0)
+        self.leaf_counters(box_data, criteria, SPECIALIZATION)
+        new_rows = [[1, 40, 1, 2.0], [2, 90, 2, 1.0]]
+
+        # act
+        box_data.append(new_rows)
+        leaf_counters = self.leaf_counters(box_data, criteria, SPECIALIZATION)
+
+        # assert
+        self.assertEqual(leaf_counters, counted_leaf_counters(get_test_data() + new_rows, criteria, self.qid_attributes, SPECIALIZATION))
+        self.assertEqual(box_data.cache.hits, 0)
+
+    @data([], [["Age", ">", "30"]], [["Center", "<", "3"]])
+    def test_counters_from_stored_leaf_codes_equal_counting_from_the_root(self, criteria):
+        # arrange
+        rows = get_test_data()
+        leaf_codes = {attr_index: (QidNodeCoder(tree.leaves).labels, QidNodeCoder(tree.leaves).codes([row[attr_index] for row in rows]))
+                      for attr_index, tree in self.qid_attributes.items()}
+        box_data = BoxData(TEST_CATEGORIES, rows, max_cached_trees=0, leaf_codes=leaf_codes)
+        new_rows = [[1, 40, 1, 2.0], [2, 90, 2, 1.0]]
+
+        # act
+        leaf_counters = self.leaf_counters(box_data, criteria, SPECIALIZATION)
+        box_data.append(new_rows)
+        appended_leaf_counters = self.leaf_counters(box_data, criteria, SPECIALIZATION)
+
+        # assert
+        self.assertEqual(leaf_counters, counted_leaf_counters(get_test_data(), criteria, self.qid_attributes, SPECIALIZATION))
+        self.assertEqual(appended_leaf_counters, counted_leaf_counters(get_test_data() + new_rows, criteria, self.qid_attributes, SPECIALIZATION))
+
+    def test_leaf_codes_of_other_hierarchies_are_ignored(self):
+        # arrange
+        rows = get_test_data()
+        leaf_codes = {1: (["1:119"], [0] * len(rows))}
+        box_data = BoxData(TEST_CATEGORIES, rows, max_cached_trees=0, leaf_codes=leaf_codes)
+
+        # act
+        leaf_counters = self.leaf_counters(box_data, [], SPECIALIZATION)
+
+        # assert
+        self.assertEqual(leaf_counters, counted_leaf_counters(get_test_data(), [], self.qid_attributes, SPECIALIZATION))
+
+    def test_disabled_cache_keeps_nothing(self):
+        box_data = BoxData(TEST_CATEGORIES, get_test_data(), max_cached_trees=0, max_cache_bytes=0)
+
+        for _ in range(2):
+            box_data.tips_tree([["Age", ">", "30"]], self.qid_attributes, [])
+
+        self.assertEqual((len(box_data.cache), box_data.cache.hits), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
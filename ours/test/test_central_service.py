@@ -0,0 +1,146 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from src import motion
+from src.algorithm_utils import AlgorithmRunner
+from src.box import serve_requests
+from src.box_data import BoxData
+from src.central_service import CentralService, AnonymizationRequest, AdmissionError
+from src.communication import InProcessTransport
+from src.data_utils import data_fulfills_k_anonymity
+from src.local_motion import LocalMotion
+from src.motion import Party
+from src.specialization_store import SpecializationStore
+from test.testdata import get_test_box_data, get_test_attribute_trees, TEST_CATEGORIES, get_test_data
+
+TEST_K = 5
+HOST = "127.0.0.1"
+
+
+class CentralServiceTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.transport, self.local_motion = InProcessTransport(), LocalMotion()
+        self.parties = [Party(i, HOST, 4442 + i, 5442 + i) for i in range(1, 4)]
+
+    def tearDown(self) -> None:
+        motion.close_sessions(self.local_motion)
+
+    def start_boxes(self, number_of_requests, box_data=None):
+        box_data = box_data if box_data is not None else [BoxData(TEST_CATEGORIES, data) for data in get_test_box_data(3)]
+        boxes = [threading.Thread(target=serve_requests, args=(data, p.id, p.host, p.ring_port, self.transport, self.local_motion),
+                                  kwargs={"number_of_requests": number_of_requests})
+                 for data, p in zip(box_data, self.parties)]
+        for box in boxes:
+            box.start()
+        return boxes
+
+    @staticmethod
+    def expected_result(criteria):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sorted(map(str, AlgorithmRunner().run_algorithm(get_test_attribute_trees(), get_test_box_data(3), TEST_CATEGORIES, TEST_K, criteria)))
+
+    def test_concurrent_requests_are_answered_in_separate_slots(self):
+        # arrange
+        criteria_lists = [[], [["Sex", "=", "1"]], [["Age", "<", "80"]], [["Age", ">", "30"]], []]
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            boxes = self.start_boxes(len(criteria_lists))
+            service = CentralService(self.parties, HOST, 4442, 5442, self.transport, self.local_motion, max_concurrent_requests=2)
+            futures = [service.submit(AnonymizationRequest(TEST_K, criteria, get_test_attribute_trees())) for criteria in criteria_lists]
+            results = [sorted(map(str, future.result())) for future in futures]
+            service.close()
+            for box in boxes:
+                box.join()
+
+        # assert
+        self.assertEqual(results, [self.expected_result(criteria) for criteria in criteria_lists])
+        metrics = service.metrics()
+        self.assertEqual((metrics["completed"], metrics["failed"], metrics["rejected"]), (5, 0, 0))
+        self.assertGreater(metrics["throughput"], 0)
+        self.assertLessEqual(metrics["latency_median"], metrics["latency_p95"])
+
+    def test_requests_exceeding_the_queue_are_rejected(self):
+        # arrange
+        service = CentralService(self.parties, HOST, 4442, 5442, self.transport, self.local_motion, max_concurrent_requests=1,
+                                 max_queued_requests=1)
+        futures = [service.submit(AnonymizationRequest(TEST_K, [], get_test_attribute_trees())) for _ in range(2)]
+
+        # act
+        with self.assertRaises(AdmissionError):
+            service.submit(AnonymizationRequest(TEST_K, [], get_test_attribute_trees()))
+
+        # assert
+        with contextlib.redirect_stdout(io.StringIO()):
+            boxes = self.start_boxes(len(futures))
+            for future in futures:
+                self.assertEqual(len(future.result()), 300)
+            service.close()
+            for box in boxes:
+                box.join()
+        self.assertEqual(service.metrics()["rejected"], 1)
+
+    def test_results_are_cached_until_records_are_appended(self):
+        # arrange
+        box_data = [BoxData(TEST_CATEGORIES, data) for data in get_test_box_data(3)]
+        new_rows = get_test_data(30, seed=7)
+
+        def perform(service):
+            request = AnonymizationRequest(TEST_K, [["Age", ">", "30"]], get_test_attribute_trees())
+            return sorted(map(str, service.submit(request).result())), request
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            boxes = self.start_boxes(2, box_data)  # the cached result does not reach the boxes
+            service = CentralService(self.parties, HOST, 4442, 5442, self.transport, self.local_motion, max_cached_result_bytes=2 ** 20)
+            result, first_request = perform(service)
+            cached_result, cached_request = perform(service)
+            for i, data in enumerate(box_data):
+                data.append(new_rows[i * 10:(i + 1) * 10])
+            result_after_append, warm_started_request = perform(service)
+            service.close()
+            for box in boxes:
+                box.join()
+
+        # assert
+        self.assertEqual(result, self.expected_result([["Age", ">", "30"]]))
+        self.assertEqual(cached_result, result)
+        self.assertEqual((cached_request.cached_result, cached_request.result_specialization), (True, first_request.result_specialization))
+        self.assertTrue(warm_started_request.warm_started)
+        self.assertEqual(len(result_after_append), len(result) + len([row for row in new_rows if row[1] > 30]))
+        metrics = service.metrics()
+        self.assertEqual((metrics["completed"], metrics["cached"], metrics["warm_started"]), (3, 1, 1))
+
+    def test_related_requests_warm_start_from_earlier_requests(self):
+        # arrange
+        service = CentralService(self.parties, HOST, 4442, 5442, self.transport, self.local_motion, max_concurrent_requests=1,
+                                 specialization_store=SpecializationStore())
+        requests = [AnonymizationRequest(TEST_K, [], get_test_attribute_trees()),
+                    AnonymizationRequest(TEST_K - 2, [], {1: get_test_attribute_trees()[1]})]  # smaller k, without sex
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            boxes = self.start_boxes(len(requests))
+            results = [service.submit(request).result() for request in requests]
+            service.close()
+            for box in boxes:
+                box.join()
+
+        # assert
+        self.assertEqual([request.warm_started for request in requests], [False, True])
+        self.assertEqual(len(results[1]), 300)
+        self.assertTrue(data_fulfills_k_anonymity(results[1], [1], TEST_K - 2))
+        age_refinements = [refinement for refinement in requests[0].result_specialization if refinement[0] == 1]
+        self.assertEqual(requests[1].result_specialization[:len(age_refinements)], age_refinements)
+
+    def test_overlapping_ports_are_rejected(self):
+        with self.assertRaises(ValueError):
+            CentralService(self.parties, HOST, 4442 - CentralService.RING_PORT_STRIDE + 1, 5442, self.transport, self.local_motion,
+                           max_concurrent_requests=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+import unittest
+
+from ddt import ddt, data, unpack
+
+from src.communication import UnixSocketTransport, InProcessTransport, SocketTransport, is_local_host, LOCALHOST, unix_socket_path
+
+
+@ddt
+class CommunicationTest(unittest.TestCase):
+    TEST_PORT = 7442
+
+    @data(
+        ["localhost", True],
+        ["127.0.0.1", True],
+        ["127.0.1.1", True],
+        ["::1", True],
+        ["10.0.0.1", False],
+        ["example.org", False],
+    )
+    @unpack
+    def test_is_local_host(self, host, expected_result):
+        self.assertEqual(is_local_host(host), expected_result)
+
+    @data(
+        [UnixSocketTransport(), 100],
+        [UnixSocketTransport(shared_memory_threshold=1024), 100000],
+        [InProcessTransport(), 100000],
+    )
+    @unpack
+    def test_send_and_receive(self, transport, payload_size):
+        # arrange
+        sent_data = {"payload": b"x" * payload_size, "rows": [[1, "1:65"]]}
+        received = []
+        receiver = threading.Thread(target=lambda: received.append(transport.receive_data(LOCALHOST, self.TEST_PORT)))
+        receiver.start()
+
+        # act
+        transport.send_data_to_other_party(sent_data, LOCALHOST, self.TEST_PORT)
+        receiver.join()
+        transport.close()
+
+        # assert
+        self.assertEqual(received, [sent_data])
+
+    @data(UnixSocketTransport(), SocketTransport())
+    def test_messages_of_concurrent_senders_are_all_received(self, transport):
+        # arrange
+        port = self.TEST_PORT + 1
+        received = []
+        receiver = threading.Thread(target=lambda: received.extend(transport.receive_data(LOCALHOST, port) for _ in range(8)), daemon=True)
+        receiver.start()
+
+        # act
+        senders = [threading.Thread(target=transport.send_data_to_other_party, args=({"message": i}, LOCALHOST, port)) for i in range(8)]
+        for sender in senders:
+            sender.start()
+        receiver.join(timeout=10)
+        transport.close()
+
+        # assert
+        self.assertEqual(sorted(message["message"] for message in received), list(range(8)))
+
+    def test_socket_of_a_running_receiver_is_not_taken_over(self):
+        # arrange
+        port = self.TEST_PORT + 2
+        transport = UnixSocketTransport()
+        received = []
+        receiver = threading.Thread(target=lambda: received.append(transport.receive_data(LOCALHOST, port)), daemon=True)
+        receiver.start()
+        while not os.path.exists(unix_socket_path(port)):
+            time.sleep(0.001)
+
+        # act
+        with self.assertRaises(OSError):
+            UnixSocketTransport().receive_data(LOCALHOST, port)
+
+        # assert
+        transport.send_data_to_other_party({"message": 1}, LOCALHOST, port)  # the probe is not received as a message
+        receiver.join(timeout=10)
+        transport.close()
+        self.assertEqual(received, [{"message": 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
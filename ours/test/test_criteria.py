@@ -0,0 +1,91 @@
+import contextlib
+import copy
+import io
+import unittest
+
+from ddt import ddt, data
+
+from src.criteria import CriteriaIndex, select_rows
+from test.testdata import get_test_data, TEST_CATEGORIES
+
+
+def select_by_scanning(criteria, data_categories, data):
+    """
+    The rows matching the criteria by checking each row for each criterion.
+    """
+    result = []
+    for row in data:
+        if all(_matches(row[data_categories.index(category)], operator, float(value)) for category, operator, value in criteria):
+            result.append(["*"] + row[1:])
+    return result
+
+
+def _matches(value, operator, criterion_value):
+    if type(value) not in (int, float):
+        return False
+    return (operator == "=" and value == criterion_value) or (operator == "<" and value < criterion_value) or \
+        (operator == ">" and value > criterion_value)
+
+
+@ddt
+class CriteriaIndexTest(unittest.TestCase):
+
+    @data([["Age", ">", "30"]], [["Age", "<", "30"], ["Sex", "=", "1"]], [["Score", "=", "3.0"], ["Age", ">", "50"], ["Center", "<", "5"]],
+          [["Age", ">", "119"]], [["Score", "<", "0"]], [["Age", "=", "30"], ["Age", "=", "31"]])
+    def test_selection_equals_scanning_all_rows(self, criteria):
+        # arrange
+        rows = get_test_data()
+        index = CriteriaIndex(TEST_CATEGORIES, rows)
+
+        # act
+        result = index.select(criteria)
+        same_result = index.select(criteria)
+
+        # assert
+        self.assertEqual(result, select_by_scanning(criteria, TEST_CATEGORIES, get_test_data()))
+        self.assertEqual(result, same_result)
+
+    @data([["Age", ">", "30"]], [["Age", "<", "30"], ["Sex", "=", "1"]], [["Score", "=", "3.0"], ["Age", ">", "50"], ["Center", "<", "5"]])
+    def test_selection_without_index_equals_selection_with_built_index(self, criteria):
+        # arrange
+        index = CriteriaIndex(TEST_CATEGORIES, get_test_data())
+        index.build()
+
+        # act
+        result = select_rows(TEST_CATEGORIES, get_test_data(), criteria)
+
+        # assert
+        self.assertEqual(result, index.select(criteria))
+
+    def test_source_rows_are_not_changed(self):
+        rows = get_test_data()
+
+        result = CriteriaIndex(TEST_CATEGORIES, rows).select([["Age", ">", "30"], ["Center", ">", "2"]])
+
+        self.assertGreater(len(result), 0)
+        self.assertEqual(rows, get_test_data())
+
+    def test_all_rows_without_criteria(self):
+        rows = get_test_data()
+
+        self.assertEqual(CriteriaIndex(TEST_CATEGORIES, rows).select([]), rows)
+
+    def test_missing_values_and_invalid_criteria_do_not_match(self):
+        # arrange
+        rows = [[1, 30, 1, ""], [2, 40, 2, 3.0], [3, 50, 1, float("nan")]]
+        index = CriteriaIndex(TEST_CATEGORIES, copy.deepcopy(rows))
+
+        # act
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [index.select(criteria) for criteria in ([["Score", ">", "1"]], [["Score", "<", "5"]], [["Weight", ">", "1"]],
+                                                               [["Age", ">", "thirty"]], [["Age", ">", "nan"]])]
+
+        # assert
+        self.assertEqual(results, [[["*", 40, 2, 3.0]], [["*", 40, 2, 3.0]], [], [], []])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(select_rows(TEST_CATEGORIES, rows, [["Score", ">", "1"]]), [["*", 40, 2, 3.0]])
+            self.assertEqual(select_rows(TEST_CATEGORIES, rows, [["Age", ">", "nan"]]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import pickle
+import unittest
+from operator import itemgetter
+from random import shuffle
+from unittest import mock
+
+from ddt import ddt, data
+from nacl.exceptions import CryptoError
+from nacl.public import SealedBox
+
+from src.central import Central
+from src.constants import DUMMY
+from src.crypto import generate_keys, encrypt_data_rows, encrypt_data_rows_hybrid, decrypt_result_hybrid, decrypt_result, \
+    decrypt_sorted_result
+from src.row_codec import RowCodec
+from test.testdata import get_test_box_data, get_test_attribute_trees
+
+
+class HybridRowEncryptionTest(unittest.TestCase):
+
+    def test_rows_of_all_parties_are_decrypted(self):
+        # arrange
+        private_key, public_key = generate_keys()
+        box_data = get_test_box_data(3)
+        encrypted_rows, session_keys = [], []
+        for data in box_data:
+            rows, session_key = encrypt_data_rows_hybrid(data, public_key)
+            encrypted_rows.extend(rows)
+            session_keys.append(session_key)
+        shuffle(encrypted_rows)
+
+        # act
+        result = decrypt_result_hybrid(encrypted_rows, private_key, session_keys)
+
+        # assert
+        self.assertEqual(sorted(map(str, result)), sorted(str(row) for data in box_data for row in data))
+
+    def test_rows_have_the_same_shape_for_all_parties(self):
+        _, public_key = generate_keys()
+        row = get_test_box_data(1)[0][0]
+
+        rows = [encrypt_data_rows_hybrid([row, row], public_key)[0] for _ in range(2)]
+
+        self.assertEqual(len({len(r) for party_rows in rows for r in party_rows}), 1)
+        self.assertEqual(len({r for party_rows in rows for r in party_rows}), 4)
+        self.assertLess(len(rows[0][0]), len(encrypt_data_rows([row], public_key)[0]))
+
+    def test_session_keys_do_not_reveal_the_number_of_rows(self):
+        # arrange
+        _, public_key = generate_keys()
+        other_private_key, _ = generate_keys()
+        data = get_test_box_data(1, 5)[0]
+
+        # act
+        session_keys = [encrypt_data_rows_hybrid(data[:number_of_rows], public_key)[1] for number_of_rows in (1, len(data))]
+
+        # assert
+        self.assertEqual(len(session_keys[0]), len(session_keys[1]))
+        with self.assertRaises(CryptoError):
+            SealedBox(other_private_key).decrypt(session_keys[0])  # a box forwarding the session keys
+
+    def test_rows_of_unknown_parties_are_rejected(self):
+        private_key, public_key = generate_keys()
+        rows, session_key = encrypt_data_rows_hybrid(get_test_box_data(1, 5)[0], public_key)
+        other_rows, _ = encrypt_data_rows_hybrid(get_test_box_data(1, 5)[0], public_key)
+
+        with self.assertRaises(CryptoError):
+            decrypt_result_hybrid(rows + other_rows, private_key, [session_key])
+
+
+@ddt
+class ParallelRowEncryptionTest(unittest.TestCase):
+
+    @data(1, 3)
+    def test_rows_are_encrypted_in_chunks(self, number_of_workers):
+        # arrange
+        private_key, public_key = generate_keys()
+        rows = get_test_box_data(1, 100)[0]
+
+        # act
+        with mock.patch("src.crypto.MIN_ROWS_PER_CHUNK", 10):
+            sealed_rows = encrypt_data_rows(rows, public_key, number_of_workers)
+            hybrid_rows, session_key = encrypt_data_rows_hybrid(rows, public_key, number_of_workers)
+            results = [decrypt_result(sealed_rows, private_key, number_of_workers),
+                       decrypt_result_hybrid(hybrid_rows, private_key, [session_key], number_of_workers)]
+
+        # assert
+        self.assertEqual(results, [rows, rows])
+
+    @data(1, 3)
+    def test_sorted_result_without_dummies(self, number_of_workers):
+        # arrange
+        private_key, public_key = generate_keys()
+        rows = get_test_box_data(1, 100)[0]
+        dummies = [[DUMMY] + row[1:] for row in rows[:20]]
+        encrypted_rows, session_key = encrypt_data_rows_hybrid(rows + dummies, public_key)
+        shuffle(encrypted_rows)
+
+        # act
+        with mock.patch("src.crypto.MIN_ROWS_PER_CHUNK", 10):
+            result = decrypt_sorted_result(encrypted_rows, private_key, [session_key], number_of_workers)
+
+        # assert
+        self.assertEqual(sorted(map(str, result)), sorted(map(str, rows)))
+        self.assertEqual(list(map(itemgetter(1), result)), sorted(map(itemgetter(1), rows)))
+
+
+class RowCodecTest(unittest.TestCase):
+
+    def test_rows_are_decoded_with_their_types(self):
+        # arrange
+        codec = RowCodec(get_test_attribute_trees())
+        rows = [[2, "66:76", "1:2", 1.0], [DUMMY, "1:119", "", -3.5], [7, "", "2", 2 ** 40, 1e300, 0.1, -40000],
+                [1, "unknown label", "*", float("nan")], [1, None, ("a", 1), 2 ** 70], list(range(300))]
+
+        # act
+        decoded_rows = [RowCodec(get_test_attribute_trees()).decode(codec.encode(row)) for row in rows]
+
+        # assert
+        self.assertEqual(list(map(repr, decoded_rows)), list(map(repr, rows)))
+        for decoded_row, row in zip(decoded_rows, rows):
+            self.assertEqual(list(map(type, decoded_row)), list(map(type, row)))
+
+    def test_rows_are_smaller_than_pickled_rows(self):
+        codec = RowCodec(get_test_attribute_trees())
+        rows = [[row[0], "66:76", "1:2", row[3]] for row in get_test_box_data(1, 20)[0]]
+
+        self.assertLess(sum(len(codec.encode(row)) for row in rows), sum(len(pickle.dumps(row)) for row in rows) / 2)
+
+    def test_dummy_rows_have_the_length_of_real_rows(self):
+        # arrange
+        _, public_key = generate_keys()
+        codec = RowCodec(get_test_attribute_trees())
+        real_rows = [[1, "66:76", "1:2", 0.0, 14.0, 0, 0, 1.0, 0.0, 1.0, 0.0, 0, 1, 7.0, 1.0, 4.0, 5.0, 1.0, 0.0, 0.0],
+                     ["*", "1:119", "1", 0.0, 16.0, 0, 0, 1.0, 0.0, 0.0, 1.0, 0, 1, "", "", 4.0, 7.0, 3.0, 0.0, 0.0],
+                     [25, "*", "*", 5.0, 42.0, 1, 1, "", "", "", "", 1, 0, 10.0, 0.0, 3.0, 40.0, 6.0, 1.0, 6.0]]
+        rows = real_rows + Central._generate_dummies(5)
+
+        # act
+        sealed_rows = encrypt_data_rows(rows, public_key, codec=codec)
+        hybrid_rows, _ = encrypt_data_rows_hybrid(rows, public_key, codec=codec)
+
+        # assert
+        self.assertEqual(len({len(row) for row in sealed_rows}), 1)
+        self.assertEqual(len({len(row) for row in hybrid_rows}), 1)
+
+    def test_codec_is_used_for_encryption(self):
+        private_key, public_key = generate_keys()
+        codec = RowCodec(get_test_attribute_trees())
+        rows = get_test_box_data(1, 20)[0]
+
+        encrypted_rows, session_key = encrypt_data_rows_hybrid(rows, public_key, codec=codec)
+
+        self.assertEqual(decrypt_result_hybrid(encrypted_rows, private_key, [session_key], codec=codec), rows)
+        self.assertEqual(decrypt_result(encrypt_data_rows(rows, public_key, codec=codec), private_key, codec=codec), rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
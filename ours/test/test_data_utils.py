@@ -0,0 +1,18 @@
+import unittest
+
+from src.data_utils import aggregate_rows, expand_rows
+
+
+class RowAggregationTest(unittest.TestCase):
+
+    def test_aggregate_rows(self):
+        rows = [[1, "1:76", 2.0], [1, "1:76", 2], [1, "1:76", 2.0], [3, "*", 2.0]]
+
+        weighted_rows = aggregate_rows(rows)
+
+        self.assertEqual(list(map(repr, weighted_rows)), list(map(repr, [[1, "1:76", 2.0, 2], [1, "1:76", 2, 1], [3, "*", 2.0, 1]])))
+        self.assertEqual(sorted(map(repr, expand_rows(weighted_rows))), sorted(map(repr, rows)))
+
+
+if __name__ == '__main__':
+    unittest.main()
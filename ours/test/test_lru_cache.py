@@ -0,0 +1,50 @@
+import time
+import unittest
+
+from src.lru_cache import LruCache
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_values_are_evicted(self):
+        # arrange
+        cache = LruCache(max_bytes=30)
+        for key in ("a", "b", "c"):
+            cache.put(key, key.upper(), 10)
+
+        # act
+        cache.get("a")
+        cache.put("d", "D", 10)
+
+        # assert
+        self.assertEqual([cache.get(key) for key in ("a", "b", "c", "d")], ["A", None, "C", "D"])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions, cache.number_of_bytes), (4, 1, 1, 30))
+
+    def test_values_larger_than_the_cache_are_not_kept(self):
+        cache = LruCache(max_bytes=10)
+        cache.put("a", "A", 5)
+
+        cache.put("b", "B", 11)
+
+        self.assertEqual((cache.get("a"), cache.get("b"), len(cache)), ("A", None, 1))
+
+    def test_removed_values_free_their_bytes(self):
+        cache = LruCache(max_bytes=100)
+        for version in range(3):
+            cache.put(("rows", version), version, 20)
+
+        cache.remove_if(lambda key: key[1] != 2)
+
+        self.assertEqual((len(cache), cache.number_of_bytes, cache.get(("rows", 2))), (1, 20, 2))
+
+    def test_values_older_than_the_time_to_live_are_dropped(self):
+        cache = LruCache(max_bytes=100, ttl=0.01)
+        cache.put("a", "A", 10)
+
+        time.sleep(0.02)
+
+        self.assertEqual((cache.get("a"), len(cache), cache.number_of_bytes, cache.misses), (None, 0, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
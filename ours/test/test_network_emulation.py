@@ -0,0 +1,59 @@
+import threading
+import time
+import unittest
+
+from src.communication import InProcessTransport
+from src.motion import Party
+from src.network_emulation import LinkProfile, NetworkEmulation, EmulatedTransport
+
+
+class NetworkEmulationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.parties = [Party(0, "127.0.0.1", 8442, 9442), Party(1, "127.0.0.1", 8443, 9443)]
+        self.transport = InProcessTransport()
+
+    def test_messages_are_delayed_and_ordered(self):
+        # arrange
+        emulation = NetworkEmulation(LinkProfile(rtt=0.1, jitter=0.02), seed=1)
+        emulated_transport = EmulatedTransport(self.transport, emulation, 0, self.parties)
+
+        # act
+        start = time.perf_counter()
+        for i in range(5):
+            emulated_transport.send_data_to_other_party({"i": i}, "127.0.0.1", 8443)
+        sending_time = time.perf_counter() - start
+        received = [self.transport.receive_data("127.0.0.1", 8443)["i"] for _ in range(5)]
+        receiving_time = time.perf_counter() - start
+
+        # assert
+        self.assertLess(sending_time, 0.03)
+        self.assertGreaterEqual(receiving_time, 0.03)
+        self.assertEqual(received, list(range(5)))
+
+    def test_bandwidth_limits_throughput(self):
+        # arrange
+        emulation = NetworkEmulation(LinkProfile(bandwidth=1000 * 1000))
+        emulated_transport = EmulatedTransport(self.transport, emulation, 1, self.parties)
+        receiver = threading.Thread(target=lambda: [self.transport.receive_data("127.0.0.1", 8442) for _ in range(2)])
+
+        # act
+        start = time.perf_counter()
+        receiver.start()
+        for _ in range(2):
+            emulated_transport.send_data_to_other_party({"payload": b"x" * 100000}, "127.0.0.1", 8442)
+        receiver.join()
+
+        # assert
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+    def test_link_profiles(self):
+        emulation = NetworkEmulation(LinkProfile(rtt=0.02), {(0, 1): LinkProfile(rtt=0.08)})
+
+        self.assertEqual(emulation.one_way_latency(0, 1), 0.04)
+        self.assertEqual(emulation.one_way_latency(1, 0), 0.01)
+        self.assertEqual(emulation.max_rtt(), 0.08)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import threading
+import unittest
+from random import Random
+
+from ddt import ddt, data
+
+import numpy as np
+
+from src.aggregation import grouped_sums_gt_k, ZERO_MASK_VALUE, secure_sum_bit_width
+from src.algorithm_utils import AlgorithmRunner
+from src.local_motion import LocalMotion
+from src.secret_sharing import SecretSharingBackend, CallStatistics, format_statistics, share_type
+from test.testdata import get_test_box_data, get_test_attribute_trees, TEST_CATEGORIES
+
+TEST_K = 5
+
+
+def perform_calls(backend: SecretSharingBackend, parties, all_inputs, k: int, use_sessions: bool, bit_width=None):
+    """
+    Let all parties perform the calls for the given inputs concurrently, returns the results per party.
+    """
+    results = {party_id: [] for party_id, _, _ in parties}
+
+    def run_party(party_id: int):
+        if use_sessions:
+            session = backend.open_session(parties, party_id)
+            session.preprocess(0, 2)
+            for inputs in all_inputs[party_id]:
+                results[party_id].append(session.perform_arithmetic_then_bool_with_groups(inputs, k if party_id == 0 else 0, bit_width))
+            session.close()
+        else:
+            for inputs in all_inputs[party_id]:
+                results[party_id].append(backend.perform_arithmetic_then_bool_with_groups(parties, party_id, inputs, k if party_id == 0 else 0, bit_width))
+
+    threads = [threading.Thread(target=run_party, args=(party_id,)) for party_id, _, _ in parties]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+@ddt
+class SecretSharingBackendTest(unittest.TestCase):
+
+    @data((True, True), (True, False), (False, True), (False, False))
+    def test_results_equal_plain_computation(self, in_process_and_use_sessions):
+        # arrange
+        in_process, use_sessions = in_process_and_use_sessions
+        backend = SecretSharingBackend(in_process=in_process)
+        parties = [(i, "127.0.0.1", 7450 + i) for i in range(3)]
+        random = Random(42)
+        shapes = [[1], [2, 3], [4]]
+        all_inputs = {party_id: [[[random.randint(0, 4) for _ in range(size)] for size in shape] for shape in shapes]
+                      for party_id, _, _ in parties}
+
+        # act
+        results = perform_calls(backend, parties, all_inputs, TEST_K, use_sessions)
+
+        # assert
+        for call in range(len(shapes)):
+            summed_inputs = [[sum(values) for values in zip(*groups)] for groups in zip(*(all_inputs[p][call] for p in all_inputs))]
+            expected = grouped_sums_gt_k(summed_inputs, TEST_K)
+            for party_id in results:
+                self.assertEqual(results[party_id][call], expected)
+
+    @data(None, 4, 8, 12, 20)
+    def test_results_with_bit_width(self, bit_width):
+        # arrange
+        backend = SecretSharingBackend(in_process=True)
+        parties = [(i, "127.0.0.1", 7450 + i) for i in range(3)]
+        all_inputs = {0: [[[0], [1, 4], [5, 0]]], 1: [[[0], [2, 0], [5, 0]]], 2: [[[0], [0, 1], [5, 0]]]}
+
+        # act
+        results = perform_calls(backend, parties, all_inputs, TEST_K, False, bit_width)
+
+        # assert
+        for party_id in results:
+            self.assertEqual(results[party_id][0], [[ZERO_MASK_VALUE], [0, 0], [15, ZERO_MASK_VALUE]])
+
+    def test_share_type(self):
+        self.assertEqual(share_type(None), np.uint64)
+        self.assertEqual(share_type(8), np.uint8)
+        self.assertEqual(share_type(12), np.uint16)
+        self.assertEqual(share_type(20), np.uint32)
+        self.assertEqual(share_type(33), np.uint64)
+
+    def test_secure_sum_bit_width(self):
+        self.assertEqual(secure_sum_bit_width(3, 800, 5), 12)
+        self.assertEqual(secure_sum_bit_width(2, 1, 5), 3)
+        with self.assertRaises(ValueError):
+            secure_sum_bit_width(2, ZERO_MASK_VALUE, 5)
+
+    def test_zero_mask_value(self):
+        self.assertEqual(SecretSharingBackend().get_zero_mask_value(), ZERO_MASK_VALUE)
+
+    def test_statistics_are_recorded(self):
+        # arrange
+        backend = SecretSharingBackend(in_process=True)
+        parties = [(i, "127.0.0.1", 7450 + i) for i in range(2)]
+
+        # act
+        perform_calls(backend, parties, {0: [[[1, 2]]], 1: [[[3, 4]]]}, TEST_K, False)
+
+        # assert
+        self.assertEqual(len(backend.statistics[0]), 1)
+        self.assertEqual(backend.statistics[0][0].messages_sent, 2)  # share and results
+        self.assertEqual(backend.statistics[1][0].messages_sent, 2)  # share and share sum
+        self.assertEqual(backend.statistics[1][0].bytes_received, 2 * 2 * 8)
+
+    def test_statistics_are_formatted_like_motion(self):
+        call_statistics = CallStatistics()
+        call_statistics.preprocessing = 0.5
+        call_statistics.circuit_evaluation = 1.25
+        call_statistics.bytes_sent = 1024 ** 2
+        call_statistics.messages_sent = 7
+
+        lines = format_statistics([call_statistics]).split("\n")
+
+        # the line offsets parsed by eval/eval.py
+        self.assertEqual(len(lines), 31)
+        self.assertTrue(lines[21].startswith("Preprocessing Total"))
+        self.assertEqual(float(lines[21].split()[2]), 500.0)
+        self.assertTrue(lines[25].startswith("Circuit Evaluation"))
+        self.assertEqual(float(lines[25].split()[2]), 1250.0)
+        self.assertEqual(lines[28].split()[1], "1.000")
+        self.assertEqual(int(lines[28].split()[4]), 7)
+        self.assertEqual(lines[30], lines[0])
+
+    def test_protocol_result_equals_local_motion_result(self):
+        attribute_trees = get_test_attribute_trees()
+        box_data = get_test_box_data(3)
+
+        results = [sorted(map(str, AlgorithmRunner(backend).run_algorithm(attribute_trees, box_data, TEST_CATEGORIES, TEST_K, [])))
+                   for backend in (LocalMotion(), SecretSharingBackend(in_process=True))]
+
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+
+from ddt import ddt, data
+
+from src.data_utils import read_csv_data
+from src.qid_hierarchy_node import NumericalQidHierarchyNode, CategoricalQidHierarchyNode
+from src.snapshot import write_snapshot, read_snapshot, read_data, snapshot_path, verify_snapshot, read_leaf_codes, \
+    snapshot_metadata, read_data_leaf_codes
+
+TEST_CSV = """Center,Age,Sex,Score,Note
+1,92,2,3.0,a
+1,87,2,,b
+2,45,1,1.5,
+2,61,1,7,longer note
+3,?,1,2.0,c
+3,70,2,0.0,d
+"""
+
+# the types and string lengths change after the first rows
+CHANGING_TYPES_CSV = """Center,Age,Sex,Score,Note
+1,92,f,3.0,a
+1,87,f,2.5,b
+2,45,m,1.5,c
+2,61,m,1.0,d
+3,?,m,2.0,?
+3,70,d,7,ee
+4,1_0,m,nan,longer note
+4,33,m,,1
+5,0.5,f,-inf,2.0
+"""
+
+
+@ddt
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data_path = os.path.join(self.directory.name, "data.csv")
+        with open(self.data_path, "w") as f:
+            f.write(TEST_CSV)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_rows_equal_csv_rows(self):
+        # arrange
+        categories, data = read_csv_data(self.data_path)
+
+        # act
+        snapshot_categories, snapshot_data = read_snapshot(write_snapshot(self.data_path))
+
+        # assert
+        self.assertEqual(snapshot_categories, categories)
+        self.assertEqual(repr(snapshot_data), repr(data))  # including the types
+
+    @data((2, 1), (3, 2), (100, 100))
+    def test_rows_with_changing_types_equal_csv_rows(self, sizes):
+        # arrange
+        chunk_size, sample_size = sizes
+        with open(self.data_path, "w") as f:
+            f.write(CHANGING_TYPES_CSV)
+        categories, data = read_csv_data(self.data_path)
+
+        # act
+        snapshot_categories, snapshot_data = read_snapshot(write_snapshot(self.data_path, chunk_size=chunk_size, sample_size=sample_size))
+
+        # assert
+        self.assertEqual(snapshot_categories, categories)
+        self.assertEqual(repr(snapshot_data), repr(data))
+
+    def test_dropped_rows_are_counted(self):
+        with open(self.data_path, "w") as f:
+            f.write(CHANGING_TYPES_CSV)
+
+        metadata = snapshot_metadata(write_snapshot(self.data_path, chunk_size=2))
+
+        self.assertEqual((metadata["number_of_rows"], metadata["number_of_dropped_rows"]), (8, 1))  # the first row is skipped
+        self.assertEqual(metadata["missing_values"], {"Age": 1, "Note": 1})
+
+    def test_qid_columns_are_stored_as_leaf_codes(self):
+        # arrange
+        age_tree = NumericalQidHierarchyNode(1, 100)
+        NumericalQidHierarchyNode(1, 50, parent=age_tree)
+        NumericalQidHierarchyNode(51, 100, parent=age_tree)
+        sex_tree = CategoricalQidHierarchyNode("*")
+        for sex in ("m", "f"):
+            CategoricalQidHierarchyNode(sex, parent=sex_tree)
+        with open(self.data_path, "w") as f:
+            f.write(CHANGING_TYPES_CSV)
+
+        # act
+        path = write_snapshot(self.data_path, {1: age_tree, 2: sex_tree}, chunk_size=3)
+
+        # assert
+        labels, codes = read_leaf_codes(path, 1)
+        self.assertEqual(labels, ["1:50", "51:100"])
+        self.assertEqual(codes.tolist(), [1, 0, 1, 1, 0, 0, -1])  # 0.5 is not covered by a leaf
+        self.assertEqual(read_leaf_codes(path, 2, row_indices=[2, 3])[1].tolist(), [0, -1])
+
+    def test_leaf_codes_of_partitions_are_read(self):
+        # arrange
+        sex_tree = CategoricalQidHierarchyNode("*")
+        for sex in (1, 2):
+            CategoricalQidHierarchyNode(sex, parent=sex_tree)
+        self.assertEqual(read_data_leaf_codes(self.data_path), {})  # no snapshot
+
+        # act
+        write_snapshot(self.data_path, {2: sex_tree})
+        leaf_codes = [read_data_leaf_codes(self.data_path, (index, 2)) for index in range(2)]
+
+        # assert
+        self.assertEqual([(labels, codes.tolist()) for labels, codes in (codes_of_partition[2] for codes_of_partition in leaf_codes)],
+                         [([1, 2], [1, 0]), ([1, 2], [0, 1])])
+
+    def test_partitions_are_read(self):
+        write_snapshot(self.data_path)
+        _, data = read_csv_data(self.data_path)
+
+        partitions = [read_data(self.data_path, (index, 2))[1] for index in range(2)]
+
+        self.assertEqual(partitions, [data[:2], data[2:4]])
+
+    def test_row_ranges_and_row_indices_are_read(self):
+        # arrange
+        _, data = read_csv_data(self.data_path)
+        selections = [{"row_range": (1, 4)}, {"row_indices": [3, 0, 2]}]
+        csv_rows = [read_data(self.data_path, **selection)[1] for selection in selections]
+        write_snapshot(self.data_path)
+
+        # act
+        snapshot_rows = [read_data(self.data_path, **selection)[1] for selection in selections]
+
+        # assert
+        self.assertEqual(csv_rows, [data[1:4], [data[3], data[0], data[2]]])
+        self.assertEqual(repr(snapshot_rows), repr(csv_rows))
+        with self.assertRaises(ValueError):
+            read_data(self.data_path, (0, 2), row_range=(0, 1))
+
+    def test_corrupted_snapshot_is_rejected(self):
+        path = write_snapshot(self.data_path)
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\x01")
+
+        with self.assertRaises(ValueError):
+            read_snapshot(path)
+
+    def test_corruption_keeping_size_and_modification_time_is_detected_by_verification(self):
+        # arrange
+        path = write_snapshot(self.data_path)
+        stat = os.stat(path)
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\x01")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        # act
+        read_snapshot(path)  # the cheap check of each load does not hash the snapshot
+
+        # assert
+        with self.assertRaises(ValueError):
+            verify_snapshot(path)
+
+    def test_outdated_snapshot_is_not_used(self):
+        # arrange
+        write_snapshot(self.data_path)
+        with open(self.data_path, "a") as f:
+            f.write("4,33,2,1.0,e\n")
+
+        # act
+        _, data = read_data(self.data_path)
+
+        # assert
+        self.assertEqual(data[-1], [4, 33, 2, 1.0, "e"])
+        self.assertTrue(os.path.exists(snapshot_path(self.data_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
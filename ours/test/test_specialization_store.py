@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from ddt import ddt, data, unpack
+
+from src.qid_hierarchy_node import NumericalQidHierarchyNode
+from src.specialization_store import SpecializationStore
+from test.testdata import get_test_attribute_trees
+
+SPECIALIZATION = [(1, "1:119"), (2, "1:2"), (1, "1:76")]
+
+
+@ddt
+class SpecializationStoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.store = SpecializationStore()
+        self.store.add(5, [], get_test_attribute_trees(), SPECIALIZATION)
+
+    @data(
+        [5, [], None, SPECIALIZATION],
+        [10, [], None, SPECIALIZATION],  # the initial round undoes refinements for larger k
+        [5, [], [1], [(1, "1:119"), (1, "1:76")]],
+        [5, [["Age", ">", "30"]], None, None],
+    )
+    @unpack
+    def test_related_specialization(self, k, criteria, qids, expected_specialization):
+        qid_attribute_trees = {qid: tree for qid, tree in get_test_attribute_trees().items() if qids is None or qid in qids}
+
+        self.assertEqual(self.store.related_specialization(k, criteria, qid_attribute_trees), expected_specialization)
+
+    def test_requests_with_further_qids_or_other_hierarchies_are_not_related(self):
+        # arrange
+        store = SpecializationStore()
+        store.add(5, [], {1: get_test_attribute_trees()[1]}, [(1, "1:119")])
+        other_trees = get_test_attribute_trees()
+        other_trees[2] = NumericalQidHierarchyNode(1, 3)
+
+        # act
+        results = [store.related_specialization(5, [], trees) for trees in (get_test_attribute_trees(), other_trees)]
+
+        # assert
+        self.assertEqual(results, [None, None])
+        self.assertEqual(self.store.related_specialization(5, [], other_trees), None)
+
+    def test_specializations_of_requests_with_at_least_the_same_k_are_preferred(self):
+        self.store.add(3, [], get_test_attribute_trees(), SPECIALIZATION + [(2, "1:1")])
+        self.store.add(8, [], get_test_attribute_trees(), SPECIALIZATION[:1])
+
+        self.assertEqual(self.store.related_specialization(5, [], get_test_attribute_trees()), SPECIALIZATION)
+
+    def test_specializations_are_kept_in_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "specializations.json")
+            SpecializationStore(path).add(5, [["Age", ">", "30"]], get_test_attribute_trees(), SPECIALIZATION)
+
+            specialization = SpecializationStore(path).related_specialization(5, [["Age", ">", "30"]], get_test_attribute_trees())
+
+        self.assertEqual(specialization, SPECIALIZATION)
+
+
+if __name__ == '__main__':
+    unittest.main()
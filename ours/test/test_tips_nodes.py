@@ -0,0 +1,182 @@
+import unittest
+
+from src.counter_information_data import counter_groups_from_counter_information_data, NodeCounterType
+from src.qid_hierarchy_node import NumericalQidHierarchyNode
+from src.tips_nodes import setup_tips_root_node, setup_tips_link_heads, perform_refinement, \
+    extract_counter_information_data_from_tips_nodes, counter_groups_upper_bound, next_round_counter_groups_upper_bound, \
+    determine_counters, replay_refinements, append_records_to_link_heads, leaf_nodes_from_link_heads, \
+    longest_valid_specialization, specialization_for_qids
+from test.testdata import get_test_data, get_test_attribute_trees, get_test_age_tree
+
+
+class TipsNodesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.qid_attributes = get_test_attribute_trees()
+        self.tips_root = setup_tips_root_node(get_test_data(), self.qid_attributes)
+
+    @staticmethod
+    def number_of_groups_and_counters(tips_nodes):
+        counter_groups = counter_groups_from_counter_information_data(extract_counter_information_data_from_tips_nodes(tips_nodes))
+        return len([g for g in counter_groups if g]), sum(len(g) for g in counter_groups)
+
+    def test_counter_groups_upper_bound_for_root(self):
+        self.assertEqual(counter_groups_upper_bound([self.tips_root]), self.number_of_groups_and_counters([self.tips_root]))
+
+    def test_next_round_counter_groups_upper_bound(self):
+        # arrange
+        link_heads = setup_tips_link_heads(self.tips_root, self.qid_attributes)
+        link_heads, _ = perform_refinement(link_heads, 1, "1:119")
+
+        # act
+        max_groups, max_counters = next_round_counter_groups_upper_bound(link_heads)
+
+        # assert
+        for attr_index, label in [(1, "1:76"), (1, "77:119"), (2, "1:2")]:
+            refined_link_heads = setup_tips_link_heads(self.tips_root, self.qid_attributes)
+            refined_link_heads, _ = perform_refinement(refined_link_heads, 1, "1:119")
+            _, new_nodes = perform_refinement(refined_link_heads, attr_index, label)
+            number_of_groups, number_of_counters = self.number_of_groups_and_counters(new_nodes)
+
+            self.assertLessEqual(number_of_groups, max_groups)
+            self.assertLessEqual(number_of_counters, max_counters)
+
+    def test_appended_records_are_counted_like_records_of_the_root(self):
+        # arrange
+        specialization = [(1, "1:119"), (2, "1:2"), (1, "1:76")]
+        rows = get_test_data()
+        new_rows = [[1, 30, 1, 2.0], [2, 31, 1, 1.0], [3, 90, 2, 0.0], [1, 150, 1, 2.0]]  # 150 is not covered by the refined age labels
+        link_heads = replay_refinements(setup_tips_link_heads(setup_tips_root_node(rows[:], self.qid_attributes), self.qid_attributes),
+                                        specialization)
+        root_with_all_rows = setup_tips_root_node(rows + new_rows, self.qid_attributes)
+
+        # act
+        changed_nodes = append_records_to_link_heads(link_heads, new_rows)
+
+        # assert
+        expected_link_heads = replay_refinements(setup_tips_link_heads(root_with_all_rows, self.qid_attributes), specialization)
+        self.assertEqual(extract_counter_information_data_from_tips_nodes(leaf_nodes_from_link_heads(link_heads)),
+                         extract_counter_information_data_from_tips_nodes(leaf_nodes_from_link_heads(expected_link_heads)))
+        self.assertEqual(sum(len(node.raw_records) for node in leaf_nodes_from_link_heads(link_heads)), len(rows) + len(new_rows) - 1)
+        self.assertEqual(len(changed_nodes), 2)
+
+    def test_unrefined_attributes_do_not_drop_appended_records(self):
+        link_heads = setup_tips_link_heads(setup_tips_root_node([], self.qid_attributes), self.qid_attributes)
+
+        append_records_to_link_heads(link_heads, [[1, 150, 1, 2.0]])
+
+        self.assertEqual(leaf_nodes_from_link_heads(link_heads)[0].number_of_records(), 1)
+
+    def test_specialization_for_removed_qids_keeps_the_refinements_of_the_other_qids(self):
+        specialization = [(1, "1:119"), (2, "1:2"), (1, "1:76"), (1, "unknown")]
+
+        result = specialization_for_qids(specialization, {1: self.qid_attributes[1]})
+
+        self.assertEqual(result, [(1, "1:119"), (1, "1:76")])
+
+    def test_specialization_for_qids_skips_labels_outside_the_generalization(self):
+        specialization = [(1, "1:119"), (1, "1:76"), (1, "1:119")]  # 1:119 is no longer part of the generalization
+
+        result = specialization_for_qids(specialization, self.qid_attributes)
+
+        self.assertEqual(result, [(1, "1:119"), (1, "1:76")])
+
+
+class LongestValidSpecializationTest(unittest.TestCase):
+    K = 5
+    SPECIALIZATION = [(1, "1:119"), (2, "1:2")]
+
+    def longest_valid_specialization(self, counters_by_labels):
+        """
+        Replays the specialization in the central unit and sets the node counters of the leaf nodes given by their age
+        and sex labels.
+        """
+        qid_attributes = get_test_attribute_trees()
+        link_heads = replay_refinements(setup_tips_link_heads(setup_tips_root_node(None, qid_attributes), qid_attributes), self.SPECIALIZATION)
+        leaf_nodes = leaf_nodes_from_link_heads(link_heads)
+        for node in leaf_nodes:
+            labels = node.generalization_label_for_attribute(1), node.generalization_label_for_attribute(2)
+            node.set_counter_values((counters_by_labels.get(labels, (NodeCounterType.Valid, self.K)), node.get_child_counters()))
+        return longest_valid_specialization(leaf_nodes, self.SPECIALIZATION, self.K)
+
+    def test_valid_leaf_nodes_keep_all_refinements(self):
+        self.assertEqual(self.longest_valid_specialization({("1:76", "1"): (NodeCounterType.Empty, 0)}), 2)
+
+    def test_union_with_at_least_k_records_is_valid(self):
+        result = self.longest_valid_specialization({("1:76", "1"): (NodeCounterType.SmallerThanK, 0),
+                                                    ("1:76", "2"): (NodeCounterType.Valid, self.K - 1)})
+
+        self.assertEqual(result, 1)
+
+    def test_union_with_possibly_less_than_k_records_is_invalid(self):
+        result = self.longest_valid_specialization({("1:76", "1"): (NodeCounterType.SmallerThanK, 0),
+                                                    ("1:76", "2"): (NodeCounterType.Empty, 0)})
+
+        self.assertEqual(result, 0)
+
+
+class DetermineCountersTest(unittest.TestCase):
+    AGE = 1
+    SEX = 2
+
+    @staticmethod
+    def central_root(qid_attributes, node_counter, child_counter_infos):
+        """
+        Returns the TIPS root of the central unit with the given counters, child counters are given per attribute in
+        hierarchy order.
+        """
+        root = setup_tips_root_node(None, qid_attributes)
+        child_counters = root.get_child_counters()
+        for attr_index, infos in child_counter_infos.items():
+            child_counters[attr_index] = dict(zip(child_counters[attr_index], infos))
+        root.set_counter_values((node_counter, child_counters))
+        return root
+
+    def refine_and_determine(self, qid_attributes, root, attr_index, label):
+        link_heads = setup_tips_link_heads(root, qid_attributes)
+        refined_nodes = list(link_heads[attr_index][label])
+        _, new_nodes = perform_refinement(link_heads, attr_index, label)
+        counter_data = extract_counter_information_data_from_tips_nodes(new_nodes)
+        return new_nodes, determine_counters(counter_data, refined_nodes, attr_index)
+
+    def test_empty_node_and_failed_parent_group(self):
+        # arrange
+        qid_attributes = get_test_attribute_trees()
+        root = self.central_root(qid_attributes, (NodeCounterType.Valid, 20), {
+            self.AGE: [(NodeCounterType.Valid, 20), (NodeCounterType.Empty, 0)],
+            self.SEX: [(NodeCounterType.SmallerThanK, 0), (NodeCounterType.SmallerThanK, 0)],
+        })
+
+        # act
+        (valid_node, empty_node), (counter_data, number_of_groups, number_of_counters) = \
+            self.refine_and_determine(qid_attributes, root, self.AGE, "1:119")
+
+        # assert
+        valid_child_counters = counter_data[valid_node.id][1]
+        self.assertTrue(all(c[0] == NodeCounterType.Undefined for c in valid_child_counters[self.AGE].values()))
+        self.assertTrue(all(c[0] == NodeCounterType.SmallerThanK for c in valid_child_counters[self.SEX].values()))
+        empty_child_counters = counter_data[empty_node.id][1]
+        self.assertTrue(all(c == (NodeCounterType.Empty, 0) for g in empty_child_counters.values() for c in g.values()))
+        self.assertEqual(number_of_groups, 3)
+        self.assertEqual(number_of_counters, 6)
+
+    def test_single_child(self):
+        # arrange
+        sex_root = NumericalQidHierarchyNode(min=1, max=2)
+        NumericalQidHierarchyNode(parent=sex_root, min=1, max=2)
+        qid_attributes = {self.AGE: get_test_age_tree(), self.SEX: sex_root}
+        root = self.central_root(qid_attributes, (NodeCounterType.Valid, 20), {
+            self.AGE: [(NodeCounterType.Valid, 12), (NodeCounterType.Valid, 8)],
+            self.SEX: [(NodeCounterType.Valid, 20)],
+        })
+
+        # act
+        (node_1_76, _), (counter_data, number_of_groups, _) = self.refine_and_determine(qid_attributes, root, self.AGE, "1:119")
+
+        # assert
+        self.assertEqual(list(counter_data[node_1_76.id][1][self.SEX].values()), [(NodeCounterType.Valid, 12)])
+        self.assertEqual(number_of_groups, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from random import Random
+from typing import List
+
+from src.constants import Data
+from src.qid_hierarchy_node import NumericalQidHierarchyNode
+
+
+TEST_CATEGORIES = ["Center", "Age", "Sex", "Score"]
+
+
+def get_test_data(number_of_rows: int = 300, seed: int = 42) -> Data:
+    rnd = Random(seed)
+    return [[rnd.randint(1, 8), rnd.randint(1, 119), rnd.randint(1, 2), float(rnd.randint(0, 6))] for _ in range(number_of_rows)]
+
+
+def get_test_box_data(number_of_boxes: int, number_of_rows: int = 300) -> List[Data]:
+    data = get_test_data(number_of_rows)
+    rows_per_box = len(data) // number_of_boxes
+    return [data[i * rows_per_box:(i + 1) * rows_per_box] for i in range(number_of_boxes)]
+
+
+def get_test_age_tree() -> NumericalQidHierarchyNode:
+    age_root = NumericalQidHierarchyNode(min=1, max=119)
+    age_0 = NumericalQidHierarchyNode(parent=age_root, min=1, max=76)
+    age_0_0 = NumericalQidHierarchyNode(parent=age_0, min=1, max=65)
+    age_0_1 = NumericalQidHierarchyNode(parent=age_0, min=66, max=76)
+    age_1 = NumericalQidHierarchyNode(parent=age_root, min=77, max=119)
+    age_1_0 = NumericalQidHierarchyNode(parent=age_1, min=77, max=82)
+    age_1_1 = NumericalQidHierarchyNode(parent=age_1, min=83, max=119)
+    return age_root
+
+
+def get_test_sex_tree() -> NumericalQidHierarchyNode:
+    sex_root = NumericalQidHierarchyNode(min=1, max=2)
+    sex_0 = NumericalQidHierarchyNode(parent=sex_root, min=1, max=1)
+    sex_1 = NumericalQidHierarchyNode(parent=sex_root, min=2, max=2)
+    return sex_root
+
+
+def get_test_center_tree() -> NumericalQidHierarchyNode:
+    center_root = NumericalQidHierarchyNode(min=1, max=8)
+    for minv, maxv in [(1, 4), (5, 8)]:
+        center_group = NumericalQidHierarchyNode(parent=center_root, min=minv, max=maxv)
+        for center in range(minv, maxv + 1):
+            NumericalQidHierarchyNode(parent=center_group, min=center, max=center)
+    return center_root
+
+
+def get_test_attribute_trees():
+    return {
+        1: get_test_age_tree(),
+        2: get_test_sex_tree()
+    }